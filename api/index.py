@@ -1,18 +1,16 @@
-from fastapi import FastAPI
-from fastapi.middleware.cors import CORSMiddleware
 import sys
 import os
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from app.main import app
-
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+# En Vercel cada arranque en frío importa este módulo: los routers y el cliente de Supabase
+# se cargan con la primera petición que los necesita. Los middlewares (CORS incluido) están
+# definidos una sola vez en app/main.py.
+os.environ.setdefault("CARGA_PEREZOSA", "1")
+# La función puede congelarse apenas responde: los ajustes de stock y ventas se aplican dentro
+# de la petición en vez de quedar en la cola de efectos (app/efectos.py)
+os.environ.setdefault("EFECTOS_EN_SEGUNDO_PLANO", "0")
+# Por lo mismo, sin libro de inventario: sus descuentos se envían a Supabase en un volcado periódico
+os.environ.setdefault("INVENTARIO_LIBRO", "0")
 
-app = app 
\ No newline at end of file
+from app.main import app
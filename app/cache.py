@@ -0,0 +1,96 @@
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+CACHE_MAX_ENTRADAS = int(os.getenv("CACHE_MAX_ENTRADAS", "2000"))
+CACHE_TTL = float(os.getenv("CACHE_TTL", "30"))
+
+class CacheEntidades:
+    """
+    Caché de lectura (read-through) para filas individuales, indexada por (tabla, clave primaria).
+    Desaloja por LRU al superar `max_entradas` y por antigüedad al superar `ttl` segundos.
+    Las claves secundarias (por ejemplo el rut) se registran como alias que apuntan a la
+    clave primaria y se eliminan junto con la entrada.
+
+    El TTL acota cuánto tiempo puede verse un dato modificado por otra instancia de la API;
+    las escrituras hechas por esta instancia invalidan la entrada de inmediato.
+    """
+
+    def __init__(self, max_entradas: int = CACHE_MAX_ENTRADAS, ttl: float = CACHE_TTL):
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self._entradas: "OrderedDict[Tuple[str, Hashable], Tuple[float, Dict, Tuple]]" = OrderedDict()
+        self._alias: Dict[Tuple[str, str, Hashable], Hashable] = {}
+        self.aciertos = 0
+        self.fallos = 0
+        self.expulsiones = 0
+        self.invalidaciones = 0
+
+    def obtener(self, tabla: str, pk: Hashable) -> Optional[Dict]:
+        clave = (tabla, pk)
+        entrada = self._entradas.get(clave)
+        if entrada is None:
+            self.fallos += 1
+            return None
+
+        expira, valor, _ = entrada
+        if expira < time.monotonic():
+            self._eliminar(clave)
+            self.fallos += 1
+            return None
+
+        self._entradas.move_to_end(clave)
+        self.aciertos += 1
+        return dict(valor)
+
+    def obtener_por_alias(self, tabla: str, campo: str, valor: Hashable) -> Optional[Dict]:
+        pk = self._alias.get((tabla, campo, valor))
+        if pk is None:
+            self.fallos += 1
+            return None
+        return self.obtener(tabla, pk)
+
+    def guardar(self, tabla: str, pk: Hashable, valor: Dict, alias: Optional[Dict[str, Any]] = None):
+        clave = (tabla, pk)
+        if clave in self._entradas:
+            self._eliminar(clave)
+
+        claves_alias = tuple((tabla, campo, v) for campo, v in (alias or {}).items() if v is not None)
+        self._entradas[clave] = (time.monotonic() + self.ttl, dict(valor), claves_alias)
+        for clave_alias in claves_alias:
+            self._alias[clave_alias] = pk
+
+        while len(self._entradas) > self.max_entradas:
+            self._eliminar(next(iter(self._entradas)))
+            self.expulsiones += 1
+
+    def invalidar(self, tabla: str, pk: Hashable):
+        if (tabla, pk) in self._entradas:
+            self._eliminar((tabla, pk))
+            self.invalidaciones += 1
+
+    def limpiar(self):
+        self._entradas.clear()
+        self._alias.clear()
+
+    def _eliminar(self, clave: Tuple[str, Hashable]):
+        _, _, claves_alias = self._entradas.pop(clave)
+        for clave_alias in claves_alias:
+            if self._alias.get(clave_alias) == clave[1]:
+                del self._alias[clave_alias]
+
+    def estadisticas(self) -> Dict[str, Any]:
+        consultas = self.aciertos + self.fallos
+        return {
+            "entradas": len(self._entradas),
+            "max_entradas": self.max_entradas,
+            "ttl_segundos": self.ttl,
+            "aciertos": self.aciertos,
+            "fallos": self.fallos,
+            "tasa_aciertos": round(self.aciertos / consultas, 4) if consultas else 0.0,
+            "expulsiones": self.expulsiones,
+            "invalidaciones": self.invalidaciones,
+        }
+
+cache_entidades = CacheEntidades()
@@ -0,0 +1,179 @@
+import os
+import time
+import asyncio
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Pattern, Tuple
+from urllib.parse import parse_qsl, urlencode
+from starlette.routing import compile_path
+from app.etag import POLITICAS, versiones_tablas, tablas_de_peticion
+
+COALESCENCIA_VENTANA = float(os.getenv("COALESCENCIA_VENTANA", "1.0"))
+COALESCENCIA_MAX_ENTRADAS = int(os.getenv("COALESCENCIA_MAX_ENTRADAS", "1000"))
+
+# Rutas cuyas respuestas no dependen de quién las pide: las mismas de POLITICAS, con sus tablas.
+# Las que no tienen parámetros van primero para que `/x/literal` no caiga en `/x/{id}`.
+RUTAS_COALESCIBLES: List[Tuple[Pattern, str, Tuple[str, ...]]] = [
+    (compile_path(plantilla)[0], plantilla, tablas)
+    for plantilla, (_, tablas) in sorted(POLITICAS.items(), key=lambda item: "{" in item[0])
+]
+
+def clave_peticion(scope) -> str:
+    """Ruta concreta más los parámetros ordenados: `?b=2&a=1` y `?a=1&b=2` comparten respuesta."""
+    parametros = sorted(parse_qsl(scope["query_string"].decode("latin-1"), keep_blank_values=True))
+    return scope["path"] + "?" + urlencode(parametros)
+
+def resolver_ruta(path: str) -> Optional[Tuple[str, Tuple[str, ...]]]:
+    """
+    Plantilla y tablas de la ruta coalescible que corresponde a `path`, antes de enrutar.
+    Si el router termina eligiendo otra ruta, la respuesta no se comparte.
+    """
+    for expresion, plantilla, tablas in RUTAS_COALESCIBLES:
+        if expresion.match(path):
+            return plantilla, tablas
+    return None
+
+class Vuelo:
+    """Cálculo en curso (o recién terminado) de una respuesta compartida."""
+
+    __slots__ = ("futuro", "tablas", "secuencia", "expira")
+
+    def __init__(self, tablas: Tuple[str, ...], secuencia: int):
+        self.futuro: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.tablas = tablas
+        self.secuencia = secuencia
+        self.expira = float("inf")
+
+    def vigente(self) -> bool:
+        return self.expira >= time.monotonic() and versiones_tablas.vigente(self.tablas, self.secuencia)
+
+class Coalescedor:
+    """
+    Single-flight para GETs idénticos: la primera petición de una clave ejecuta el handler y
+    las que llegan mientras tanto esperan su respuesta en vez de repetir las llamadas a
+    Supabase. Una respuesta 200 se sigue entregando durante `ventana` segundos mientras no se
+    escriba ninguna de sus tablas. Las respuestas en streaming no se comparten: quienes
+    esperaban una ejecutan su propia petición.
+    """
+
+    def __init__(self, ventana: float = COALESCENCIA_VENTANA, max_entradas: int = COALESCENCIA_MAX_ENTRADAS):
+        self.ventana = ventana
+        self.max_entradas = max_entradas
+        self._vuelos: "OrderedDict[str, Vuelo]" = OrderedDict()
+        # Plantilla de ruta -> [ejecutadas, coalescidas, reutilizadas]
+        self.conteos: Dict[str, List[int]] = {}
+
+    def contar(self, ruta: str, indice: int):
+        conteos = self.conteos.setdefault(ruta, [0, 0, 0])
+        conteos[indice] += 1
+
+    def unirse(self, clave: str) -> Optional[Vuelo]:
+        """Devuelve el vuelo vigente para la clave, o None si la petición debe ejecutarse."""
+        vuelo = self._vuelos.get(clave)
+        if vuelo is None:
+            return None
+        if not vuelo.vigente():
+            del self._vuelos[clave]
+            return None
+        return vuelo
+
+    def despegar(self, clave: str, ruta: str, tablas: Tuple[str, ...]) -> Vuelo:
+        vuelo = self._vuelos[clave] = Vuelo(tablas, versiones_tablas.secuencia)
+        self._vuelos.move_to_end(clave)
+        while len(self._vuelos) > self.max_entradas:
+            self._vuelos.popitem(last=False)
+        self.contar(ruta, 0)
+        return vuelo
+
+    def aterrizar(self, clave: str, vuelo: Vuelo, resultado: Optional[Tuple[Dict, bytes, Any]]):
+        """Entrega el resultado a quienes esperan y lo deja en la ventana si es reutilizable."""
+        if not vuelo.futuro.done():
+            vuelo.futuro.set_result(resultado)
+        if resultado is not None and resultado[0]["status"] == 200 and self.ventana > 0:
+            vuelo.expira = time.monotonic() + self.ventana
+        elif self._vuelos.get(clave) is vuelo:
+            del self._vuelos[clave]
+
+    def limpiar(self):
+        self._vuelos.clear()
+
+    def totales(self) -> Dict[str, int]:
+        ejecutadas, coalescidas, reutilizadas = (sum(c[i] for c in self.conteos.values()) for i in range(3))
+        return {"ejecutadas": ejecutadas, "coalescidas": coalescidas, "reutilizadas": reutilizadas}
+
+    def estadisticas(self) -> Dict[str, Any]:
+        return {
+            "ventana_segundos": self.ventana,
+            "entradas": len(self._vuelos),
+            **self.totales(),
+            "por_ruta": {
+                ruta: {"ejecutadas": e, "coalescidas": c, "reutilizadas": r}
+                for ruta, (e, c, r) in sorted(self.conteos.items())
+            },
+        }
+
+coalescedor = Coalescedor()
+
+async def _reproducir(send, resultado: Tuple[Dict, bytes, Any]):
+    inicio, cuerpo, _ = resultado
+    # Copia de las cabeceras: los middlewares externos las modifican en cada respuesta
+    await send({**inicio, "headers": list(inicio.get("headers", []))})
+    await send({"type": "http.response.body", "body": cuerpo})
+
+class MiddlewareCoalescencia:
+    """
+    Middleware ASGI que aplica el Coalescedor a los GET de RUTAS_COALESCIBLES. Va dentro del
+    de ETags para compartir el cuerpo sin comprimir y que cada petición reciba su propio ETag,
+    304 o codificación.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "GET":
+            return await self.app(scope, receive, send)
+
+        coalescible = resolver_ruta(scope["path"])
+        if coalescible is None:
+            return await self.app(scope, receive, send)
+
+        plantilla, tablas = coalescible
+        clave = clave_peticion(scope)
+        vuelo = coalescedor.unirse(clave)
+        if vuelo is not None:
+            en_curso = not vuelo.futuro.done()
+            resultado = await asyncio.shield(vuelo.futuro)
+            if resultado is not None:
+                coalescedor.contar(plantilla, 1 if en_curso else 2)
+                # Para que métricas y ETags etiqueten la respuesta como si el handler se hubiera ejecutado
+                scope["route"] = resultado[2]
+                return await _reproducir(send, resultado)
+            # La respuesta compartida era un stream o la petición original falló o se canceló
+            coalescedor.contar(plantilla, 0)
+            return await self.app(scope, receive, send)
+
+        vuelo = coalescedor.despegar(clave, plantilla, tablas_de_peticion(tablas, scope["query_string"].decode("latin-1")))
+        pendiente = []
+        resultado: List[Optional[Tuple[Dict, bytes, Any]]] = [None]
+
+        async def enviar(mensaje):
+            if mensaje["type"] == "http.response.start":
+                pendiente.append(mensaje)
+                return
+            if not pendiente:
+                return await send(mensaje)
+
+            inicio = pendiente.pop()
+            ruta = scope.get("route")
+            if mensaje.get("more_body", False) or getattr(ruta, "path", None) != plantilla:
+                coalescedor.aterrizar(clave, vuelo, None)
+                await send(inicio)
+                return await send(mensaje)
+            resultado[0] = ({**inicio, "headers": list(inicio.get("headers", []))}, mensaje.get("body", b""), ruta)
+
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            coalescedor.aterrizar(clave, vuelo, resultado[0])
+        if resultado[0] is not None:
+            await _reproducir(send, resultado[0])
@@ -0,0 +1,210 @@
+import os
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli
+except ImportError:  # brotli es opcional; sin él solo se ofrece gzip
+    brotli = None
+
+COMPRESION_MINIMO = int(os.getenv("COMPRESION_MINIMO", "1024"))
+GZIP_NIVEL = int(os.getenv("GZIP_NIVEL", "6"))
+BROTLI_CALIDAD = int(os.getenv("BROTLI_CALIDAD", "5"))
+COMPRESION_CACHE_BYTES = int(os.getenv("COMPRESION_CACHE_BYTES", str(8 * 1024 * 1024)))
+
+TIPOS_COMPRIMIBLES = {"application/json", "application/x-ndjson", "text/csv", "text/plain", "text/html"}
+
+def codificaciones_disponibles() -> Tuple[str, ...]:
+    """En orden de preferencia ante un Accept-Encoding que acepta ambas por igual."""
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+def negociar(accept_encoding: Optional[str]) -> Optional[str]:
+    """Elige br o gzip según los valores q de Accept-Encoding; None si el cliente no acepta ninguna."""
+    if not accept_encoding:
+        return None
+
+    preferencias: Dict[str, float] = {}
+    for parte in accept_encoding.split(","):
+        nombre, _, parametros = parte.partition(";")
+        q = 1.0
+        parametros = parametros.strip()
+        if parametros.startswith("q="):
+            try:
+                q = float(parametros[2:])
+            except ValueError:
+                q = 0.0
+        preferencias[nombre.strip().lower()] = q
+
+    elegida, mejor = None, 0.0
+    for codificacion in codificaciones_disponibles():
+        q = preferencias.get(codificacion, preferencias.get("*", 0.0))
+        if q > mejor:
+            elegida, mejor = codificacion, q
+    return elegida
+
+class _CompresorBrotli:
+    def __init__(self):
+        self._compresor = brotli.Compressor(quality=BROTLI_CALIDAD)
+
+    def compress(self, datos: bytes) -> bytes:
+        return self._compresor.process(datos)
+
+    def flush(self) -> bytes:
+        return self._compresor.finish()
+
+def crear_compresor(codificacion: str):
+    """Compresor incremental con la interfaz de zlib (compress/flush)."""
+    if codificacion == "br":
+        return _CompresorBrotli()
+    return zlib.compressobj(GZIP_NIVEL, zlib.DEFLATED, 31)
+
+def comprimir(cuerpo: bytes, codificacion: str) -> bytes:
+    compresor = crear_compresor(codificacion)
+    return compresor.compress(cuerpo) + compresor.flush()
+
+class CacheCompresion:
+    """
+    Cuerpos ya comprimidos indexados por (ETag, codificación). Como el ETag es el hash del
+    cuerpo sin comprimir, una entrada nunca queda desactualizada y no hace falta invalidarla.
+    Solo se guarda una respuesta la segunda vez que se comprime (las que se piden una vez no
+    desplazan a las frecuentes) y el total se acota a `max_bytes` por LRU.
+    """
+
+    def __init__(self, max_bytes: int = COMPRESION_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._entradas: "OrderedDict[Tuple[str, str], bytes]" = OrderedDict()
+        self._vistas: "OrderedDict[Tuple[str, str], None]" = OrderedDict()
+        self.aciertos = 0
+        self.fallos = 0
+        self.bytes_originales = 0
+        self.bytes_enviados = 0
+
+    def comprimir(self, etag: str, codificacion: str, cuerpo: bytes) -> bytes:
+        clave = (etag, codificacion)
+        comprimido = self._entradas.get(clave)
+        if comprimido is not None:
+            self._entradas.move_to_end(clave)
+            self.aciertos += 1
+            return comprimido
+
+        self.fallos += 1
+        comprimido = comprimir(cuerpo, codificacion)
+        if clave in self._vistas:
+            del self._vistas[clave]
+            self._guardar(clave, comprimido)
+        else:
+            self._vistas[clave] = None
+            if len(self._vistas) > 4096:
+                self._vistas.popitem(last=False)
+        return comprimido
+
+    def _guardar(self, clave: Tuple[str, str], comprimido: bytes):
+        if len(comprimido) > self.max_bytes // 8:
+            return
+        self._entradas[clave] = comprimido
+        self.bytes += len(comprimido)
+        while self.bytes > self.max_bytes:
+            _, expulsado = self._entradas.popitem(last=False)
+            self.bytes -= len(expulsado)
+
+    def registrar(self, originales: int, enviados: int):
+        self.bytes_originales += originales
+        self.bytes_enviados += enviados
+
+    def limpiar(self):
+        self._entradas.clear()
+        self._vistas.clear()
+        self.bytes = 0
+
+    def estadisticas(self) -> Dict[str, Any]:
+        return {
+            "codificaciones": list(codificaciones_disponibles()),
+            "entradas": len(self._entradas),
+            "bytes": self.bytes,
+            "aciertos": self.aciertos,
+            "fallos": self.fallos,
+            "bytes_originales": self.bytes_originales,
+            "bytes_enviados": self.bytes_enviados,
+        }
+
+cache_compresion = CacheCompresion()
+
+def _comprimible(inicio: Dict, cabeceras: Headers) -> bool:
+    tipo = cabeceras.get("content-type", "").split(";")[0].strip()
+    return (
+        200 <= inicio["status"] < 300 and inicio["status"] != 204
+        and "content-encoding" not in cabeceras
+        and (tipo in TIPOS_COMPRIMIBLES or tipo.startswith("text/"))
+    )
+
+class MiddlewareCompresion:
+    """
+    Middleware ASGI que comprime con brotli o gzip (según Accept-Encoding) las respuestas de
+    texto de al menos COMPRESION_MINIMO bytes. Las respuestas con ETag pasan por CacheCompresion;
+    las respuestas en streaming se comprimen a medida que se escriben. El ETag de una respuesta
+    comprimida se vuelve débil (W/), como hace nginx, porque ya no es el mismo cuerpo byte a byte.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "HEAD":
+            return await self.app(scope, receive, send)
+
+        codificacion = negociar(Headers(scope=scope).get("accept-encoding"))
+        if codificacion is None:
+            return await self.app(scope, receive, send)
+
+        pendiente = []
+        estado: Dict[str, Any] = {"compresor": None}
+
+        async def enviar(mensaje):
+            if mensaje["type"] == "http.response.start":
+                pendiente.append(mensaje)
+                return
+
+            cuerpo = mensaje.get("body", b"")
+            mas = mensaje.get("more_body", False)
+            compresor = estado["compresor"]
+            if not pendiente:
+                if compresor is None:
+                    return await send(mensaje)
+                datos = compresor.compress(cuerpo) + (b"" if mas else compresor.flush())
+                cache_compresion.registrar(len(cuerpo), len(datos))
+                return await send({"type": "http.response.body", "body": datos, "more_body": mas})
+
+            inicio = pendiente.pop()
+            cabeceras = MutableHeaders(scope=inicio)
+            if not _comprimible(inicio, cabeceras) or (not mas and len(cuerpo) < COMPRESION_MINIMO):
+                await send(inicio)
+                return await send(mensaje)
+
+            etag = cabeceras.get("etag")
+            cabeceras["content-encoding"] = codificacion
+            cabeceras.add_vary_header("Accept-Encoding")
+            if etag and not etag.startswith("W/"):
+                cabeceras["etag"] = "W/" + etag
+
+            if mas:
+                if "content-length" in cabeceras:
+                    del cabeceras["content-length"]
+                compresor = estado["compresor"] = crear_compresor(codificacion)
+                datos = compresor.compress(cuerpo)
+                cache_compresion.registrar(len(cuerpo), len(datos))
+                await send(inicio)
+                return await send({"type": "http.response.body", "body": datos, "more_body": True})
+
+            if etag and not etag.startswith("W/"):
+                datos = cache_compresion.comprimir(etag, codificacion, cuerpo)
+            else:
+                datos = comprimir(cuerpo, codificacion)
+            cache_compresion.registrar(len(cuerpo), len(datos))
+            cabeceras["content-length"] = str(len(datos))
+            await send(inicio)
+            await send({"type": "http.response.body", "body": datos})
+
+        await self.app(scope, receive, enviar)
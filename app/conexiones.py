@@ -0,0 +1,242 @@
+import os
+import time
+import asyncio
+import logging
+from typing import Any, Dict, Optional, TYPE_CHECKING
+from app.resiliencia import Resiliencia, TransporteResiliente, resiliencia
+
+if TYPE_CHECKING:
+    import httpx
+
+logger = logging.getLogger(__name__)
+
+# Pool de lecturas (GET/HEAD): recibe la mayor parte del tráfico
+HTTP_MAX_CONEXIONES = int(os.getenv("HTTP_MAX_CONEXIONES", "64"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "32"))
+# Pool de escrituras (POST/PATCH/PUT/DELETE y funciones rpc)
+HTTP_ESCRITURA_MAX_CONEXIONES = int(os.getenv("HTTP_ESCRITURA_MAX_CONEXIONES", "16"))
+HTTP_ESCRITURA_MAX_KEEPALIVE = int(os.getenv("HTTP_ESCRITURA_MAX_KEEPALIVE", "8"))
+HTTP_POOLS_SEPARADOS = os.getenv("HTTP_POOLS_SEPARADOS", "1") == "1"
+
+HTTP_KEEPALIVE_EXPIRA = float(os.getenv("HTTP_KEEPALIVE_EXPIRA", "60"))
+HTTP2 = os.getenv("HTTP2", "1") == "1"
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "120"))
+HTTP_TIMEOUT_CONEXION = float(os.getenv("HTTP_TIMEOUT_CONEXION", "5"))
+HTTP_TIMEOUT_POOL = float(os.getenv("HTTP_TIMEOUT_POOL", "10"))
+
+# Conexiones que se abren por pool al arrancar (0 desactiva el precalentamiento)
+HTTP_PRECALENTAR = int(os.getenv("HTTP_PRECALENTAR", "2"))
+# Ruta barata para precalentar y verificar la salud: una fila de la tabla más chica
+RUTA_SALUD = os.getenv("HTTP_RUTA_SALUD", "/rest/v1/rol?select=id_rol&limit=1")
+
+METODOS_LECTURA = {"GET", "HEAD"}
+
+class PoolMedido:
+    """
+    Transporte httpx con su propio pool de conexiones que mide cuánto espera cada llamada hasta
+    tener una conexión: el tiempo desde que entra al pool hasta que empieza a enviar las
+    cabeceras, que incluye hacer cola si el pool está lleno y abrir la conexión si no había una
+    ociosa. Usa los eventos de la extensión `trace` de httpcore.
+    """
+
+    def __init__(self, nombre: str, transporte, max_conexiones: int, max_keepalive: int):
+        self.nombre = nombre
+        self.transporte = transporte
+        self.max_conexiones = max_conexiones
+        self.max_keepalive = max_keepalive
+        self.peticiones = 0
+        self.conexiones_abiertas = 0
+        self.fallos_conexion = 0
+        self.esperas = 0
+        self.espera_total = 0.0
+        self.espera_maxima = 0.0
+
+    def _registrar(self, evento: str, inicio: float, esperando: list):
+        if evento.endswith(".send_request_headers.started") and esperando:
+            esperando.clear()
+            espera = time.perf_counter() - inicio
+            self.esperas += 1
+            self.espera_total += espera
+            self.espera_maxima = max(self.espera_maxima, espera)
+        elif evento == "connection.connect_tcp.complete":
+            self.conexiones_abiertas += 1
+        elif evento == "connection.connect_tcp.failed":
+            self.fallos_conexion += 1
+
+    async def handle_async_request(self, request: "httpx.Request") -> "httpx.Response":
+        self.peticiones += 1
+        inicio = time.perf_counter()
+        esperando = [True]
+        anterior = request.extensions.get("trace")
+
+        async def trazar(evento: str, info: Dict[str, Any]):
+            self._registrar(evento, inicio, esperando)
+            if anterior is not None:
+                await anterior(evento, info)
+
+        # Un diccionario nuevo para este intento: los reintentos reenvían el mismo request
+        extensiones = request.extensions
+        request.extensions = {**extensiones, "trace": trazar}
+        try:
+            return await self.transporte.handle_async_request(request)
+        finally:
+            request.extensions = extensiones
+
+    def estado_pool(self) -> Dict[str, int]:
+        """Conexiones en uso y ociosas, y llamadas esperando conexión, según httpcore."""
+        pool = getattr(self.transporte, "_pool", None)
+        conexiones = list(getattr(pool, "connections", []))
+        ociosas = sum(1 for conexion in conexiones if conexion.is_idle())
+        en_cola = sum(1 for pendiente in getattr(pool, "_requests", []) if pendiente.is_queued())
+        return {"en_uso": len(conexiones) - ociosas, "ociosas": ociosas, "en_cola": en_cola}
+
+    def estadisticas(self) -> Dict[str, Any]:
+        return {
+            "max_conexiones": self.max_conexiones,
+            "max_keepalive": self.max_keepalive,
+            **self.estado_pool(),
+            "peticiones": self.peticiones,
+            "conexiones_abiertas": self.conexiones_abiertas,
+            "fallos_conexion": self.fallos_conexion,
+            "espera_promedio_ms": round(self.espera_total / self.esperas * 1000, 3) if self.esperas else 0.0,
+            "espera_maxima_ms": round(self.espera_maxima * 1000, 3),
+        }
+
+    async def __aenter__(self):
+        await self.transporte.__aenter__()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.transporte.__aexit__(*args)
+
+    async def aclose(self):
+        await self.transporte.aclose()
+
+class TransportePorMetodo:
+    """
+    Reparte las llamadas entre un pool de lecturas y uno de escrituras, para que una ráfaga de
+    lecturas no deje a los POST/PATCH esperando conexión (ni al revés). Las funciones rpc van
+    por el de escrituras porque se llaman con POST. Sin pool de escrituras, todo usa el de lecturas.
+    """
+
+    def __init__(self, lectura: PoolMedido, escritura: Optional[PoolMedido] = None):
+        self.lectura = lectura
+        self.escritura = escritura
+
+    @property
+    def pools(self) -> Dict[str, PoolMedido]:
+        pools = [self.lectura] + ([self.escritura] if self.escritura is not None else [])
+        return {pool.nombre: pool for pool in pools}
+
+    def pool(self, metodo: str) -> PoolMedido:
+        if metodo in METODOS_LECTURA or self.escritura is None:
+            return self.lectura
+        return self.escritura
+
+    async def handle_async_request(self, request: "httpx.Request") -> "httpx.Response":
+        return await self.pool(request.method).handle_async_request(request)
+
+    async def __aenter__(self):
+        for pool in self.pools.values():
+            await pool.__aenter__()
+        return self
+
+    async def __aexit__(self, *args):
+        for pool in self.pools.values():
+            await pool.__aexit__(*args)
+
+    async def aclose(self):
+        for pool in self.pools.values():
+            await pool.aclose()
+
+def crear_pool(nombre: str, max_conexiones: int, max_keepalive: int) -> PoolMedido:
+    import httpx
+
+    limites = httpx.Limits(
+        max_connections=max_conexiones,
+        max_keepalive_connections=max_keepalive,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRA,
+    )
+    return PoolMedido(nombre, httpx.AsyncHTTPTransport(http2=HTTP2, limits=limites), max_conexiones, max_keepalive)
+
+def crear_transporte() -> TransportePorMetodo:
+    """Pools de lecturas y escrituras con el keep-alive, HTTP/2 y límites configurados."""
+    return TransportePorMetodo(
+        crear_pool("lectura", HTTP_MAX_CONEXIONES, HTTP_MAX_KEEPALIVE),
+        crear_pool("escritura", HTTP_ESCRITURA_MAX_CONEXIONES, HTTP_ESCRITURA_MAX_KEEPALIVE) if HTTP_POOLS_SEPARADOS else None,
+    )
+
+def crear_cliente_http(transporte, politica: Optional[Resiliencia] = None) -> "httpx.AsyncClient":
+    """
+    Cliente httpx para Supabase con los timeouts configurados. Cada llamada pasa por la capa
+    de resiliencia y después por `transporte`: el de crear_transporte() o uno inyectado (por
+    ejemplo, el transporte simulado de los benchmarks).
+    """
+    import httpx
+
+    timeout = httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_TIMEOUT_CONEXION, pool=HTTP_TIMEOUT_POOL)
+    return httpx.AsyncClient(transport=TransporteResiliente(transporte, politica or resiliencia), timeout=timeout, follow_redirects=True)
+
+def pools_de(transporte) -> Dict[str, PoolMedido]:
+    """Pools medidos del transporte (vacío si no es un TransportePorMetodo)."""
+    return transporte.pools if isinstance(transporte, TransportePorMetodo) else {}
+
+class Salud:
+    """Resultado de la última verificación de Supabase (al arrancar o con GET /upstream/salud)."""
+
+    def __init__(self):
+        self.ok: Optional[bool] = None
+        self.estado: Optional[int] = None
+        self.latencia_ms: Optional[float] = None
+        self.error: Optional[str] = None
+        self.verificado: Optional[float] = None
+
+    def estadisticas(self) -> Dict[str, Any]:
+        return {
+            "ok": self.ok,
+            "estado": self.estado,
+            "latencia_ms": self.latencia_ms,
+            "error": self.error,
+            "verificado_hace_segundos": round(time.time() - self.verificado, 1) if self.verificado else None,
+        }
+
+salud = Salud()
+
+async def precalentar(cliente: "httpx.AsyncClient", transporte, url: str, clave: str, conexiones: int = HTTP_PRECALENTAR) -> Salud:
+    """
+    Abre hasta `conexiones` conexiones en cada pool con llamadas concurrentes a RUTA_SALUD y
+    deja el resultado en `salud`. Las llamadas van directo a los pools de `transporte` (el que
+    está debajo de la capa de resiliencia de `cliente`): no pasan por esa capa ni cuentan en
+    las métricas de la API. Con HTTP/2 basta una conexión por pool.
+    """
+    import httpx
+
+    # Un transporte inyectado (por ejemplo, el simulado de los benchmarks) se verifica como un solo pool
+    pools = pools_de(transporte) or {"cliente": transporte}
+    cabeceras = {"apikey": clave, "Authorization": f"Bearer {clave}"}
+
+    async def llamar(pool):
+        peticion = cliente.build_request("GET", url.rstrip("/") + RUTA_SALUD, headers=cabeceras)
+        respuesta = await pool.handle_async_request(peticion)
+        await respuesta.aread()
+        await respuesta.aclose()
+        return respuesta.status_code
+
+    inicio = time.perf_counter()
+    llamadas = [llamar(pool) for pool in pools.values() for _ in range(max(1, conexiones))]
+    try:
+        estados = await asyncio.wait_for(asyncio.gather(*llamadas), HTTP_TIMEOUT_CONEXION + HTTP_TIMEOUT_POOL)
+    except (httpx.HTTPError, asyncio.TimeoutError, OSError) as ex:
+        salud.ok, salud.estado, salud.error = False, None, f"{ex.__class__.__name__}: {ex}"
+    else:
+        # Un 4xx (por ejemplo, la tabla no existe) igual prueba que Supabase responde
+        peor = max(estados)
+        salud.ok, salud.estado, salud.error = peor < 500, peor, None
+    salud.latencia_ms = round((time.perf_counter() - inicio) * 1000, 1)
+    salud.verificado = time.time()
+
+    if salud.ok:
+        logger.info("Conexiones a Supabase precalentadas", extra={"pools": list(pools), "latencia_ms": salud.latencia_ms})
+    else:
+        logger.warning("Supabase no respondió la verificación de salud", extra={"estado": salud.estado, "error": salud.error})
+    return salud
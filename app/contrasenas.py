@@ -0,0 +1,95 @@
+import os
+import hmac
+import base64
+import asyncio
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+# Costo de scrypt configurable por entorno. N=2**14, r=8, p=1 son los parámetros mínimos
+# recomendados para contraseñas interactivas (~50-70 ms por hash en una CPU de Vercel).
+HASH_SCRYPT_N = int(os.getenv("HASH_SCRYPT_N", str(2 ** 14)))
+HASH_SCRYPT_R = int(os.getenv("HASH_SCRYPT_R", "8"))
+HASH_SCRYPT_P = int(os.getenv("HASH_SCRYPT_P", "1"))
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+PREFIJO = "scrypt"
+LARGO_SAL = 16
+LARGO_HASH = 32
+
+logger = logging.getLogger(__name__)
+
+_pool: Optional[ThreadPoolExecutor] = None
+
+def _ejecutor() -> ThreadPoolExecutor:
+    # hashlib.scrypt libera el GIL mientras calcula, así que un pool de hilos basta para
+    # sacar el trabajo del event loop sin el costo de arrancar procesos en un arranque en frío.
+    global _pool
+    if _pool is None:
+        _pool = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="hash")
+    return _pool
+
+def _b64(datos: bytes) -> str:
+    return base64.b64encode(datos).decode("ascii").rstrip("=")
+
+def _desde_b64(texto: str) -> bytes:
+    return base64.b64decode(texto + "=" * (-len(texto) % 4))
+
+def _scrypt(contrasena: str, sal: bytes, n: int, r: int, p: int) -> bytes:
+    return hashlib.scrypt(
+        contrasena.encode("utf-8"), salt=sal, n=n, r=r, p=p,
+        maxmem=256 * n * r + 1024 * 1024, dklen=LARGO_HASH
+    )
+
+def hashear(contrasena: str) -> str:
+    """Devuelve el hash en formato `scrypt$N$r$p$sal$hash` (sal y hash en base64)."""
+    sal = os.urandom(LARGO_SAL)
+    digest = _scrypt(contrasena, sal, HASH_SCRYPT_N, HASH_SCRYPT_R, HASH_SCRYPT_P)
+    return f"{PREFIJO}${HASH_SCRYPT_N}${HASH_SCRYPT_R}${HASH_SCRYPT_P}${_b64(sal)}${_b64(digest)}"
+
+def verificar(contrasena: str, almacenado: Optional[str]) -> bool:
+    """
+    Compara en tiempo constante una contraseña con el valor guardado. Acepta también las
+    contraseñas en texto plano anteriores a los hashes, que se reemplazan al iniciar sesión.
+    """
+    if not almacenado:
+        return False
+
+    partes = almacenado.split("$")
+    if len(partes) != 6 or partes[0] != PREFIJO:
+        return hmac.compare_digest(contrasena.encode("utf-8"), almacenado.encode("utf-8"))
+
+    _, n, r, p, sal, digest = partes
+    calculado = _scrypt(contrasena, _desde_b64(sal), int(n), int(r), int(p))
+    return hmac.compare_digest(calculado, _desde_b64(digest))
+
+def necesita_rehash(almacenado: Optional[str]) -> bool:
+    """True si el valor guardado es texto plano o un hash con un costo distinto al configurado."""
+    partes = (almacenado or "").split("$")
+    if len(partes) != 6 or partes[0] != PREFIJO:
+        return True
+    return partes[1:4] != [str(HASH_SCRYPT_N), str(HASH_SCRYPT_R), str(HASH_SCRYPT_P)]
+
+async def hashear_contrasena(contrasena: str) -> str:
+    """Calcula el hash en el pool de hashing sin bloquear el event loop."""
+    return await asyncio.get_running_loop().run_in_executor(_ejecutor(), hashear, contrasena)
+
+async def verificar_contrasena(contrasena: str, almacenado: Optional[str]) -> bool:
+    """Verifica la contraseña en el pool de hashing sin bloquear el event loop."""
+    return await asyncio.get_running_loop().run_in_executor(_ejecutor(), verificar, contrasena, almacenado)
+
+async def hashear_contrasenas(filas: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Devuelve copias de `filas` con el campo contrasena hasheado, repartiendo el trabajo en el pool."""
+    hashes = await asyncio.gather(*(hashear_contrasena(fila["contrasena"]) for fila in filas))
+    return [dict(fila, contrasena=hash_) for fila, hash_ in zip(filas, hashes)]
+
+async def actualizar_hash(repositorio: Any, valor: Any, contrasena: str):
+    """
+    Reemplaza la contraseña guardada de la fila `valor` por un hash con el costo actual.
+    Se ejecuta como tarea en segundo plano tras un inicio de sesión exitoso.
+    """
+    try:
+        await repositorio.actualizar(valor, {"contrasena": await hashear_contrasena(contrasena)})
+    except Exception as ex:
+        logger.warning("No se pudo actualizar el hash de la contraseña", extra={"tabla": repositorio.tabla, "id": valor}, exc_info=ex)
@@ -1,27 +1,93 @@
 import os
+import asyncio
 from dotenv import load_dotenv
-from supabase import create_client, Client
-from functools import lru_cache
+from typing import Any, Dict, Optional, TYPE_CHECKING
+from app.metricas import instrumentar_cliente
+from app.etag import registrar_escrituras
+from app.resiliencia import resiliencia
+from app.conexiones import HTTP_PRECALENTAR, crear_cliente_http, crear_transporte, pools_de, precalentar, Salud, PoolMedido
 load_dotenv()
 
+# supabase y httpx se importan recién al crear el cliente: son la mayor parte del tiempo
+# de importación de la app y no hacen falta para responder rutas que no usan la base de datos.
+if TYPE_CHECKING:
+    import httpx
+    from supabase import AsyncClient
+
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 
-@lru_cache(maxsize=10)
-def get_conexion() -> Client:
+_cliente: Optional["AsyncClient"] = None
+# Transporte inyectado con reiniciar_conexion (None: los pools de crear_transporte)
+_transporte: Optional[Any] = None
+# Cliente httpx que está usando _cliente y el transporte debajo de su capa de resiliencia
+_cliente_http_activo: Optional["httpx.AsyncClient"] = None
+_transporte_activo: Optional[Any] = None
+_lock = asyncio.Lock()
+
+async def get_conexion() -> "AsyncClient":
     """
-    Crea y devuelve un cliente de Supabase para interactuar con la base de datos.
-    Utiliza caché para optimizar el rendimiento en entornos sin servidor.
-    
+    Devuelve el cliente asíncrono de Supabase compartido por toda la aplicación.
+    El cliente se crea una sola vez por proceso y reutiliza su pool de conexiones,
+    de modo que los handlers no ocupan un hilo mientras esperan a PostgREST.
+
     Returns:
-        Client: Cliente de Supabase inicializado.
+        AsyncClient: Cliente asíncrono de Supabase inicializado.
     """
-    if not SUPABASE_URL or not SUPABASE_KEY:
-        raise ValueError(
-            "Las variables de entorno SUPABASE_URL y SUPABASE_KEY deben estar configuradas. "
-            "Por favor, verifica tu archivo .env o las variables de entorno en Vercel."
-        )
-        
-    supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
-    return supabase
+    global _cliente, _cliente_http_activo, _transporte_activo
+    if _cliente is not None:
+        return _cliente
+
+    async with _lock:
+        if _cliente is None:
+            if not SUPABASE_URL or not SUPABASE_KEY:
+                raise ValueError(
+                    "Las variables de entorno SUPABASE_URL y SUPABASE_KEY deben estar configuradas. "
+                    "Por favor, verifica tu archivo .env o las variables de entorno en Vercel."
+                )
+
+            from supabase import acreate_client, AsyncClientOptions
+
+            _transporte_activo = _transporte or crear_transporte()
+            cliente_http = _cliente_http_activo = crear_cliente_http(_transporte_activo)
+            opciones = AsyncClientOptions(httpx_client=instrumentar_cliente(registrar_escrituras(cliente_http)))
+            _cliente = await acreate_client(SUPABASE_URL, SUPABASE_KEY, opciones)
+
+    return _cliente
+
+def reiniciar_conexion(transporte: Optional[Any] = None):
+    """
+    Descarta el cliente compartido para que la próxima llamada a get_conexion lo vuelva a crear.
+    Permite inyectar un transporte httpx propio (por ejemplo, uno simulado en benchmarks), que
+    igual queda debajo de la capa de resiliencia.
+
+    Args:
+        transporte: Transporte httpx por el que saldrán las llamadas a PostgREST.
+    """
+    global _cliente, _transporte, _cliente_http_activo, _transporte_activo, _lock
+    _cliente = None
+    _transporte = transporte
+    _cliente_http_activo = None
+    _transporte_activo = None
+    _lock = asyncio.Lock()
+    resiliencia.reiniciar_semaforos()
+
+async def precalentar_conexion(conexiones: int = HTTP_PRECALENTAR) -> Salud:
+    """
+    Crea el cliente compartido, abre las primeras conexiones de cada pool y verifica que
+    Supabase responda. Se llama al arrancar la aplicación para que la primera petición de un
+    usuario no pague el handshake TCP/TLS.
+    """
+    await get_conexion()
+    return await precalentar(_cliente_http_activo, _transporte_activo, SUPABASE_URL, SUPABASE_KEY, conexiones)
+
+async def cerrar_conexion():
+    """Cierra las conexiones del cliente compartido al apagar la aplicación."""
+    cliente_http = _cliente_http_activo
+    reiniciar_conexion(_transporte)
+    if cliente_http is not None:
+        await cliente_http.aclose()
 
+def pools_conexion() -> Dict[str, PoolMedido]:
+    """Pools de conexiones del cliente compartido, por nombre (vacío si todavía no se creó)."""
+    return pools_de(_transporte_activo)
@@ -0,0 +1,355 @@
+import os
+import json
+import time
+import uuid
+import random
+import socket
+import sqlite3
+import asyncio
+import logging
+import tempfile
+import contextvars
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# Con 0 los efectos se aplican dentro de la petición, como antes de la cola (ver api/index.py)
+EFECTOS_EN_SEGUNDO_PLANO = os.getenv("EFECTOS_EN_SEGUNDO_PLANO", "1") == "1"
+EFECTOS_DIARIO = os.getenv("EFECTOS_DIARIO", os.path.join(tempfile.gettempdir(), "spinzone_efectos.sqlite3"))
+EFECTOS_WORKERS = int(os.getenv("EFECTOS_WORKERS", "2"))
+EFECTOS_LOTE = int(os.getenv("EFECTOS_LOTE", "200"))
+EFECTOS_ESPERA_LOTE = float(os.getenv("EFECTOS_ESPERA_LOTE", "0.05"))
+EFECTOS_INTENTOS = int(os.getenv("EFECTOS_INTENTOS", "8"))
+EFECTOS_BACKOFF = float(os.getenv("EFECTOS_BACKOFF", "0.5"))
+EFECTOS_BACKOFF_MAXIMO = float(os.getenv("EFECTOS_BACKOFF_MAXIMO", "60"))
+# Segundos que una entrada tomada queda reservada para su worker; si el proceso muere, otro la retoma después
+EFECTOS_PLAZO = float(os.getenv("EFECTOS_PLAZO", "120"))
+
+PENDIENTE, EN_PROCESO, FALLIDO = "pendiente", "en_proceso", "fallido"
+
+# Recibe los datos de todas las entradas de un lote del mismo tipo, cada uno con su id en
+# `efecto` para que Supabase no lo aplique dos veces; si lanza, el lote se reintenta
+Procesador = Callable[[List[Dict[str, Any]]], Awaitable[None]]
+
+class Entrada(NamedTuple):
+    id: int
+    tipo: str
+    datos: Dict[str, Any]
+    intentos: int
+    creado: float
+
+class DiarioEfectos:
+    """
+    Diario SQLite de los efectos pendientes: una entrada se escribe antes de responder y se
+    borra recién cuando el efecto se aplicó, así que sobrevive a un reinicio del proceso y se
+    retoma al arrancar. Las escrituras son de pocos bytes en modo WAL sin fsync por commit
+    (synchronous=NORMAL), por lo que se hacen directamente en el event loop.
+
+    Varios procesos (workers de uvicorn o gunicorn) pueden compartir el archivo: una entrada se
+    toma marcándola en_proceso con el dueño y un plazo dentro de una transacción `immediate`,
+    así que dos procesos nunca toman la misma. Si el dueño muere, la entrada se puede volver
+    a tomar cuando vence el plazo.
+    """
+
+    def __init__(self, ruta: str = EFECTOS_DIARIO):
+        self.ruta = ruta
+        self._conexion: Optional[sqlite3.Connection] = None
+
+    @property
+    def conexion(self) -> sqlite3.Connection:
+        if self._conexion is None:
+            # Las escrituras se hacen desde el event loop; los handlers síncronos de /metrics y
+            # /efectos/estado solo leen el resumen desde el pool de hilos
+            conexion = sqlite3.connect(self.ruta, isolation_level=None, check_same_thread=False)
+            conexion.execute("pragma journal_mode=wal")
+            conexion.execute("pragma synchronous=normal")
+            conexion.execute("""
+                create table if not exists efectos (
+                    id integer primary key autoincrement,
+                    tipo text not null,
+                    datos text not null,
+                    creado real not null,
+                    intentos integer not null default 0,
+                    siguiente_intento real not null,
+                    estado text not null default 'pendiente',
+                    dueno text,
+                    tomado_hasta real,
+                    error text
+                )
+            """)
+            # Diarios creados antes de que las entradas se tomaran por proceso
+            columnas = {fila[1] for fila in conexion.execute("pragma table_info(efectos)")}
+            for columna in ("dueno text", "tomado_hasta real"):
+                if columna.split()[0] not in columnas:
+                    conexion.execute(f"alter table efectos add column {columna}")
+            conexion.execute("create index if not exists efectos_pendientes on efectos (estado, siguiente_intento)")
+            conexion.execute("create index if not exists efectos_tomados on efectos (dueno)")
+            self._conexion = conexion
+        return self._conexion
+
+    def agregar(self, tipo: str, datos: Dict[str, Any]) -> int:
+        ahora = time.time()
+        cursor = self.conexion.execute(
+            "insert into efectos (tipo, datos, creado, siguiente_intento) values (?, ?, ?, ?)",
+            (tipo, json.dumps(datos, separators=(",", ":")), ahora, ahora),
+        )
+        return cursor.lastrowid
+
+    def listos(self, limite: int) -> List[Entrada]:
+        """
+        Entradas que se pueden tomar, de la más antigua a la más nueva: pendientes cuyo próximo
+        intento ya llegó y tomadas por un proceso cuyo plazo venció.
+        """
+        ahora = time.time()
+        filas = self.conexion.execute(
+            "select id, tipo, datos, intentos, creado from efectos"
+            " where (estado = ? and siguiente_intento <= ?) or (estado = ? and tomado_hasta < ?) order by id limit ?",
+            (PENDIENTE, ahora, EN_PROCESO, ahora, limite),
+        ).fetchall()
+        return [Entrada(id, tipo, json.loads(datos), intentos, creado) for id, tipo, datos, intentos, creado in filas]
+
+    def tomar(self, dueno: str, limite: int, plazo: float, elegir: Callable[[List[Entrada]], List[Entrada]]) -> List[Entrada]:
+        """
+        Marca como tomadas por `dueno` durante `plazo` segundos las entradas que `elegir` escoge
+        entre las `limite` primeras listas. La lectura y la marca van en una transacción
+        `immediate`, que bloquea a los demás procesos hasta el commit.
+        """
+        conexion = self.conexion
+        conexion.execute("begin immediate")
+        try:
+            lote = elegir(self.listos(limite))
+            conexion.executemany(
+                "update efectos set estado = ?, dueno = ?, tomado_hasta = ? where id = ?",
+                [(EN_PROCESO, dueno, time.time() + plazo, entrada.id) for entrada in lote],
+            )
+            conexion.execute("commit")
+        except BaseException:
+            conexion.execute("rollback")
+            raise
+        return lote
+
+    def soltar(self, dueno: str):
+        """Devuelve a pendientes las entradas que `dueno` tomó y no terminó (al reiniciar sus workers)."""
+        self.conexion.execute("update efectos set estado = ?, dueno = null where estado = ? and dueno = ?", (PENDIENTE, EN_PROCESO, dueno))
+
+    def eliminar(self, ids: List[int]):
+        self.conexion.executemany("delete from efectos where id = ?", [(id,) for id in ids])
+
+    def reprogramar(self, entrada: Entrada, siguiente_intento: float, error: str):
+        self.conexion.execute(
+            "update efectos set intentos = intentos + 1, siguiente_intento = ?, estado = ?, dueno = null, error = ? where id = ?",
+            (siguiente_intento, PENDIENTE, error, entrada.id),
+        )
+
+    def marcar_fallida(self, entrada: Entrada, error: str):
+        self.conexion.execute(
+            "update efectos set intentos = intentos + 1, estado = ?, dueno = null, error = ? where id = ?",
+            (FALLIDO, error, entrada.id),
+        )
+
+    def proximo_intento(self) -> Optional[float]:
+        """Momento del próximo reintento programado o del próximo plazo que vence (las entradas ya listas no cuentan)."""
+        ahora = time.time()
+        return self.conexion.execute(
+            "select min(case when estado = ? then siguiente_intento else tomado_hasta end) from efectos"
+            " where (estado = ? and siguiente_intento > ?) or (estado = ? and tomado_hasta >= ?)",
+            (PENDIENTE, PENDIENTE, ahora, EN_PROCESO, ahora),
+        ).fetchone()[0]
+
+    def resumen(self) -> Dict[str, Any]:
+        pendientes, mas_antigua = self.conexion.execute(
+            "select count(*), min(creado) from efectos where estado in (?, ?)", (PENDIENTE, EN_PROCESO)
+        ).fetchone()
+        fallidas = self.conexion.execute("select count(*) from efectos where estado = ?", (FALLIDO,)).fetchone()[0]
+        return {"pendientes": pendientes, "mas_antigua": mas_antigua, "fallidas": fallidas}
+
+    def cerrar(self):
+        if self._conexion is not None:
+            self._conexion.close()
+            self._conexion = None
+
+class ColaEfectos:
+    """
+    Cola de efectos secundarios de las escrituras (ajustes de stock y de producto_ventas):
+    el handler registra el efecto en el diario y responde; `workers` tareas de asyncio los
+    toman en lotes del mismo tipo, que el procesador de cada tipo agrupa por producto, y los
+    aplican con reintentos y backoff exponencial. Una entrada que ya falló se reintenta sola
+    para que no arrastre al resto de su lote; tras `intentos` fallos queda como fallida en el
+    diario. La entrega es al menos una vez (un lote cuya respuesta se perdió se reenvía), así
+    que cada efecto lleva un id con el que las funciones de Supabase lo aplican una sola vez
+    (ver sql/efectos_aplicados.sql).
+    """
+
+    def __init__(self, diario: DiarioEfectos, workers: int = EFECTOS_WORKERS, lote: int = EFECTOS_LOTE,
+                 espera_lote: float = EFECTOS_ESPERA_LOTE, intentos: int = EFECTOS_INTENTOS,
+                 backoff: float = EFECTOS_BACKOFF, backoff_maximo: float = EFECTOS_BACKOFF_MAXIMO,
+                 plazo: float = EFECTOS_PLAZO, en_segundo_plano: bool = EFECTOS_EN_SEGUNDO_PLANO):
+        self.diario = diario
+        # Identifica las entradas que toma este proceso en un diario compartido
+        self.dueno = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.workers = workers
+        self.lote = lote
+        self.espera_lote = espera_lote
+        self.intentos = intentos
+        self.backoff = backoff
+        self.backoff_maximo = backoff_maximo
+        self.plazo = plazo
+        self.en_segundo_plano = en_segundo_plano
+        self.procesadores: Dict[str, Procesador] = {}
+        self._tomadas: Set[int] = set()
+        self._tareas: List[asyncio.Task] = []
+        self._hay_trabajo: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.encolados = 0
+        self.aplicados = 0
+        self.lotes = 0
+        self.reintentos = 0
+        self.fallidos = 0
+
+    def registrar(self, tipo: str, procesador: Procesador):
+        self.procesadores[tipo] = procesador
+
+    async def encolar(self, tipo: str, datos: Dict[str, Any]):
+        """
+        Registra un efecto para aplicarlo en segundo plano. Sin cola, lo aplica en el momento y
+        solo registra el error si falla, como hacían los handlers.
+        """
+        datos = {**datos, 'efecto': uuid.uuid4().hex}
+        if not self.en_segundo_plano:
+            try:
+                await self.procesadores[tipo]([datos])
+            except Exception as ex:
+                logger.error("Error al aplicar un efecto", extra={"tipo": tipo}, exc_info=ex)
+            return
+
+        self.diario.agregar(tipo, datos)
+        self.encolados += 1
+        self.iniciar()
+        self._hay_trabajo.set()
+
+    def iniciar(self):
+        """Arranca los workers en el event loop actual (y retoma lo que quedó en el diario)."""
+        loop = asyncio.get_running_loop()
+        if self._loop is loop and all(not tarea.done() for tarea in self._tareas):
+            return
+        for tarea in self._tareas:
+            tarea.cancel()
+        self._loop = loop
+        # Lo que tomaron los workers anteriores de este proceso vuelve a la cola sin esperar el plazo
+        self.diario.soltar(self.dueno)
+        self._tomadas.clear()
+        self._hay_trabajo = asyncio.Event()
+        self._hay_trabajo.set()
+        # Contexto vacío: los workers no heredan el request_id ni las métricas de la petición que los arrancó
+        self._tareas = [
+            contextvars.Context().run(loop.create_task, self._trabajar(), name=f"efectos-{n}")
+            for n in range(self.workers)
+        ]
+
+    async def drenar(self, timeout: Optional[float] = None) -> bool:
+        """Espera hasta que no queden efectos listos ni en proceso. Devuelve False si vence el timeout."""
+        limite = None if timeout is None else time.monotonic() + timeout
+        while self._tomadas or (self._tareas and self.diario.listos(1)):
+            if limite is not None and time.monotonic() >= limite:
+                return False
+            await asyncio.sleep(0.01)
+        return True
+
+    async def detener(self, timeout: float = 5.0):
+        """Aplica lo pendiente durante hasta `timeout` segundos; lo que quede sigue en el diario."""
+        if not self._tareas:
+            return
+        if not await self.drenar(timeout):
+            logger.warning("Efectos pendientes al apagar; se aplicarán al volver a arrancar", extra=self.diario.resumen())
+        for tarea in self._tareas:
+            tarea.cancel()
+        await asyncio.gather(*self._tareas, return_exceptions=True)
+        self._tareas = []
+        self._loop = None
+
+    def _elegir(self, listas: List[Entrada]) -> List[Entrada]:
+        """Siguiente lote: entradas listas del tipo de la más antigua, o una sola si ya falló antes."""
+        # Una entrada propia cuyo plazo venció mientras se aplicaba no se vuelve a tomar aquí
+        candidatas = [entrada for entrada in listas if entrada.id not in self._tomadas and entrada.tipo in self.procesadores]
+        if not candidatas:
+            return []
+        primera = candidatas[0]
+        if primera.intentos:
+            return [primera]
+        return [entrada for entrada in candidatas if entrada.tipo == primera.tipo and not entrada.intentos][:self.lote]
+
+    def _tomar(self) -> List[Entrada]:
+        lote = self.diario.tomar(self.dueno, self.lote + len(self._tomadas), self.plazo, self._elegir)
+        self._tomadas.update(entrada.id for entrada in lote)
+        return lote
+
+    async def _esperar_trabajo(self):
+        proximo = self.diario.proximo_intento()
+        espera = None if proximo is None else max(0.0, proximo - time.time())
+        try:
+            await asyncio.wait_for(self._hay_trabajo.wait(), espera)
+        except asyncio.TimeoutError:
+            pass
+        # Dejar que se acumulen los efectos de las peticiones que llegan juntas
+        await asyncio.sleep(self.espera_lote)
+
+    async def _trabajar(self):
+        while True:
+            try:
+                self._hay_trabajo.clear()
+                lote = self._tomar()
+                if not lote:
+                    await self._esperar_trabajo()
+                    continue
+                try:
+                    await self._procesar(lote)
+                finally:
+                    self._tomadas.difference_update(entrada.id for entrada in lote)
+            except asyncio.CancelledError:
+                raise
+            except Exception as ex:
+                # Un error del diario no debe matar al worker
+                logger.error("Error en el worker de efectos", exc_info=ex)
+                await asyncio.sleep(self.backoff)
+
+    async def _procesar(self, lote: List[Entrada]):
+        tipo = lote[0].tipo
+        try:
+            await self.procesadores[tipo]([entrada.datos for entrada in lote])
+        except Exception as ex:
+            error = f"{ex.__class__.__name__}: {ex}"
+            for entrada in lote:
+                if entrada.intentos + 1 >= self.intentos:
+                    self.fallidos += 1
+                    self.diario.marcar_fallida(entrada, error)
+                    logger.error("Efecto descartado tras agotar los reintentos", extra={"tipo": tipo, "id": entrada.id, "datos": entrada.datos, "error": error})
+                else:
+                    self.reintentos += 1
+                    espera = min(self.backoff_maximo, self.backoff * 2 ** entrada.intentos) * random.uniform(0.5, 1.0)
+                    self.diario.reprogramar(entrada, time.time() + espera, error)
+            logger.warning("Error al aplicar efectos; se reintentarán", extra={"tipo": tipo, "efectos": len(lote), "error": error})
+            return
+
+        self.diario.eliminar([entrada.id for entrada in lote])
+        self.aplicados += len(lote)
+        self.lotes += 1
+
+    def estadisticas(self) -> Dict[str, Any]:
+        resumen = self.diario.resumen() if self.en_segundo_plano else {"pendientes": 0, "mas_antigua": None, "fallidas": 0}
+        return {
+            "en_segundo_plano": self.en_segundo_plano,
+            "diario": self.diario.ruta,
+            "dueno": self.dueno,
+            "workers": sum(1 for tarea in self._tareas if not tarea.done()),
+            "pendientes": resumen["pendientes"],
+            "en_proceso": len(self._tomadas),
+            "retraso_segundos": round(time.time() - resumen["mas_antigua"], 3) if resumen["mas_antigua"] else 0.0,
+            "fallidas": resumen["fallidas"],
+            "encolados": self.encolados,
+            "aplicados": self.aplicados,
+            "lotes": self.lotes,
+            "tamano_promedio_lote": round(self.aplicados / self.lotes, 2) if self.lotes else 0.0,
+            "reintentos": self.reintentos,
+        }
+
+cola_efectos = ColaEfectos(DiarioEfectos())
@@ -0,0 +1,236 @@
+import os
+import re
+import time
+import hashlib
+from collections import OrderedDict
+from urllib.parse import parse_qsl
+from typing import Any, Dict, Iterable, Optional, Tuple, TYPE_CHECKING
+from app.cache import CACHE_TTL
+from app.metricas import tabla_de_url
+
+if TYPE_CHECKING:
+    import httpx
+
+ETAG_TTL = float(os.getenv("ETAG_TTL", str(CACHE_TTL)))
+ETAG_MAX_ENTRADAS = int(os.getenv("ETAG_MAX_ENTRADAS", "5000"))
+
+PRIVADA = "private, no-cache"
+
+# Plantilla de ruta -> (Cache-Control, tablas de las que depende la respuesta sin `?fields=`;
+# las que embebe `?fields=` se suman en cada petición, ver tablas_de_peticion).
+# Solo estas rutas llevan ETag; el resto (exportaciones en streaming, métricas, sesión) no.
+POLITICAS: Dict[str, Tuple[str, Tuple[str, ...]]] = {
+    "/clientes/": (PRIVADA, ("cliente",)),
+    "/clientes/{id_cliente}": (PRIVADA, ("cliente",)),
+    "/clientes/rut/{rut}": (PRIVADA, ("cliente",)),
+    "/empleados/": (PRIVADA, ("empleado",)),
+    "/empleados/{id_empleado}": (PRIVADA, ("empleado",)),
+    "/empleados/rut/{rut}": (PRIVADA, ("empleado",)),
+    "/pedidos/": (PRIVADA, ("pedido", "cliente")),
+    "/pedidos/{id_pedido}": (PRIVADA, ("pedido",)),
+    "/pedidos/{id_pedido}/completo": (PRIVADA, ("pedido", "cliente", "pedido_producto", "producto")),
+    "/pedidos/cliente/{id_cliente}": (PRIVADA, ("pedido",)),
+    "/pedido-producto/pedido/{id_pedido}": (PRIVADA, ("pedido", "pedido_producto")),
+    "/pedido-producto/producto/{id_producto}": (PRIVADA, ("producto", "pedido_producto")),
+    "/pedido-producto/{id_pedido_producto}": (PRIVADA, ("pedido_producto",)),
+    "/pedido-producto/productos/mas-vendidos": ("public, max-age=30", ("producto", "producto_ventas")),
+}
+
+# Tablas que modifica cada función RPC; una RPC desconocida invalida todas las tablas
+TABLAS_RPC = {
+    "rpc/descontar_stock": ("producto",),
+    "rpc/aplicar_lote_stock": ("producto",),
+    "rpc/ajustar_ventas": ("producto_ventas",),
+    "rpc/reconstruir_producto_ventas": ("producto_ventas",),
+    "rpc/actualizar_linea_pedido": ("pedido_producto",),
+    "rpc/aplicar_efectos_stock": ("producto",),
+    "rpc/aplicar_efectos_ventas": ("producto_ventas",),
+}
+TODAS = "*"
+
+# Nombre de una relación embebida en `?fields=`: `cliente(nombre,pedido(fecha))` -> cliente, pedido
+EMBEBIDO = re.compile(r"(\w+)\s*\(")
+
+def tablas_de_peticion(tablas: Tuple[str, ...], query_string: str) -> Tuple[str, ...]:
+    """
+    Tablas de la ruta más las relaciones que embebe `?fields=`. Solo una respuesta 200 llega a
+    usarse, y app.proyeccion ya rechazó con 400 las relaciones que la tabla no tiene.
+    """
+    embebidas = [
+        nombre
+        for clave, valor in parse_qsl(query_string, keep_blank_values=True) if clave == "fields"
+        for nombre in EMBEBIDO.findall(valor)
+    ]
+    return tuple(dict.fromkeys((*tablas, *embebidas))) if embebidas else tablas
+
+class VersionesTablas:
+    """
+    Sellos de versión por tabla: un contador que avanza con cada escritura que esta instancia
+    envía a Supabase y la posición del contador en la última escritura de cada tabla.
+    Una respuesta calculada cuando el contador valía `secuencia` sigue vigente mientras
+    ninguna de sus tablas se haya escrito después.
+    """
+
+    def __init__(self):
+        self.secuencia = 0
+        self._ultima_escritura: Dict[str, int] = {}
+
+    def registrar_escritura(self, tabla: str):
+        self.secuencia += 1
+        for afectada in TABLAS_RPC.get(tabla, (TODAS,)) if tabla.startswith("rpc/") else (tabla,):
+            self._ultima_escritura[afectada] = self.secuencia
+
+    def vigente(self, tablas: Iterable[str], secuencia: int) -> bool:
+        return all(self._ultima_escritura.get(tabla, 0) <= secuencia for tabla in (TODAS, *tablas))
+
+versiones_tablas = VersionesTablas()
+
+async def _escritura_enviada(request: "httpx.Request"):
+    if request.method not in ("GET", "HEAD"):
+        versiones_tablas.registrar_escritura(tabla_de_url(request.url))
+
+async def _escritura_terminada(response: "httpx.Response"):
+    # También al terminar: una lectura que empezó con la escritura en curso pudo ver el dato anterior
+    await _escritura_enviada(response.request)
+
+def registrar_escrituras(cliente: "httpx.AsyncClient") -> "httpx.AsyncClient":
+    """Añade al cliente httpx los hooks que avanzan la versión de cada tabla escrita (solo una vez)."""
+    hooks = cliente.event_hooks
+    if _escritura_enviada not in hooks["request"]:
+        hooks["request"].append(_escritura_enviada)
+        hooks["response"].append(_escritura_terminada)
+        cliente.event_hooks = hooks
+    return cliente
+
+def calcular_etag(cuerpo: bytes) -> str:
+    return '"' + hashlib.blake2b(cuerpo, digest_size=16).hexdigest() + '"'
+
+def coincide(if_none_match: Optional[str], etag: str) -> bool:
+    """Comparación débil de If-None-Match (RFC 9110): ignora el prefijo W/ y acepta *."""
+    if not if_none_match:
+        return False
+    for candidato in if_none_match.split(","):
+        candidato = candidato.strip()
+        if candidato == "*" or candidato.removeprefix("W/") == etag:
+            return True
+    return False
+
+class CacheETags:
+    """
+    Último ETag entregado por URL, con la ruta, sus tablas y la secuencia de versiones con que
+    se calculó. Permite responder 304 sin llamar al handler (ni a Supabase) mientras las tablas
+    no se hayan escrito y no pasen `ttl` segundos; el TTL acota cuánto puede tardar en verse
+    una escritura hecha por otra instancia. Acotada por LRU.
+    """
+
+    def __init__(self, max_entradas: int = ETAG_MAX_ENTRADAS, ttl: float = ETAG_TTL):
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self._entradas: "OrderedDict[str, Tuple[float, str, Any, Tuple[str, ...], int]]" = OrderedDict()
+        self.respuestas_304 = 0
+        self.sin_upstream = 0
+
+    def guardar(self, clave: str, etag: str, ruta: Any, tablas: Tuple[str, ...], secuencia: int):
+        self._entradas[clave] = (time.monotonic() + self.ttl, etag, ruta, tablas, secuencia)
+        self._entradas.move_to_end(clave)
+        while len(self._entradas) > self.max_entradas:
+            self._entradas.popitem(last=False)
+
+    def validar(self, clave: str, if_none_match: str) -> Optional[Tuple[str, Any]]:
+        """Devuelve (etag, ruta) si el ETag del cliente sigue siendo el vigente para la URL."""
+        entrada = self._entradas.get(clave)
+        if entrada is None:
+            return None
+        expira, etag, ruta, tablas, secuencia = entrada
+        if expira < time.monotonic() or not versiones_tablas.vigente(tablas, secuencia):
+            del self._entradas[clave]
+            return None
+        if not coincide(if_none_match, etag):
+            return None
+        self._entradas.move_to_end(clave)
+        return etag, ruta
+
+    def limpiar(self):
+        self._entradas.clear()
+
+    def estadisticas(self) -> Dict[str, Any]:
+        return {
+            "entradas": len(self._entradas),
+            "respuestas_304": self.respuestas_304,
+            "sin_upstream": self.sin_upstream,
+        }
+
+cache_etags = CacheETags()
+
+def _no_modificado(etag: str, cache_control: str) -> Dict:
+    return {
+        "type": "http.response.start",
+        "status": 304,
+        "headers": [(b"etag", etag.encode("latin-1")), (b"cache-control", cache_control.encode("latin-1"))],
+    }
+
+class MiddlewareETag:
+    """
+    Middleware ASGI que añade ETag fuerte (hash del cuerpo) y Cache-Control a los GET de las
+    rutas en POLITICAS, y responde 304 cuando el If-None-Match coincide. Si la URL tiene en
+    CacheETags un ETag todavía vigente, el 304 se responde antes de ejecutar el handler.
+    Las respuestas en streaming se dejan pasar sin ETag.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "GET":
+            return await self.app(scope, receive, send)
+
+        if_none_match = None
+        for nombre, valor in scope["headers"]:
+            if nombre == b"if-none-match":
+                if_none_match = valor.decode("latin-1")
+                break
+
+        clave = scope["path"] + "?" + scope["query_string"].decode("latin-1")
+        if if_none_match:
+            vigente = cache_etags.validar(clave, if_none_match)
+            if vigente is not None:
+                etag, ruta = vigente
+                scope["route"] = ruta
+                cache_etags.respuestas_304 += 1
+                cache_etags.sin_upstream += 1
+                await send(_no_modificado(etag, POLITICAS[ruta.path][0]))
+                await send({"type": "http.response.body", "body": b""})
+                return
+
+        secuencia = versiones_tablas.secuencia
+        pendiente = []
+
+        async def enviar(mensaje):
+            if mensaje["type"] == "http.response.start":
+                pendiente.append(mensaje)
+                return
+            if not pendiente:
+                return await send(mensaje)
+
+            inicio = pendiente.pop()
+            politica = POLITICAS.get(getattr(scope.get("route"), "path", None))
+            if inicio["status"] != 200 or politica is None or mensaje.get("more_body", False):
+                await send(inicio)
+                return await send(mensaje)
+
+            cache_control, tablas = politica
+            etag = calcular_etag(mensaje.get("body", b""))
+            cache_etags.guardar(clave, etag, scope["route"], tablas_de_peticion(tablas, scope["query_string"].decode("latin-1")), secuencia)
+            if coincide(if_none_match, etag):
+                cache_etags.respuestas_304 += 1
+                await send(_no_modificado(etag, cache_control))
+                await send({"type": "http.response.body", "body": b""})
+                return
+
+            inicio["headers"] = list(inicio.get("headers", [])) + [
+                (b"etag", etag.encode("latin-1")), (b"cache-control", cache_control.encode("latin-1"))
+            ]
+            await send(inicio)
+            await send(mensaje)
+
+        await self.app(scope, receive, enviar)
@@ -0,0 +1,62 @@
+import io
+import csv
+import json
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List
+from fastapi.responses import StreamingResponse
+from app.paginacion import TAMANO_PAGINA, obtener_pagina, recorrer_paginas
+
+FORMATOS_EXPORTACION = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+}
+
+async def a_ndjson(filas: AsyncIterator[Dict]) -> AsyncIterator[bytes]:
+    """Un objeto JSON por línea."""
+    async for fila in filas:
+        yield json.dumps(fila, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+
+async def a_csv(filas: AsyncIterator[Dict], columnas: List[str], aplanar: Callable[[Dict], Iterable[Dict]]) -> AsyncIterator[bytes]:
+    """
+    Cabecera y una línea CSV por cada registro plano que `aplanar` obtiene de cada fila.
+    Se reutiliza un único buffer, así que la memoria no depende del tamaño de la exportación.
+    """
+    buffer = io.StringIO()
+    escritor = csv.DictWriter(buffer, fieldnames=columnas, extrasaction="ignore", lineterminator="\n")
+
+    def vaciar() -> bytes:
+        texto = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return texto.encode("utf-8")
+
+    escritor.writeheader()
+    yield vaciar()
+    async for fila in filas:
+        for registro in aplanar(fila):
+            escritor.writerow(registro)
+        yield vaciar()
+
+async def respuesta_exportacion(
+    crear_consulta: Callable[[], Any],
+    pk: str,
+    formato: str,
+    nombre_archivo: str,
+    columnas_csv: List[str],
+    aplanar: Callable[[Dict], Iterable[Dict]],
+    tamano: int = TAMANO_PAGINA,
+) -> StreamingResponse:
+    """
+    Exporta todas las filas de la consulta como NDJSON o CSV, encadenando generadores:
+    páginas de PostgREST por cursor -> filas -> bytes. Solo hay una página en memoria a la vez.
+    Igual que en `respuesta_stream`, la primera página se pide antes de responder para
+    que un error de Supabase todavía pueda devolverse como 500.
+    """
+    primera = await obtener_pagina(crear_consulta, pk, None, tamano)
+    filas = recorrer_paginas(crear_consulta, pk, None, tamano, primera)
+
+    cuerpo = a_csv(filas, columnas_csv, aplanar) if formato == "csv" else a_ndjson(filas)
+    return StreamingResponse(
+        cuerpo,
+        media_type=FORMATOS_EXPORTACION[formato],
+        headers={"Content-Disposition": f'attachment; filename="{nombre_archivo}.{formato}"'},
+    )
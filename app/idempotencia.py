@@ -0,0 +1,364 @@
+import os
+import time
+import asyncio
+import hashlib
+import logging
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional, Pattern, Tuple
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+from starlette.routing import compile_path
+from app.database import get_conexion
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCIA_TTL = float(os.getenv("IDEMPOTENCIA_TTL", str(24 * 3600)))
+# Cuánto dura la reserva de una clave cuya petición no terminó (por ejemplo, si la instancia se cayó)
+IDEMPOTENCIA_RESERVA_TTL = float(os.getenv("IDEMPOTENCIA_RESERVA_TTL", "60"))
+IDEMPOTENCIA_MAX_ENTRADAS = int(os.getenv("IDEMPOTENCIA_MAX_ENTRADAS", "10000"))
+# "memoria" (por defecto) o "supabase" para compartir las claves entre instancias (ver sql/idempotencia.sql)
+IDEMPOTENCIA_ALMACEN = os.getenv("IDEMPOTENCIA_ALMACEN", "memoria")
+
+CABECERA_IDEMPOTENCIA = "idempotency-key"
+LARGO_MAXIMO_CLAVE = 255
+
+# POST que aceptan Idempotency-Key
+RUTAS_IDEMPOTENTES: List[Tuple[Pattern, str]] = [
+    (compile_path(plantilla)[0], plantilla)
+    for plantilla in ("/pedidos/", "/pedido-producto/", "/pedido-producto/bulk/{id_pedido}")
+]
+# Solo se usa para etiquetar en las métricas las respuestas repetidas sin ejecutar el handler
+_RUTAS = {plantilla: SimpleNamespace(path=plantilla) for _, plantilla in RUTAS_IDEMPOTENTES}
+
+class Registro:
+    """Respuesta guardada para una clave, con la huella de la petición que la produjo."""
+
+    __slots__ = ("huella", "estado", "cabeceras", "cuerpo")
+
+    def __init__(self, huella: str, estado: Optional[int] = None, cabeceras: Optional[List[Tuple[str, str]]] = None, cuerpo: bytes = b""):
+        self.huella = huella
+        # None mientras la petición original sigue en curso
+        self.estado = estado
+        self.cabeceras = cabeceras or []
+        self.cuerpo = cuerpo
+
+class AlmacenIdempotencia(ABC):
+    """
+    Interfaz de los almacenes de respuestas. `reservar` debe ser atómico: devuelve el registro
+    existente (completo o en curso) o, si no hay uno vigente, deja la clave reservada y
+    devuelve None para que la petición se ejecute. Un almacén al que le falte algún método
+    no se puede instanciar.
+    """
+
+    @abstractmethod
+    async def reservar(self, clave: str, huella: str, ttl: float) -> Optional[Registro]:
+        ...
+
+    @abstractmethod
+    async def guardar(self, clave: str, registro: Registro, ttl: float):
+        ...
+
+    @abstractmethod
+    async def liberar(self, clave: str):
+        ...
+
+class AlmacenMemoria(AlmacenIdempotencia):
+    """Registros en memoria del proceso, acotados por TTL y LRU."""
+
+    def __init__(self, max_entradas: int = IDEMPOTENCIA_MAX_ENTRADAS):
+        self.max_entradas = max_entradas
+        self._entradas: "OrderedDict[str, Tuple[float, Registro]]" = OrderedDict()
+
+    def obtener(self, clave: str) -> Optional[Registro]:
+        entrada = self._entradas.get(clave)
+        if entrada is None:
+            return None
+        expira, registro = entrada
+        if expira < time.monotonic():
+            del self._entradas[clave]
+            return None
+        self._entradas.move_to_end(clave)
+        return registro
+
+    async def reservar(self, clave: str, huella: str, ttl: float) -> Optional[Registro]:
+        registro = self.obtener(clave)
+        if registro is not None:
+            return registro
+        self._guardar(clave, Registro(huella), ttl)
+        return None
+
+    async def guardar(self, clave: str, registro: Registro, ttl: float):
+        self._guardar(clave, registro, ttl)
+
+    def _guardar(self, clave: str, registro: Registro, ttl: float):
+        self._entradas[clave] = (time.monotonic() + ttl, registro)
+        self._entradas.move_to_end(clave)
+        while len(self._entradas) > self.max_entradas:
+            self._entradas.popitem(last=False)
+
+    async def liberar(self, clave: str):
+        self._entradas.pop(clave, None)
+
+    def limpiar(self):
+        self._entradas.clear()
+
+    def __len__(self) -> int:
+        return len(self._entradas)
+
+class AlmacenSupabase(AlmacenIdempotencia):
+    """
+    Registros en la tabla `idempotencia` de Supabase, compartidos por todas las instancias.
+    La reserva es un insert que ignora duplicados: si no devuelve la fila, otra petición ya
+    tenía la clave.
+    """
+
+    tabla = "idempotencia"
+
+    @staticmethod
+    def _a_registro(fila: Dict[str, Any]) -> Registro:
+        return Registro(
+            fila["huella"], fila["estado"],
+            [tuple(cabecera) for cabecera in fila.get("cabeceras") or []],
+            (fila.get("cuerpo") or "").encode("utf-8"),
+        )
+
+    @staticmethod
+    def _expira(ttl: float) -> str:
+        return (datetime.now(timezone.utc) + timedelta(seconds=ttl)).isoformat()
+
+    async def reservar(self, clave: str, huella: str, ttl: float) -> Optional[Registro]:
+        supabase = await get_conexion()
+        for _ in range(2):
+            response = await supabase.table(self.tabla).upsert(
+                {"clave": clave, "huella": huella, "expira": self._expira(ttl)},
+                on_conflict="clave", ignore_duplicates=True
+            ).execute()
+            if response.data:
+                return None
+
+            response = await supabase.table(self.tabla).select("*").eq("clave", clave).execute()
+            if not response.data:
+                continue
+            fila = response.data[0]
+            if datetime.fromisoformat(fila["expira"]) >= datetime.now(timezone.utc):
+                return self._a_registro(fila)
+            # Vencida: se borra (solo si nadie la renovó entretanto) y se vuelve a intentar la reserva
+            await supabase.table(self.tabla).delete().eq("clave", clave).eq("expira", fila["expira"]).execute()
+        return None
+
+    async def guardar(self, clave: str, registro: Registro, ttl: float):
+        supabase = await get_conexion()
+        await supabase.table(self.tabla).upsert({
+            "clave": clave,
+            "huella": registro.huella,
+            "estado": registro.estado,
+            "cabeceras": [list(cabecera) for cabecera in registro.cabeceras],
+            "cuerpo": registro.cuerpo.decode("utf-8"),
+            "expira": self._expira(ttl),
+        }, on_conflict="clave").execute()
+
+    async def liberar(self, clave: str):
+        supabase = await get_conexion()
+        await supabase.table(self.tabla).delete().eq("clave", clave).is_("estado", "null").execute()
+
+class Idempotencia:
+    """
+    Coordina las claves de idempotencia: primero la memoria del proceso (una repetición se
+    responde sin llamar a Supabase) y, si está configurado, un almacén persistente compartido
+    entre instancias. Las repeticiones que llegan mientras la original sigue en este mismo
+    proceso esperan su respuesta; si la original está en otra instancia se responde 409.
+    """
+
+    def __init__(self, persistente: Optional[AlmacenIdempotencia] = None, ttl: float = IDEMPOTENCIA_TTL,
+                 ttl_reserva: float = IDEMPOTENCIA_RESERVA_TTL):
+        self.memoria = AlmacenMemoria()
+        self.persistente = persistente
+        self.ttl = ttl
+        self.ttl_reserva = ttl_reserva
+        self._en_curso: Dict[str, asyncio.Future] = {}
+        self.ejecutadas = 0
+        self.repeticiones = 0
+        self.conflictos = 0
+
+    async def reservar(self, clave: str, huella: str) -> Optional[Registro]:
+        """Registro existente para la clave, o None si quedó reservada para esta petición."""
+        registro = self.memoria.obtener(clave)
+        if registro is None and self.persistente is not None:
+            registro = await self.persistente.reservar(clave, huella, self.ttl_reserva)
+            if registro is not None and registro.estado is not None:
+                await self.memoria.guardar(clave, registro, self.ttl)
+        if registro is None:
+            # Otra petición del proceso pudo reservarla mientras se consultaba el almacén persistente
+            registro = await self.memoria.reservar(clave, huella, self.ttl_reserva)
+        if registro is not None:
+            return registro
+
+        self._en_curso[clave] = asyncio.get_running_loop().create_future()
+        return None
+
+    async def esperar(self, clave: str) -> Optional[Registro]:
+        """Respuesta de la petición original si está en curso en este proceso."""
+        futuro = self._en_curso.get(clave)
+        if futuro is None:
+            return None
+        return await asyncio.shield(futuro)
+
+    async def completar(self, clave: str, registro: Registro):
+        """
+        Guarda la respuesta (salvo 5xx: esa petición puede reintentarse con la misma clave)
+        y se la entrega a las repeticiones que la esperaban.
+        """
+        try:
+            if registro.estado < 500:
+                await self.memoria.guardar(clave, registro, self.ttl)
+                if self.persistente is not None:
+                    await self.persistente.guardar(clave, registro, self.ttl)
+            else:
+                await self.liberar(clave)
+        finally:
+            futuro = self._en_curso.pop(clave, None)
+            if futuro is not None and not futuro.done():
+                futuro.set_result(registro)
+
+    async def liberar(self, clave: str):
+        await self.memoria.liberar(clave)
+        futuro = self._en_curso.pop(clave, None)
+        if futuro is not None and not futuro.done():
+            futuro.set_result(None)
+        if self.persistente is not None:
+            try:
+                await self.persistente.liberar(clave)
+            except Exception as ex:
+                # La reserva vence sola a los `ttl_reserva` segundos
+                logger.warning("No se pudo liberar la clave de idempotencia", extra={"clave": clave}, exc_info=ex)
+
+    def limpiar(self):
+        self.memoria.limpiar()
+
+    def estadisticas(self) -> Dict[str, Any]:
+        return {
+            "almacen": "supabase" if isinstance(self.persistente, AlmacenSupabase) else "memoria",
+            "ttl_segundos": self.ttl,
+            "entradas": len(self.memoria),
+            "en_curso": len(self._en_curso),
+            "ejecutadas": self.ejecutadas,
+            "repeticiones": self.repeticiones,
+            "conflictos": self.conflictos,
+        }
+
+idempotencia = Idempotencia(AlmacenSupabase() if IDEMPOTENCIA_ALMACEN == "supabase" else None)
+
+def calcular_huella(scope, cuerpo: bytes) -> str:
+    """Hash de la petición completa: una clave reutilizada con otro cuerpo o en otra ruta es un error del cliente."""
+    huella = hashlib.blake2b(digest_size=16)
+    for parte in (scope["method"], scope["path"], scope["query_string"].decode("latin-1")):
+        huella.update(parte.encode("utf-8") + b"\0")
+    huella.update(cuerpo)
+    return huella.hexdigest()
+
+def resolver_ruta(path: str) -> Optional[str]:
+    for expresion, plantilla in RUTAS_IDEMPOTENTES:
+        if expresion.match(path):
+            return plantilla
+    return None
+
+async def _leer_cuerpo(receive) -> Optional[bytes]:
+    partes = []
+    while True:
+        mensaje = await receive()
+        if mensaje["type"] == "http.disconnect":
+            return None
+        partes.append(mensaje.get("body", b""))
+        if not mensaje.get("more_body", False):
+            return b"".join(partes)
+
+async def _repetir(send, registro: Registro):
+    cabeceras = [(nombre.encode("latin-1"), valor.encode("latin-1")) for nombre, valor in registro.cabeceras]
+    cabeceras.append((b"idempotent-replayed", b"true"))
+    await send({"type": "http.response.start", "status": registro.estado, "headers": cabeceras})
+    await send({"type": "http.response.body", "body": registro.cuerpo})
+
+class MiddlewareIdempotencia:
+    """
+    Middleware ASGI para los POST de RUTAS_IDEMPOTENTES que traen `Idempotency-Key`: la
+    primera petición con una clave se ejecuta y su respuesta se guarda durante
+    IDEMPOTENCIA_TTL segundos; los reintentos con la misma clave y el mismo cuerpo reciben
+    esa respuesta (con `Idempotent-Replayed: true`) sin volver a ejecutar el handler.
+    Una clave reutilizada con otra petición responde 422.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST":
+            return await self.app(scope, receive, send)
+
+        clave = Headers(scope=scope).get(CABECERA_IDEMPOTENCIA)
+        plantilla = resolver_ruta(scope["path"]) if clave is not None else None
+        if plantilla is None:
+            return await self.app(scope, receive, send)
+
+        scope["route"] = _RUTAS[plantilla]
+        if not 0 < len(clave) <= LARGO_MAXIMO_CLAVE:
+            respuesta = JSONResponse({"detail": f"Idempotency-Key debe tener entre 1 y {LARGO_MAXIMO_CLAVE} caracteres"}, status_code=400)
+            return await respuesta(scope, receive, send)
+
+        cuerpo = await _leer_cuerpo(receive)
+        if cuerpo is None:
+            return
+        huella = calcular_huella(scope, cuerpo)
+
+        registro = await idempotencia.reservar(clave, huella)
+        if registro is not None:
+            if registro.huella != huella:
+                idempotencia.conflictos += 1
+                respuesta = JSONResponse({"detail": "Idempotency-Key ya usada con una petición distinta"}, status_code=422)
+                return await respuesta(scope, receive, send)
+            if registro.estado is None:
+                registro = await idempotencia.esperar(clave)
+            if registro is None:
+                respuesta = JSONResponse({"detail": "Hay una petición con esta Idempotency-Key en curso; reintente más tarde"}, status_code=409)
+                return await respuesta(scope, receive, send)
+            idempotencia.repeticiones += 1
+            return await _repetir(send, registro)
+
+        idempotencia.ejecutadas += 1
+        entregado = [False]
+
+        async def recibir():
+            if not entregado[0]:
+                entregado[0] = True
+                return {"type": "http.request", "body": cuerpo, "more_body": False}
+            return await receive()
+
+        inicio: List[Dict] = []
+        partes: List[bytes] = []
+
+        async def enviar(mensaje):
+            if mensaje["type"] == "http.response.start":
+                inicio.append(mensaje)
+            else:
+                partes.append(mensaje.get("body", b""))
+
+        try:
+            await self.app(scope, recibir, enviar)
+        except BaseException:
+            await idempotencia.liberar(clave)
+            raise
+
+        registro = Registro(
+            huella, inicio[0]["status"],
+            [(nombre.decode("latin-1"), valor.decode("latin-1")) for nombre, valor in inicio[0].get("headers", [])],
+            b"".join(partes),
+        )
+        try:
+            await idempotencia.completar(clave, registro)
+        except Exception as ex:
+            # La respuesta ya está calculada: que falle el almacén no debe convertirla en un error
+            logger.error("No se pudo guardar la respuesta idempotente", extra={"clave": clave}, exc_info=ex)
+        await send(inicio[0])
+        await send({"type": "http.response.body", "body": registro.cuerpo})
@@ -0,0 +1,179 @@
+import os
+import csv
+import json
+import logging
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+from fastapi import Request
+from pydantic import ValidationError
+from app.repositorio import Repositorio, error_http
+
+logger = logging.getLogger(__name__)
+
+IMPORTACION_LOTE = int(os.getenv("IMPORTACION_LOTE", "500"))
+LOTE_MAXIMO = 5000
+MAX_ERRORES_REPORTADOS = 1000
+
+async def _lineas(request: Request) -> AsyncIterator[str]:
+    """Lee el cuerpo de la petición a medida que llega y lo entrega línea por línea."""
+    pendiente = b""
+    primera = True
+    async for bloque in request.stream():
+        pendiente += bloque
+        *lineas, pendiente = pendiente.split(b"\n")
+        for linea in lineas:
+            texto = linea.decode("utf-8-sig" if primera else "utf-8", errors="replace").rstrip("\r")
+            primera = False
+            yield texto
+    if pendiente:
+        yield pendiente.decode("utf-8-sig" if primera else "utf-8", errors="replace").rstrip("\r")
+
+async def leer_filas(request: Request, formato: str) -> AsyncIterator[Tuple[int, Optional[Dict], Optional[str]]]:
+    """
+    Recorre un cuerpo NDJSON (un objeto JSON por línea) o CSV (con cabecera) sin cargarlo
+    entero en memoria. Entrega (número de fila, datos, error); las líneas vacías se saltan.
+    En CSV los campos vacíos se entregan como None y no se admiten saltos de línea dentro de un campo.
+    """
+    cabecera: Optional[List[str]] = None
+    numero = 0
+    async for linea in _lineas(request):
+        if not linea.strip():
+            continue
+
+        if formato == "csv":
+            valores = next(csv.reader([linea]))
+            if cabecera is None:
+                cabecera = [columna.strip() for columna in valores]
+                continue
+            numero += 1
+            if len(valores) != len(cabecera):
+                yield numero, None, f"Se esperaban {len(cabecera)} columnas y hay {len(valores)}"
+                continue
+            yield numero, {columna: (valor if valor != "" else None) for columna, valor in zip(cabecera, valores)}, None
+        else:
+            numero += 1
+            try:
+                fila = json.loads(linea)
+            except ValueError as ex:
+                yield numero, None, f"JSON inválido: {ex}"
+                continue
+            if not isinstance(fila, dict):
+                yield numero, None, "Cada línea debe ser un objeto JSON"
+                continue
+            yield numero, fila, None
+
+def detectar_formato(request: Request, formato: Optional[str]) -> str:
+    if formato:
+        return formato
+    return "csv" if "csv" in request.headers.get("content-type", "") else "ndjson"
+
+def _mensaje_validacion(ex: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(str(p) for p in error['loc'])}: {error['msg']}" for error in ex.errors())
+
+class Importacion:
+    """
+    Importa filas a una tabla en lotes de `tamano_lote` con una llamada a PostgREST por lote.
+    Los errores se registran por fila (número de fila en el archivo) y no detienen la carga.
+
+    Sin `actualizar`, las filas cuya `clave` ya existe se reportan como error y no se tocan
+    (insert con resolution=ignore-duplicates); con `actualizar` se sobrescriben (upsert).
+    Si un lote completo falla (por ejemplo, una referencia inválida), se reintenta fila por
+    fila para atribuir el error solo a las filas que lo causan.
+    """
+
+    def __init__(
+        self,
+        repositorio: Repositorio,
+        clave: str,
+        validar: Callable[[Dict], Dict],
+        preparar_lote: Optional[Callable[[List[Dict]], Awaitable[List[Dict]]]] = None,
+        actualizar: bool = False,
+        tamano_lote: int = IMPORTACION_LOTE,
+    ):
+        self.repositorio = repositorio
+        self.clave = clave
+        self.validar = validar
+        self.preparar_lote = preparar_lote
+        self.actualizar = actualizar
+        self.tamano_lote = tamano_lote
+        self.procesadas = 0
+        self.guardadas = 0
+        self.total_errores = 0
+        self.errores: List[Dict[str, Any]] = []
+
+    def _error(self, numero: int, mensaje: str, valor_clave: Any = None):
+        self.total_errores += 1
+        if len(self.errores) < MAX_ERRORES_REPORTADOS:
+            error = {"fila": numero, "error": mensaje}
+            if valor_clave is not None:
+                error[self.clave] = valor_clave
+            self.errores.append(error)
+
+    async def _guardar(self, lote: List[Tuple[int, Dict]]):
+        datos = [fila for _, fila in lote]
+        if self.preparar_lote:
+            datos = await self.preparar_lote(datos)
+
+        try:
+            guardadas = await self.repositorio.upsert(datos, self.clave, ignorar_duplicados=not self.actualizar)
+        except Exception as ex:
+            logger.warning("Lote rechazado, se reintenta fila por fila", extra={"tabla": self.repositorio.tabla, "filas": len(lote)}, exc_info=ex)
+            await self._guardar_por_fila(lote, datos)
+            return
+
+        self.guardadas += len(guardadas)
+        if not self.actualizar:
+            insertadas = {fila.get(self.clave) for fila in guardadas}
+            for (numero, fila), preparada in zip(lote, datos):
+                if preparada[self.clave] not in insertadas:
+                    self._error(numero, f"Ya existe un registro con {self.clave} {preparada[self.clave]}", preparada[self.clave])
+
+    async def _guardar_por_fila(self, lote: List[Tuple[int, Dict]], datos: List[Dict]):
+        for (numero, _), fila in zip(lote, datos):
+            try:
+                guardadas = await self.repositorio.upsert([fila], self.clave, ignorar_duplicados=not self.actualizar)
+                if guardadas:
+                    self.guardadas += 1
+                else:
+                    self._error(numero, f"Ya existe un registro con {self.clave} {fila[self.clave]}", fila[self.clave])
+            except Exception as ex:
+                self._error(numero, error_http(ex).detail, fila.get(self.clave))
+
+    async def ejecutar(self, filas: AsyncIterator[Tuple[int, Optional[Dict], Optional[str]]]) -> Dict[str, Any]:
+        lote: List[Tuple[int, Dict]] = []
+        en_lote: Dict[Any, int] = {}
+
+        async for numero, fila, error in filas:
+            self.procesadas += 1
+            if error:
+                self._error(numero, error)
+                continue
+
+            try:
+                datos = self.validar(fila)
+            except ValidationError as ex:
+                self._error(numero, _mensaje_validacion(ex), fila.get(self.clave))
+                continue
+            except ValueError as ex:
+                self._error(numero, str(ex), fila.get(self.clave))
+                continue
+
+            # Postgres rechaza un upsert que toca dos veces la misma fila
+            if datos[self.clave] in en_lote:
+                self._error(numero, f"{self.clave} repetido en la fila {en_lote[datos[self.clave]]}", datos[self.clave])
+                continue
+            en_lote[datos[self.clave]] = numero
+            lote.append((numero, datos))
+
+            if len(lote) >= self.tamano_lote:
+                await self._guardar(lote)
+                lote, en_lote = [], {}
+
+        if lote:
+            await self._guardar(lote)
+
+        return {
+            "procesadas": self.procesadas,
+            "guardadas": self.guardadas,
+            "con_error": self.total_errores,
+            "errores": sorted(self.errores, key=lambda error: error["fila"]),
+        }
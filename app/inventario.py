@@ -0,0 +1,657 @@
+import os
+import time
+import uuid
+import socket
+import sqlite3
+import asyncio
+import logging
+import tempfile
+import contextvars
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from fastapi import HTTPException
+from app.database import get_conexion
+from app.efectos import cola_efectos
+from app.repositorio import repo_pedido, repo_pedido_producto
+
+logger = logging.getLogger(__name__)
+
+# Solo los pedidos pagados por transferencia descuentan stock al agregar sus productos
+MEDIO_PAGO_TRANSFERENCIA = 1
+
+# Con 0 el stock se descuenta con la cola de efectos, sin reservar al recibir el pedido (ver api/index.py)
+INVENTARIO_LIBRO = os.getenv("INVENTARIO_LIBRO", "1") == "1"
+INVENTARIO_SHARDS = int(os.getenv("INVENTARIO_SHARDS", "16"))
+# Cada cuántos segundos se envían a Supabase los descuentos confirmados
+INVENTARIO_VOLCADO = float(os.getenv("INVENTARIO_VOLCADO", "0.5"))
+# Cada cuántos segundos se recarga el stock desde Supabase (reposiciones, ventas de otras instancias)
+INVENTARIO_RECONCILIAR = float(os.getenv("INVENTARIO_RECONCILIAR", "30"))
+INVENTARIO_DIARIO = os.getenv("INVENTARIO_DIARIO", os.path.join(tempfile.gettempdir(), "spinzone_inventario.sqlite3"))
+# Segundos sin renovar su latido tras los que las reservas de un proceso pasan al siguiente que arranque
+INVENTARIO_PLAZO = float(os.getenv("INVENTARIO_PLAZO", "30"))
+
+PAGINA_CARGA = 1000
+
+# id_producto -> unidades
+Reserva = Dict[int, int]
+
+async def descontar_stock(efectos: Dict[str, Iterable[Tuple[int, int]]]) -> List[Dict]:
+    """
+    Descuenta el stock de varios productos en una sola llamada atómica a la función
+    `aplicar_efectos_stock` de Postgres (ver sql/efectos_aplicados.sql), que aplica cada
+    efecto una sola vez aunque se reenvíe. Las cantidades repetidas para un mismo producto
+    dentro de un efecto se suman antes de enviarlas.
+
+    Args:
+        efectos: Id de cada efecto -> pares (id_producto, cantidad) a descontar.
+
+    Returns:
+        List[Dict]: Un resultado por producto de los efectos nuevos con id_producto, cantidad,
+        stock_anterior, stock_nuevo y actualizado (False si el producto no existe).
+    """
+    por_efecto: Dict[str, Dict[int, int]] = {}
+    for efecto, items in efectos.items():
+        cantidades = por_efecto.setdefault(efecto, {})
+        for id_producto, cantidad in items:
+            cantidades[id_producto] = cantidades.get(id_producto, 0) + cantidad
+
+    if not any(por_efecto.values()):
+        return []
+
+    supabase = await get_conexion()
+    response = await supabase.rpc('aplicar_efectos_stock', {
+        'efectos': [
+            {'id': efecto, 'items': [{'id_producto': id_producto, 'cantidad': cantidad} for id_producto, cantidad in cantidades.items()]}
+            for efecto, cantidades in por_efecto.items() if cantidades
+        ]
+    }).execute()
+
+    for resultado in response.data or []:
+        if resultado['actualizado']:
+            logger.debug("Stock actualizado", extra={"id_producto": resultado['id_producto'], "stock_anterior": resultado['stock_anterior'], "stock_nuevo": resultado['stock_nuevo']})
+        else:
+            logger.warning("No se pudo actualizar el stock: producto no encontrado", extra={"id_producto": resultado['id_producto']})
+
+    return response.data or []
+
+async def aplicar_lote_stock(lote: str, items: Reserva) -> Dict[int, int]:
+    """
+    Descuenta un lote del libro de inventario con la función `aplicar_lote_stock` de Postgres
+    (ver sql/aplicar_lote_stock.sql), que registra el id del lote y no lo vuelve a aplicar si
+    se reenvía. Devuelve el stock actual de los productos del lote.
+    """
+    supabase = await get_conexion()
+    response = await supabase.rpc('aplicar_lote_stock', {
+        'lote': lote,
+        'items': [{'id_producto': id_producto, 'cantidad': cantidad} for id_producto, cantidad in items.items()]
+    }).execute()
+    return {fila['id_producto']: fila['stock'] for fila in response.data or []}
+
+async def consultar_stock(ids: Optional[List[int]] = None) -> Dict[int, int]:
+    """Stock actual de los productos `ids` (o de todos, paginando por id_producto)."""
+    supabase = await get_conexion()
+    if ids is not None:
+        response = await supabase.table('producto').select('id_producto, stock').in_('id_producto', ids).execute()
+        return {fila['id_producto']: fila['stock'] or 0 for fila in response.data or []}
+
+    stock: Dict[int, int] = {}
+    ultimo = 0
+    while True:
+        response = await supabase.table('producto').select('id_producto, stock').gt('id_producto', ultimo).order('id_producto').limit(PAGINA_CARGA).execute()
+        filas = response.data or []
+        stock.update((fila['id_producto'], fila['stock'] or 0) for fila in filas)
+        if len(filas) < PAGINA_CARGA:
+            return stock
+        ultimo = filas[-1]['id_producto']
+
+class StockInsuficiente(Exception):
+    def __init__(self, id_producto: int, disponible: int, solicitado: int):
+        super().__init__(f"Stock insuficiente para el producto {id_producto}: disponibles {max(0, disponible)}, solicitados {solicitado}")
+        self.id_producto = id_producto
+        self.disponible = disponible
+        self.solicitado = solicitado
+
+class Cuenta:
+    """
+    Contador de un producto: `stock` es el último valor conocido en Supabase y el resto son
+    unidades que todavía no llegaron allí: reservadas por peticiones en curso, confirmadas a
+    la espera del próximo volcado y enviadas en un lote sin respuesta todavía.
+    """
+
+    __slots__ = ("stock", "reservado", "pendiente", "en_vuelo")
+
+    def __init__(self, stock: int):
+        self.stock = stock
+        self.reservado = 0
+        self.pendiente = 0
+        self.en_vuelo = 0
+
+    @property
+    def disponible(self) -> int:
+        return self.stock - self.reservado - self.pendiente - self.en_vuelo
+
+class Shard:
+    """Grupo de cuentas con su lock: el volcado y la reconciliación de un shard no se pisan."""
+
+    def __init__(self, numero: int):
+        self.numero = numero
+        self.cuentas: Dict[int, Cuenta] = {}
+        self.lock = asyncio.Lock()
+        # Lote enviado sin confirmación: se reenvía con el mismo id hasta que Supabase responda
+        self.lote: Optional[Tuple[str, Reserva]] = None
+        self.con_pendientes = False
+        self.reconciliar = False
+
+class DiarioReservas:
+    """
+    Diario SQLite de los descuentos confirmados que aún no llegaron a Supabase, una fila por
+    producto de cada reserva. Al armar un lote sus filas quedan marcadas con el id del lote y
+    se borran cuando Supabase lo confirma; al arrancar, los lotes marcados se reenvían (la
+    función los aplica una sola vez) y las filas sin lote vuelven a quedar pendientes.
+
+    Cada fila pertenece al proceso que la escribió (`dueno`), y cada proceso solo vuelca y
+    retoma las suyas, así que varios workers pueden compartir el archivo. Un proceso renueva
+    su latido mientras vive; las filas de uno cuyo latido venció hace `plazo` segundos (o que
+    se apagó con filas pendientes) las adopta el siguiente que las busque.
+    """
+
+    def __init__(self, ruta: str = INVENTARIO_DIARIO, plazo: float = INVENTARIO_PLAZO):
+        self.ruta = ruta
+        self.plazo = plazo
+        self.dueno = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._vivo_hasta = 0.0
+        self._conexion: Optional[sqlite3.Connection] = None
+
+    @property
+    def conexion(self) -> sqlite3.Connection:
+        if self._conexion is None:
+            conexion = sqlite3.connect(self.ruta, isolation_level=None, check_same_thread=False)
+            conexion.execute("pragma journal_mode=wal")
+            conexion.execute("pragma synchronous=normal")
+            conexion.execute("""
+                create table if not exists reservas_stock (
+                    id integer primary key autoincrement,
+                    dueno text not null,
+                    id_producto integer not null,
+                    cantidad integer not null,
+                    shard integer not null,
+                    lote text
+                )
+            """)
+            # Diarios creados antes de que las filas tuvieran dueño: sin latido, las adopta el primero que las busque
+            if "dueno" not in {fila[1] for fila in conexion.execute("pragma table_info(reservas_stock)")}:
+                conexion.execute("alter table reservas_stock add column dueno text not null default ''")
+            conexion.execute("create index if not exists reservas_stock_shard on reservas_stock (dueno, shard, lote)")
+            conexion.execute("create index if not exists reservas_stock_lote on reservas_stock (lote)")
+            conexion.execute("""
+                create table if not exists duenos_reservas (
+                    dueno text primary key,
+                    vivo_hasta real not null
+                )
+            """)
+            self._conexion = conexion
+        return self._conexion
+
+    def latido(self):
+        """Renueva el plazo de este proceso; escribe a lo sumo una vez cada medio plazo."""
+        ahora = time.time()
+        if self._vivo_hasta - ahora > self.plazo / 2:
+            return
+        self._vivo_hasta = ahora + self.plazo
+        self.conexion.execute(
+            "insert into duenos_reservas (dueno, vivo_hasta) values (?, ?) on conflict (dueno) do update set vivo_hasta = excluded.vivo_hasta",
+            (self.dueno, self._vivo_hasta),
+        )
+
+    def soltar(self):
+        """Al apagar: lo que quede en el diario lo adopta el próximo proceso sin esperar el plazo."""
+        self._vivo_hasta = 0.0
+        self.conexion.execute("update duenos_reservas set vivo_hasta = 0 where dueno = ?", (self.dueno,))
+
+    def adoptar(self, shards: int) -> Tuple[Dict[str, Reserva], Reserva]:
+        """
+        Pasa a este proceso las filas de los procesos cuyo latido venció, reasignadas a `shards`
+        shards, dentro de una transacción `immediate` para que dos procesos no adopten las mismas.
+        Devuelve los lotes enviados sin respuesta y los descuentos sin lote adoptados.
+        """
+        conexion = self.conexion
+        ahora = time.time()
+        conexion.execute("begin immediate")
+        try:
+            filas = conexion.execute(
+                "select id, lote, id_producto, cantidad from reservas_stock where dueno != ?"
+                " and dueno not in (select dueno from duenos_reservas where vivo_hasta >= ?)",
+                (self.dueno, ahora),
+            ).fetchall()
+            conexion.executemany(
+                "update reservas_stock set dueno = ?, shard = id_producto % ? where id = ?",
+                [(self.dueno, shards, id) for id, _, _, _ in filas],
+            )
+            conexion.execute("delete from duenos_reservas where vivo_hasta < ? and dueno != ?", (ahora, self.dueno))
+            conexion.execute("commit")
+        except BaseException:
+            conexion.execute("rollback")
+            raise
+
+        lotes: Dict[str, Reserva] = {}
+        sin_lote: Reserva = {}
+        for _, lote, id_producto, cantidad in filas:
+            destino = lotes.setdefault(lote, {}) if lote is not None else sin_lote
+            destino[id_producto] = destino.get(id_producto, 0) + cantidad
+        return lotes, sin_lote
+
+    def agregar(self, reserva: Reserva, shards: int):
+        self.conexion.executemany(
+            "insert into reservas_stock (dueno, id_producto, cantidad, shard) values (?, ?, ?, ?)",
+            [(self.dueno, id_producto, cantidad, id_producto % shards) for id_producto, cantidad in reserva.items()],
+        )
+
+    def asignar_lote(self, shard: int, lote: str):
+        self.conexion.execute("update reservas_stock set lote = ? where dueno = ? and shard = ? and lote is null", (lote, self.dueno, shard))
+
+    def eliminar_lote(self, lote: str):
+        self.conexion.execute("delete from reservas_stock where lote = ?", (lote,))
+
+    def lotes(self) -> Dict[str, Reserva]:
+        """Lotes de este proceso que se enviaron sin que se registrara la respuesta."""
+        lotes: Dict[str, Reserva] = {}
+        for lote, id_producto, cantidad in self.conexion.execute(
+            "select lote, id_producto, sum(cantidad) from reservas_stock where dueno = ? and lote is not null group by lote, id_producto",
+            (self.dueno,),
+        ):
+            lotes.setdefault(lote, {})[id_producto] = cantidad
+        return lotes
+
+    def sin_lote(self, shards: int) -> Reserva:
+        """Descuentos confirmados de este proceso que no alcanzaron a entrar en un lote, reasignados a `shards` shards."""
+        self.conexion.execute("update reservas_stock set shard = id_producto % ? where dueno = ? and lote is null", (shards, self.dueno))
+        return dict(self.conexion.execute(
+            "select id_producto, sum(cantidad) from reservas_stock where dueno = ? and lote is null group by id_producto", (self.dueno,)
+        ).fetchall())
+
+    def cerrar(self):
+        if self._conexion is not None:
+            self._conexion.close()
+            self._conexion = None
+
+class LibroInventario:
+    """
+    Stock de los productos en memoria, repartido en `shards` por id_producto, para reservar
+    las unidades de un pedido al recibirlo y rechazar la sobreventa sin consultar `producto`.
+    La verificación y la reserva de todos los productos de un pedido ocurren sin ceder el event
+    loop, así que son atómicas sin tomar ningún lock; los locks de cada shard solo ordenan el
+    volcado y la reconciliación de sus cuentas.
+
+    Las reservas confirmadas (la línea ya se insertó) se anotan en el diario y una tarea las
+    envía sumadas por producto cada `intervalo` segundos, un lote por shard. Cada lote lleva un
+    id con el que Supabase lo aplica una sola vez, así que un lote cuyo resultado no se conoce
+    (timeout, reinicio) se reenvía sin riesgo; mientras tanto sus unidades siguen descontadas.
+    El stock se carga de Supabase con la primera reserva o al arrancar, y se recarga cada
+    `reconciliar_cada` segundos y después de un volcado que falló.
+
+    Cada proceso tiene su propio libro: con varias instancias la sobreventa solo se evita
+    dentro de una, y el stock de las demás se recoge al reconciliar. Al reconciliar también se
+    adoptan los descuentos que otro proceso dejó en el diario al morir o apagarse.
+    """
+
+    def __init__(self, diario: DiarioReservas, shards: int = INVENTARIO_SHARDS, intervalo: float = INVENTARIO_VOLCADO,
+                 reconciliar_cada: float = INVENTARIO_RECONCILIAR, activo: bool = INVENTARIO_LIBRO):
+        self.diario = diario
+        self.n_shards = shards
+        self.intervalo = intervalo
+        self.reconciliar_cada = reconciliar_cada
+        self.activo = activo
+        self.shards: List[Shard] = []
+        self.listo = False
+        self._preparacion: Optional[asyncio.Task] = None
+        self._tarea: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._proxima_reconciliacion = 0.0
+        # Lotes adoptados de otro proceso cuyo reenvío falló: se reintentan en la próxima adopción
+        self._adoptados: Dict[str, Reserva] = {}
+        self.reservas = 0
+        self.rechazos = 0
+        self.volcados = 0
+        self.unidades_volcadas = 0
+        self.fallos_volcado = 0
+        self.reconciliaciones = 0
+
+    def _shard(self, id_producto: int) -> Shard:
+        return self.shards[id_producto % len(self.shards)]
+
+    def _cuenta(self, id_producto: int) -> Optional[Cuenta]:
+        return self._shard(id_producto).cuentas.get(id_producto)
+
+    async def preparar(self):
+        """
+        Deja el libro listo en el event loop actual: reenvía los lotes que quedaron sin respuesta,
+        carga el stock de todos los productos, retoma los descuentos pendientes del diario y
+        arranca el volcado periódico.
+        """
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            if self._tarea is not None:
+                self._tarea.cancel()
+            self._loop, self._tarea, self._preparacion, self.listo = loop, None, None, False
+        if self.listo:
+            return
+
+        # Una sola carga compartida: las peticiones que llegan mientras tanto la esperan juntas, y si
+        # falla la siguiente petición la reintenta
+        if self._preparacion is None or (self._preparacion.done() and (self._preparacion.cancelled() or self._preparacion.exception() is not None)):
+            self._preparacion = contextvars.Context().run(loop.create_task, self._cargar(), name="inventario-carga")
+        await asyncio.shield(self._preparacion)
+
+    async def _cargar(self):
+        loop = asyncio.get_running_loop()
+        self.diario.latido()
+        # Lo adoptado queda a nombre de este proceso: lo recogen lotes() y sin_lote()
+        self.diario.adoptar(self.n_shards)
+        for lote, items in self.diario.lotes().items():
+            await aplicar_lote_stock(lote, items)
+            self.diario.eliminar_lote(lote)
+
+        self.shards = [Shard(numero) for numero in range(self.n_shards)]
+        for id_producto, stock in (await consultar_stock()).items():
+            self._shard(id_producto).cuentas[id_producto] = Cuenta(stock)
+        for id_producto, cantidad in self.diario.sin_lote(self.n_shards).items():
+            shard = self._shard(id_producto)
+            shard.cuentas.setdefault(id_producto, Cuenta(0)).pendiente += cantidad
+            shard.con_pendientes = True
+
+        self.listo = True
+        self.reconciliaciones += 1
+        self._proxima_reconciliacion = time.monotonic() + self.reconciliar_cada
+        # Contexto vacío: las tareas del libro no heredan el request_id ni las métricas de la petición que las arrancó
+        self._tarea = contextvars.Context().run(loop.create_task, self._volcar_periodicamente(), name="inventario")
+        logger.info("Libro de inventario cargado", extra={"productos": sum(len(shard.cuentas) for shard in self.shards)})
+
+    async def reservar(self, items: Reserva) -> Reserva:
+        """
+        Reserva las unidades de todos los productos o de ninguno. Los productos que no existen
+        en Supabase se omiten (la inserción de la línea fallará por la clave foránea).
+
+        Raises:
+            StockInsuficiente: Si algún producto no tiene unidades disponibles suficientes.
+        """
+        await self.preparar()
+        faltantes = [id_producto for id_producto in items if self._cuenta(id_producto) is None]
+        if faltantes:
+            # Productos creados después de la carga: sin unidades en el libro, Supabase manda
+            for id_producto, stock in (await consultar_stock(faltantes)).items():
+                self._shard(id_producto).cuentas.setdefault(id_producto, Cuenta(stock))
+
+        # Desde aquí no hay await: nadie más puede reservar entre la verificación y la reserva
+        reserva = {id_producto: cantidad for id_producto, cantidad in items.items() if cantidad > 0 and self._cuenta(id_producto) is not None}
+        for id_producto, cantidad in reserva.items():
+            disponible = self._cuenta(id_producto).disponible
+            if disponible < cantidad:
+                self.rechazos += 1
+                raise StockInsuficiente(id_producto, disponible, cantidad)
+        for id_producto, cantidad in reserva.items():
+            self._cuenta(id_producto).reservado += cantidad
+        self.reservas += 1
+        return reserva
+
+    def confirmar(self, reserva: Reserva):
+        """Pasa una reserva a descuento pendiente de volcar (la línea del pedido ya se guardó)."""
+        self.ajustar(reserva, reserva)
+
+    def ajustar(self, reserva: Reserva, cambios: Reserva):
+        """
+        Cierra la reserva de un cambio de cantidad ya guardado: `cambios` es la cantidad nueva
+        menos la anterior por producto, según la base de datos. Lo que subió queda pendiente de
+        descontar y lo que bajó, con signo negativo, vuelve a estar disponible. Un aumento mayor
+        que lo reservado sale de unidades que devolvió un cambio concurrente de la misma línea.
+        """
+        cambios = {id_producto: cantidad for id_producto, cantidad in cambios.items() if cantidad}
+        if cambios:
+            self.diario.agregar(cambios, self.n_shards)
+        for id_producto in reserva.keys() | cambios.keys():
+            shard = self._shard(id_producto)
+            cuenta = shard.cuentas.setdefault(id_producto, Cuenta(0))
+            cuenta.reservado = max(0, cuenta.reservado - reserva.get(id_producto, 0))
+            if id_producto in cambios:
+                cuenta.pendiente += cambios[id_producto]
+                shard.con_pendientes = True
+
+    def liberar(self, reserva: Reserva):
+        """Devuelve las unidades de una reserva cuya línea no se pudo guardar."""
+        for id_producto, cantidad in reserva.items():
+            cuenta = self._cuenta(id_producto) if self.shards else None
+            if cuenta is not None:
+                cuenta.reservado = max(0, cuenta.reservado - cantidad)
+
+    async def volcar(self):
+        """Envía a Supabase los descuentos pendientes, un lote por shard en paralelo."""
+        await asyncio.gather(*(
+            self._volcar_shard(shard) for shard in self.shards if shard.lote is not None or shard.con_pendientes
+        ))
+
+    async def _volcar_shard(self, shard: Shard):
+        async with shard.lock:
+            if shard.lote is None:
+                items = {id_producto: cuenta.pendiente for id_producto, cuenta in shard.cuentas.items() if cuenta.pendiente}
+                shard.con_pendientes = False
+                if not items:
+                    return
+                lote = uuid.uuid4().hex
+                self.diario.asignar_lote(shard.numero, lote)
+                for id_producto, cantidad in items.items():
+                    cuenta = shard.cuentas[id_producto]
+                    cuenta.pendiente -= cantidad
+                    cuenta.en_vuelo += cantidad
+                shard.lote = (lote, items)
+
+            lote, items = shard.lote
+            try:
+                stock = await aplicar_lote_stock(lote, items)
+            except Exception as ex:
+                # El lote pudo haberse aplicado o no: sus unidades siguen descontadas hasta reenviarlo
+                self.fallos_volcado += 1
+                shard.reconciliar = True
+                logger.warning("Error al volcar el stock; se reintentará", extra={"shard": shard.numero, "lote": lote, "error": f"{ex.__class__.__name__}: {ex}"})
+                return
+
+            self.diario.eliminar_lote(lote)
+            for id_producto, cantidad in items.items():
+                cuenta = shard.cuentas[id_producto]
+                cuenta.en_vuelo -= cantidad
+                if id_producto in stock:
+                    cuenta.stock = stock[id_producto]
+            shard.lote = None
+            self.volcados += 1
+            self.unidades_volcadas += sum(items.values())
+
+            if shard.reconciliar:
+                await self._reconciliar_shard(shard)
+
+    async def reconciliar(self):
+        """Recarga desde Supabase el stock de todos los productos del libro, shard por shard."""
+        self._proxima_reconciliacion = time.monotonic() + self.reconciliar_cada
+
+        async def reconciliar_shard(shard: Shard):
+            async with shard.lock:
+                # Con un lote sin respuesta no se sabe si Supabase ya lo descontó: se reconcilia al confirmarlo
+                if shard.lote is None:
+                    await self._reconciliar_shard(shard)
+
+        await asyncio.gather(*(reconciliar_shard(shard) for shard in self.shards if shard.cuentas))
+
+    async def _reconciliar_shard(self, shard: Shard):
+        try:
+            stock = await consultar_stock(list(shard.cuentas))
+        except Exception as ex:
+            shard.reconciliar = True
+            logger.warning("Error al reconciliar el stock", extra={"shard": shard.numero, "error": f"{ex.__class__.__name__}: {ex}"})
+            return
+        # Las reservas y los pendientes no están en Supabase: solo cambia el stock base
+        for id_producto, valor in stock.items():
+            shard.cuentas[id_producto].stock = valor
+        shard.reconciliar = False
+        self.reconciliaciones += 1
+
+    async def _adoptar(self):
+        """Retoma los descuentos que dejaron en el diario los procesos cuyo latido venció."""
+        lotes, sin_lote = self.diario.adoptar(self.n_shards)
+        # Sin await hasta sumar los pendientes: un volcado no puede asignar estas filas a un lote antes
+        for id_producto, cantidad in sin_lote.items():
+            shard = self._shard(id_producto)
+            shard.cuentas.setdefault(id_producto, Cuenta(0)).pendiente += cantidad
+            shard.con_pendientes = True
+        if lotes or sin_lote:
+            logger.info("Reservas de otro proceso adoptadas", extra={"lotes": len(lotes), "unidades": sum(sin_lote.values())})
+
+        self._adoptados.update(lotes)
+        for lote, items in list(self._adoptados.items()):
+            try:
+                await aplicar_lote_stock(lote, items)
+            except Exception as ex:
+                logger.warning("Error al reenviar un lote adoptado; se reintentará", extra={"lote": lote, "error": f"{ex.__class__.__name__}: {ex}"})
+                continue
+            self.diario.eliminar_lote(lote)
+            del self._adoptados[lote]
+
+    async def _volcar_periodicamente(self):
+        while True:
+            await asyncio.sleep(self.intervalo)
+            try:
+                self.diario.latido()
+                await self.volcar()
+                if time.monotonic() >= self._proxima_reconciliacion:
+                    # Primero la adopción: la reconciliación recoge el stock de los lotes reenviados
+                    await self._adoptar()
+                    await self.reconciliar()
+            except asyncio.CancelledError:
+                raise
+            except Exception as ex:
+                logger.error("Error en el volcado del libro de inventario", exc_info=ex)
+
+    async def detener(self, timeout: float = 5.0):
+        """Detiene el volcado periódico y envía lo pendiente; lo que no alcance queda en el diario."""
+        if self._tarea is None:
+            return
+        self._tarea.cancel()
+        await asyncio.gather(self._tarea, return_exceptions=True)
+        self._tarea = None
+        try:
+            await asyncio.wait_for(self.volcar(), timeout)
+        except Exception as ex:
+            logger.warning("Descuentos de stock pendientes al apagar; se enviarán al volver a arrancar", extra={"error": str(ex)})
+        self.diario.soltar()
+        self._loop, self._preparacion, self.listo = None, None, False
+
+    def estadisticas(self) -> Dict[str, Any]:
+        # Se llama desde el pool de hilos: copias de las listas por si el event loop agrega productos
+        cuentas = [cuenta for shard in list(self.shards) for cuenta in list(shard.cuentas.values())]
+        return {
+            "activo": self.activo,
+            "listo": self.listo,
+            "diario": self.diario.ruta,
+            "dueno": self.diario.dueno,
+            "shards": self.n_shards,
+            "productos": len(cuentas),
+            "reservado": sum(cuenta.reservado for cuenta in cuentas),
+            "pendiente": sum(cuenta.pendiente for cuenta in cuentas),
+            "en_vuelo": sum(cuenta.en_vuelo for cuenta in cuentas),
+            "lotes_sin_confirmar": sum(1 for shard in self.shards if shard.lote is not None),
+            "reservas": self.reservas,
+            "rechazos": self.rechazos,
+            "volcados": self.volcados,
+            "unidades_volcadas": self.unidades_volcadas,
+            "fallos_volcado": self.fallos_volcado,
+            "reconciliaciones": self.reconciliaciones,
+        }
+
+libro_inventario = LibroInventario(DiarioReservas())
+
+async def descontar_stock_pedidos(lote: List[Dict[str, Any]]):
+    """
+    Procesador de los efectos "stock" de la cola: cada efecto trae `id_pedido` e `items`
+    ([id_producto, cantidad]). Consulta en una sola llamada el medio de pago de todos los
+    pedidos del lote y descuenta, en otra, el stock de los pagados por transferencia.
+    """
+    pedidos = sorted({efecto['id_pedido'] for efecto in lote})
+    supabase = await get_conexion()
+    response = await supabase.table('pedido').select('id_pedido, medio_pago_id').in_('id_pedido', pedidos).execute()
+    transferencias = {fila['id_pedido'] for fila in response.data or [] if fila['medio_pago_id'] == MEDIO_PAGO_TRANSFERENCIA}
+
+    await descontar_stock({
+        efecto['efecto']: [(id_producto, cantidad) for id_producto, cantidad in efecto['items']]
+        for efecto in lote if efecto['id_pedido'] in transferencias
+    })
+
+async def encolar_descuento_stock(id_pedido: int, items: Iterable[Tuple[int, int]]):
+    """Encola el descuento de stock de las líneas agregadas a un pedido (si se pagó por transferencia)."""
+    await cola_efectos.encolar('stock', {'id_pedido': id_pedido, 'items': [[id_producto, cantidad] for id_producto, cantidad in items]})
+
+async def usa_libro(id_pedido: int) -> bool:
+    """Si las líneas del pedido reservan stock en el libro: libro activo y pago por transferencia."""
+    if not libro_inventario.activo:
+        return False
+    pedido = await repo_pedido.obtener(id_pedido)
+    return pedido.get('medio_pago_id') == MEDIO_PAGO_TRANSFERENCIA
+
+async def reservar_stock(id_pedido: int, items: Iterable[Tuple[int, int]]) -> Reserva:
+    """
+    Antes de insertar líneas en un pedido pagado por transferencia, reserva sus unidades en el
+    libro de inventario o responde 409 si no alcanzan. Devuelve una reserva vacía si el libro
+    está desactivado o el pedido no descuenta stock.
+    """
+    if not await usa_libro(id_pedido):
+        return {}
+
+    cantidades: Reserva = {}
+    for id_producto, cantidad in items:
+        cantidades[id_producto] = cantidades.get(id_producto, 0) + cantidad
+    try:
+        return await libro_inventario.reservar(cantidades)
+    except StockInsuficiente as ex:
+        raise HTTPException(status_code=409, detail=str(ex))
+
+async def confirmar_stock(id_pedido: int, items: Iterable[Tuple[int, int]], reserva: Reserva):
+    """Después de insertar las líneas: confirma la reserva o, sin libro, encola el descuento."""
+    if libro_inventario.activo:
+        libro_inventario.confirmar(reserva)
+    else:
+        await encolar_descuento_stock(id_pedido, items)
+
+def liberar_stock(reserva: Optional[Reserva]):
+    if reserva:
+        libro_inventario.liberar(reserva)
+
+async def reservar_cambio_stock(id_pedido: int, id_producto: int, cantidad: int) -> Optional[Reserva]:
+    """
+    Antes de cambiar la cantidad de una línea (o de insertarla si no existe) en un pedido pagado
+    por transferencia: reserva en el libro lo que sube respecto de la cantidad guardada, o
+    responde 409 si no alcanza. Con `cantidad` 0 (la línea se elimina) no reserva nada. Devuelve
+    None si el pedido no reserva stock en el libro.
+    """
+    if not await usa_libro(id_pedido):
+        return None
+    aumento = 0
+    if cantidad > 0:
+        lineas = await repo_pedido_producto.buscar({'id_pedido': id_pedido, 'id_producto': id_producto}, columnas='cantidad')
+        aumento = cantidad - sum(linea['cantidad'] for linea in lineas)
+    if aumento <= 0:
+        # ajustar() necesita las cuentas cargadas aunque no haya nada que reservar
+        await libro_inventario.preparar()
+        return {}
+    try:
+        return await libro_inventario.reservar({id_producto: aumento})
+    except StockInsuficiente as ex:
+        raise HTTPException(status_code=409, detail=str(ex))
+
+async def confirmar_cambio_stock(id_pedido: int, cambios: Reserva, reserva: Optional[Reserva]):
+    """
+    Después de guardar el cambio, con `cambios` = cantidad nueva - anterior por producto según
+    la base de datos: en el libro descuenta lo que subió, devuelve lo que bajó y libera lo
+    reservado. Sin libro encola el ajuste en la cola de efectos, que solo lo aplica a pedidos
+    pagados por transferencia.
+    """
+    if libro_inventario.activo:
+        if reserva is not None:
+            libro_inventario.ajustar(reserva, cambios)
+    elif any(cambios.values()):
+        await encolar_descuento_stock(id_pedido, [(id_producto, cantidad) for id_producto, cantidad in cambios.items() if cantidad])
+
+cola_efectos.registrar('stock', descontar_stock_pedidos)
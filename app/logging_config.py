@@ -1,19 +1,151 @@
+import os
+import sys
+import json
+import uuid
+import copy
+import queue
+import atexit
+import random
 import logging
+import logging.handlers
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Optional
+
+# Niveles configurables por entorno: LOG_LEVEL para el código de la app (logger "app"),
+# LOG_LEVEL_HTTPX para el cliente HTTP de Supabase y LOG_MUESTREO_DEBUG como fracción
+# (0 a 1) de mensajes DEBUG que se emiten.
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_LEVEL_HTTPX = os.getenv("LOG_LEVEL_HTTPX", "WARNING").upper()
+LOG_MUESTREO_DEBUG = float(os.getenv("LOG_MUESTREO_DEBUG", "0.1"))
+
+CABECERA_REQUEST_ID = "X-Request-ID"
+
+request_id_actual: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+
+# Atributos estándar de LogRecord; el resto viene de `extra=` y se incluye en el JSON
+_ATRIBUTOS_RECORD = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "request_id"}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+class FormatoJSON(logging.Formatter):
+    """Una línea JSON por registro, con request_id y los campos pasados en `extra=`."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        datos = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec="milliseconds"),
+            "nivel": record.levelname,
+            "logger": record.name,
+            "mensaje": record.getMessage(),
+        }
+        request_id = getattr(record, "request_id", None)
+        if request_id:
+            datos["request_id"] = request_id
+
+        for clave, valor in record.__dict__.items():
+            if clave not in _ATRIBUTOS_RECORD:
+                datos[clave] = valor
+
+        if record.exc_text:
+            datos["excepcion"] = record.exc_text
+        return json.dumps(datos, ensure_ascii=False, default=str)
+
+class FiltroRequestId(logging.Filter):
+    """Copia el request id del contexto actual al registro (se ejecuta en el hilo que loguea)."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_actual.get()
+        return True
+
+class FiltroMuestreo(logging.Filter):
+    """Deja pasar solo una fracción `tasa` de los registros DEBUG; los demás niveles pasan siempre."""
+
+    def __init__(self, tasa: float):
+        super().__init__()
+        self.tasa = tasa
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG or self.tasa >= 1:
+            return True
+        return random.random() < self.tasa
+
+class ManejadorCola(logging.handlers.QueueHandler):
+    """
+    QueueHandler que deja el registro listo para formatearse en el hilo del listener:
+    resuelve el mensaje y la traza de la excepción pero conserva los campos de `extra=`.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        record.stack_info = None
+        return record
+
+class MiddlewareRequestId:
+    """
+    Middleware ASGI que asigna a cada petición el request id recibido en X-Request-ID
+    (o uno nuevo), lo deja en el contexto para los logs y lo devuelve en la respuesta.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        request_id = None
+        for nombre, valor in scope["headers"]:
+            if nombre == b"x-request-id":
+                request_id = valor.decode("latin-1")[:128]
+                break
+        request_id = request_id or uuid.uuid4().hex
+
+        async def enviar(mensaje):
+            if mensaje["type"] == "http.response.start":
+                mensaje.setdefault("headers", []).append((b"x-request-id", request_id.encode("latin-1")))
+            await send(mensaje)
+
+        token = request_id_actual.set(request_id)
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            request_id_actual.reset(token)
+
+def _detener_logging():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
 
 # Configurar el nivel de logging para diferentes loggers
 def configure_logging():
-    # Configurar el logger de httpx
-    httpx_logger = logging.getLogger("httpx")
-    httpx_logger.setLevel(logging.WARNING)  # Cambia a WARNING para eliminar los mensajes INFO
-    
-    # También puedes configurar otros loggers si es necesario
-    # fastapi_logger = logging.getLogger("fastapi")
-    # fastapi_logger.setLevel(logging.INFO)
-    
-    # Configuración del formato de logs (opcional)
-    handler = logging.StreamHandler()
-    formatter = logging.Formatter('%(levelname)s - %(name)s: %(message)s')
-    handler.setFormatter(formatter)
-    
-    # Añadir el handler a los loggers
-    httpx_logger.addHandler(handler) 
\ No newline at end of file
+    """
+    Configura el logging de la app: los loggers "app" y "httpx" escriben en una cola en memoria
+    y un QueueListener en un hilo aparte formatea en JSON y escribe a stdout, de modo que el
+    event loop nunca se bloquea en I/O de logs. Se puede llamar más de una vez.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    salida = logging.StreamHandler(sys.stdout)
+    salida.setFormatter(FormatoJSON())
+
+    manejador = ManejadorCola(queue.SimpleQueue())
+    manejador.addFilter(FiltroMuestreo(LOG_MUESTREO_DEBUG))
+    manejador.addFilter(FiltroRequestId())
+
+    for nombre, nivel in (("app", LOG_LEVEL), ("httpx", LOG_LEVEL_HTTPX)):
+        logger = logging.getLogger(nombre)
+        logger.setLevel(nivel)
+        logger.handlers = [manejador]
+        logger.propagate = False
+
+    _listener = logging.handlers.QueueListener(manejador.queue, salida, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_detener_logging)
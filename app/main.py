@@ -1,29 +1,132 @@
-from fastapi import FastAPI
+import os
+import math
+import logging
+import importlib
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Depends
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
-from app.routers import clientes, empleados, pedidos, pedido_producto
-from app.logging_config import configure_logging
+from app.logging_config import configure_logging, MiddlewareRequestId, CABECERA_REQUEST_ID
+from app.cache import cache_entidades
+from app.etag import cache_etags, MiddlewareETag
+from app.compresion import cache_compresion, MiddlewareCompresion
+from app.coalescencia import coalescedor, MiddlewareCoalescencia
+from app.idempotencia import idempotencia, MiddlewareIdempotencia
+from app.metricas import metricas, MiddlewareMetricas
+from app.resiliencia import resiliencia, UpstreamNoDisponible
+from app.conexiones import HTTP_PRECALENTAR, salud
+from app.efectos import cola_efectos
+from app.inventario import libro_inventario
+from app import database
+from app.sesiones import Sesion, sesion_actual
+
+# Con CARGA_PEREZOSA=1 (modo serverless, ver api/index.py) cada router se importa con la primera
+# petición a su prefijo, así un arranque en frío solo paga por el router que se está usando.
+CARGA_PEREZOSA = os.getenv("CARGA_PEREZOSA", "0") == "1"
+
+# Prefijo de la ruta -> módulo del router
+ROUTERS = {
+    "clientes": "app.routers.clientes",
+    "empleados": "app.routers.empleados",
+    "pedidos": "app.routers.pedidos",
+    "pedido-producto": "app.routers.pedido_producto",
+}
+RUTAS_DOCUMENTACION = {"docs", "redoc", "openapi.json"}
+
+_routers_cargados = set()
 
 # Configurar el logging al inicio de la aplicación
 configure_logging()
+logger = logging.getLogger(__name__)
+
+@asynccontextmanager
+async def ciclo_de_vida(app: FastAPI):
+    # En modo serverless el cliente se crea con la primera petición que lo necesita
+    if not CARGA_PEREZOSA and HTTP_PRECALENTAR > 0 and database.SUPABASE_URL and database.SUPABASE_KEY:
+        try:
+            await database.precalentar_conexion()
+        except Exception as ex:
+            logger.warning("No se pudieron precalentar las conexiones a Supabase", extra={"error": str(ex)})
+    if cola_efectos.en_segundo_plano:
+        # Retoma los efectos que quedaron en el diario si el proceso anterior no alcanzó a aplicarlos
+        cola_efectos.iniciar()
+    if libro_inventario.activo and not CARGA_PEREZOSA and database.SUPABASE_URL and database.SUPABASE_KEY:
+        # Reenvía los lotes de stock sin respuesta y carga el stock; si falla, se reintenta con la primera reserva
+        try:
+            await libro_inventario.preparar()
+        except Exception as ex:
+            logger.warning("No se pudo cargar el libro de inventario", extra={"error": str(ex)})
+    yield
+    await libro_inventario.detener()
+    await cola_efectos.detener()
+    await database.cerrar_conexion()
 
 app = FastAPI(
     title="API de gestión de SpinZone",
     version="1.0.0",
-    description="API para gestionar clientes y empleados usando FastAPI y Supabase"
+    description="API para gestionar clientes y empleados usando FastAPI y Supabase",
+    lifespan=ciclo_de_vida,
 )
 
+# El más interno, para que las peticiones coalescidas reciban cada una su ETag y compresión
+app.add_middleware(MiddlewareCoalescencia)
+# Guarda la respuesta sin comprimir; cada repetición se comprime según su propio Accept-Encoding
+app.add_middleware(MiddlewareIdempotencia)
+# Los 304 que responde sin llamar al handler igual pasan por CORS y métricas
+app.add_middleware(MiddlewareETag)
+# Fuera del de ETags, para que el hash se calcule sobre el cuerpo sin comprimir
+app.add_middleware(MiddlewareCompresion)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:3000", "https://sz-frontend.vercel.app", "*"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Siguiente-Cursor", CABECERA_REQUEST_ID, "ETag", "Idempotent-Replayed"],
 )
+app.add_middleware(MiddlewareRequestId)
+app.add_middleware(MiddlewareMetricas)
+
+def cargar_router(prefijo: str):
+    """Importa e incluye el router de `prefijo` si todavía no está cargado."""
+    if prefijo in _routers_cargados:
+        return
+    _routers_cargados.add(prefijo)
+    app.include_router(importlib.import_module(ROUTERS[prefijo]).router)
+    app.openapi_schema = None
+
+def cargar_routers():
+    for prefijo in ROUTERS:
+        cargar_router(prefijo)
 
-app.include_router(clientes.router)
-app.include_router(empleados.router)
-app.include_router(pedidos.router)
-app.include_router(pedido_producto.router)
+class MiddlewareCargaPerezosa:
+    """
+    Middleware ASGI que, antes de enrutar, carga el router correspondiente al primer segmento
+    de la ruta (o todos si se pide la documentación). Es el más externo de la pila para que
+    las rutas ya existan cuando el resto de middlewares y el router de Starlette las busquen.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            segmento = scope["path"].split("/", 2)[1]
+            if segmento in ROUTERS:
+                cargar_router(segmento)
+            elif segmento in RUTAS_DOCUMENTACION:
+                cargar_routers()
+        await self.app(scope, receive, send)
+
+if CARGA_PEREZOSA:
+    app.add_middleware(MiddlewareCargaPerezosa)
+else:
+    cargar_routers()
+
+@app.exception_handler(UpstreamNoDisponible)
+async def upstream_no_disponible(request, ex: UpstreamNoDisponible):
+    # Para las llamadas que no pasan por error_http (dependencias, respuestas en streaming)
+    return JSONResponse({"detail": str(ex)}, status_code=ex.estado, headers={"Retry-After": str(math.ceil(ex.reintentar_en))})
 
 @app.get("/")
 def read_root():
@@ -37,3 +140,93 @@ def read_root():
             {"ruta": "/pedido-producto", "descripcion": "Gestión de productos en pedidos"}
         ]
     }
+
+@app.get("/sesion", response_model=Sesion)
+async def obtener_sesion(sesion: Sesion = Depends(sesion_actual)):
+    return sesion
+
+@app.get("/cache/estadisticas")
+def estadisticas_cache():
+    return {
+        **cache_entidades.estadisticas(),
+        "etags": cache_etags.estadisticas(),
+        "compresion": cache_compresion.estadisticas(),
+        "coalescencia": coalescedor.estadisticas(),
+        "idempotencia": idempotencia.estadisticas(),
+    }
+
+@app.get("/upstream/estado")
+def estado_upstream():
+    return {
+        **resiliencia.estadisticas(),
+        "pools": {nombre: pool.estadisticas() for nombre, pool in database.pools_conexion().items()},
+        "salud": salud.estadisticas(),
+    }
+
+@app.get("/upstream/salud")
+async def salud_upstream():
+    # Una llamada por pool: sirve como readiness check del balanceador
+    resultado = await database.precalentar_conexion(1)
+    return JSONResponse(resultado.estadisticas(), status_code=200 if resultado.ok else 503)
+
+@app.get("/efectos/estado")
+def estado_efectos():
+    return cola_efectos.estadisticas()
+
+@app.get("/inventario/estado")
+def estado_inventario():
+    return libro_inventario.estadisticas()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def exportar_metricas():
+    cache = cache_entidades.estadisticas()
+    coalescencia = coalescedor.totales()
+    pools = list(database.pools_conexion().values())
+    efectos = cola_efectos.estadisticas()
+    inventario = libro_inventario.estadisticas()
+    estados_pool = [pool.estado_pool() for pool in pools]
+    texto = metricas.exportar(
+        contadores={
+            "spinzone_cache_aciertos_total": cache["aciertos"],
+            "spinzone_cache_fallos_total": cache["fallos"],
+            "spinzone_etag_304_total": cache_etags.respuestas_304,
+            "spinzone_etag_304_sin_upstream_total": cache_etags.sin_upstream,
+            "spinzone_compresion_bytes_originales_total": cache_compresion.bytes_originales,
+            "spinzone_compresion_bytes_enviados_total": cache_compresion.bytes_enviados,
+            "spinzone_compresion_cache_aciertos_total": cache_compresion.aciertos,
+            "spinzone_coalescencia_ejecutadas_total": coalescencia["ejecutadas"],
+            "spinzone_coalescencia_coalescidas_total": coalescencia["coalescidas"],
+            "spinzone_coalescencia_reutilizadas_total": coalescencia["reutilizadas"],
+            "spinzone_idempotencia_repeticiones_total": idempotencia.repeticiones,
+            "spinzone_idempotencia_conflictos_total": idempotencia.conflictos,
+            "spinzone_upstream_circuito_aperturas_total": resiliencia.aperturas(),
+            "spinzone_upstream_reintentos_total": resiliencia.reintentos_hechos,
+            "spinzone_upstream_timeouts_total": resiliencia.timeouts,
+            "spinzone_upstream_rechazadas_total": resiliencia.rechazadas,
+            "spinzone_http_pool_conexiones_abiertas_total": sum(pool.conexiones_abiertas for pool in pools),
+            "spinzone_http_pool_espera_segundos_total": round(sum(pool.espera_total for pool in pools), 6),
+            "spinzone_efectos_aplicados_total": efectos["aplicados"],
+            "spinzone_efectos_lotes_total": efectos["lotes"],
+            "spinzone_efectos_reintentos_total": efectos["reintentos"],
+            "spinzone_inventario_rechazos_total": inventario["rechazos"],
+            "spinzone_inventario_volcados_total": inventario["volcados"],
+            "spinzone_inventario_fallos_volcado_total": inventario["fallos_volcado"],
+            "spinzone_inventario_reconciliaciones_total": inventario["reconciliaciones"],
+        },
+        medidores={
+            "spinzone_cache_entradas": cache["entradas"],
+            "spinzone_upstream_circuitos_abiertos": resiliencia.abiertos(),
+            "spinzone_upstream_en_curso": sum(resiliencia.en_curso.values()),
+            "spinzone_http_pool_en_uso": sum(estado["en_uso"] for estado in estados_pool),
+            "spinzone_http_pool_ociosas": sum(estado["ociosas"] for estado in estados_pool),
+            "spinzone_http_pool_en_cola": sum(estado["en_cola"] for estado in estados_pool),
+            "spinzone_efectos_pendientes": efectos["pendientes"],
+            "spinzone_efectos_en_proceso": efectos["en_proceso"],
+            "spinzone_efectos_retraso_segundos": efectos["retraso_segundos"],
+            "spinzone_efectos_fallidos": efectos["fallidas"],
+            "spinzone_inventario_reservado": inventario["reservado"],
+            "spinzone_inventario_pendiente": inventario["pendiente"],
+            "spinzone_inventario_en_vuelo": inventario["en_vuelo"],
+        },
+    )
+    return PlainTextResponse(texto, media_type="text/plain; version=0.0.4")
@@ -0,0 +1,212 @@
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import httpx
+
+BUCKETS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BUCKETS_LLAMADAS = (0, 1, 2, 3, 5, 8, 13, 21)
+
+# Llamadas a PostgREST y segundos acumulados por la petición en curso. Es una lista mutable
+# para que las tareas creadas con asyncio.gather (que copian el contexto) sumen sobre el mismo objeto.
+upstream_actual: ContextVar[Optional[List[float]]] = ContextVar("upstream_actual", default=None)
+
+class Histograma:
+    """Histograma acumulativo al estilo Prometheus con buckets fijos."""
+
+    __slots__ = ("buckets", "conteos", "suma", "total")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.conteos = [0] * len(buckets)
+        self.suma = 0.0
+        self.total = 0
+
+    def observar(self, valor: float):
+        indice = bisect_left(self.buckets, valor)
+        if indice < len(self.conteos):
+            self.conteos[indice] += 1
+        self.suma += valor
+        self.total += 1
+
+    def lineas(self, nombre: str, etiquetas: str) -> List[str]:
+        separador = "," if etiquetas else ""
+        lineas = []
+        acumulado = 0
+        for limite, conteo in zip(self.buckets, self.conteos):
+            acumulado += conteo
+            lineas.append(f'{nombre}_bucket{{{etiquetas}{separador}le="{limite}"}} {acumulado}')
+        lineas.append(f'{nombre}_bucket{{{etiquetas}{separador}le="+Inf"}} {self.total}')
+        lineas.append(f"{nombre}_sum{{{etiquetas}}} {self.suma}")
+        lineas.append(f"{nombre}_count{{{etiquetas}}} {self.total}")
+        return lineas
+
+def _escapar(valor) -> str:
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _etiquetas(**valores) -> str:
+    return ",".join(f'{clave}="{_escapar(valor)}"' for clave, valor in valores.items())
+
+def tabla_de_url(url: "httpx.URL") -> str:
+    """Extrae la tabla (o rpc/<función>) de una URL de PostgREST como /rest/v1/pedido."""
+    partes = [parte for parte in url.path.split("/") if parte]
+    if "v1" in partes:
+        partes = partes[partes.index("v1") + 1:]
+    if not partes:
+        return "desconocida"
+    if partes[0] == "rpc" and len(partes) > 1:
+        return f"rpc/{partes[1]}"
+    return partes[0]
+
+class Metricas:
+    """
+    Registro en memoria de métricas de la API. Todas las actualizaciones ocurren en el
+    event loop, por lo que no necesitan locks; cada observación es una suma y una
+    búsqueda binaria sobre los buckets.
+    """
+
+    def __init__(self):
+        self.peticiones: Dict[Tuple[str, str, int], int] = {}
+        self.errores: Dict[Tuple[str, str], int] = {}
+        self.duracion: Dict[Tuple[str, str], Histograma] = {}
+        self.llamadas_por_peticion: Dict[Tuple[str, str], Histograma] = {}
+        self.upstream_por_peticion: Dict[Tuple[str, str], Histograma] = {}
+        self.upstream_llamadas: Dict[Tuple[str, str, int], int] = {}
+        self.upstream_duracion: Dict[str, Histograma] = {}
+
+    def registrar_peticion(self, metodo: str, ruta: str, estado: int, segundos: float, llamadas: int, segundos_upstream: float):
+        clave = (metodo, ruta)
+        self.peticiones[(metodo, ruta, estado)] = self.peticiones.get((metodo, ruta, estado), 0) + 1
+        if estado >= 500:
+            self.errores[clave] = self.errores.get(clave, 0) + 1
+
+        if clave not in self.duracion:
+            self.duracion[clave] = Histograma(BUCKETS_SEGUNDOS)
+            self.llamadas_por_peticion[clave] = Histograma(BUCKETS_LLAMADAS)
+            self.upstream_por_peticion[clave] = Histograma(BUCKETS_SEGUNDOS)
+        self.duracion[clave].observar(segundos)
+        self.llamadas_por_peticion[clave].observar(llamadas)
+        self.upstream_por_peticion[clave].observar(segundos_upstream)
+
+    def registrar_upstream(self, tabla: str, metodo: str, estado: int, segundos: float):
+        clave = (tabla, metodo, estado)
+        self.upstream_llamadas[clave] = self.upstream_llamadas.get(clave, 0) + 1
+        if tabla not in self.upstream_duracion:
+            self.upstream_duracion[tabla] = Histograma(BUCKETS_SEGUNDOS)
+        self.upstream_duracion[tabla].observar(segundos)
+
+        acumulado = upstream_actual.get()
+        if acumulado is not None:
+            acumulado[0] += 1
+            acumulado[1] += segundos
+
+    def reiniciar(self):
+        self.__init__()
+
+    def exportar(self, contadores: Optional[Dict[str, float]] = None, medidores: Optional[Dict[str, float]] = None) -> str:
+        """
+        Devuelve todas las métricas en el formato de texto de Prometheus (versión 0.0.4), más las
+        de otros módulos: `contadores` (solo crecen, terminan en _total) y `medidores` (valores
+        actuales, que pueden bajar).
+        """
+        lineas = [
+            "# HELP spinzone_http_peticiones_total Peticiones HTTP atendidas por ruta y estado.",
+            "# TYPE spinzone_http_peticiones_total counter",
+        ]
+        for (metodo, ruta, estado), valor in sorted(self.peticiones.items()):
+            lineas.append(f"spinzone_http_peticiones_total{{{_etiquetas(metodo=metodo, ruta=ruta, estado=estado)}}} {valor}")
+
+        lineas += [
+            "# HELP spinzone_http_errores_total Peticiones HTTP respondidas con 5xx.",
+            "# TYPE spinzone_http_errores_total counter",
+        ]
+        for (metodo, ruta), valor in sorted(self.errores.items()):
+            lineas.append(f"spinzone_http_errores_total{{{_etiquetas(metodo=metodo, ruta=ruta)}}} {valor}")
+
+        for nombre, ayuda, histogramas in (
+            ("spinzone_http_duracion_segundos", "Latencia total de la petición, incluida la serialización.", self.duracion),
+            ("spinzone_upstream_segundos_por_peticion", "Tiempo esperando a Supabase dentro de cada petición.", self.upstream_por_peticion),
+            ("spinzone_upstream_llamadas_por_peticion", "Llamadas a Supabase hechas por cada petición.", self.llamadas_por_peticion),
+        ):
+            lineas += [f"# HELP {nombre} {ayuda}", f"# TYPE {nombre} histogram"]
+            for (metodo, ruta), histograma in sorted(histogramas.items()):
+                lineas += histograma.lineas(nombre, _etiquetas(metodo=metodo, ruta=ruta))
+
+        lineas += [
+            "# HELP spinzone_upstream_llamadas_total Llamadas a Supabase por tabla, método y estado.",
+            "# TYPE spinzone_upstream_llamadas_total counter",
+        ]
+        for (tabla, metodo, estado), valor in sorted(self.upstream_llamadas.items()):
+            lineas.append(f"spinzone_upstream_llamadas_total{{{_etiquetas(tabla=tabla, metodo=metodo, estado=estado)}}} {valor}")
+
+        lineas += [
+            "# HELP spinzone_upstream_duracion_segundos Duración de las llamadas a Supabase por tabla.",
+            "# TYPE spinzone_upstream_duracion_segundos histogram",
+        ]
+        for tabla, histograma in sorted(self.upstream_duracion.items()):
+            lineas += histograma.lineas("spinzone_upstream_duracion_segundos", _etiquetas(tabla=tabla))
+
+        for tipo, valores in (("counter", contadores), ("gauge", medidores)):
+            for nombre, valor in (valores or {}).items():
+                lineas += [f"# TYPE {nombre} {tipo}", f"{nombre} {valor}"]
+
+        return "\n".join(lineas) + "\n"
+
+metricas = Metricas()
+
+async def _inicio_upstream(request: "httpx.Request"):
+    request.extensions["inicio_metricas"] = time.perf_counter()
+
+async def _fin_upstream(response: "httpx.Response"):
+    inicio = response.request.extensions.get("inicio_metricas")
+    if inicio is not None:
+        metricas.registrar_upstream(
+            tabla_de_url(response.request.url), response.request.method, response.status_code, time.perf_counter() - inicio
+        )
+
+def instrumentar_cliente(cliente: "httpx.AsyncClient") -> "httpx.AsyncClient":
+    """Añade al cliente httpx los hooks que miden cada llamada a PostgREST (solo una vez)."""
+    hooks = cliente.event_hooks
+    if _inicio_upstream not in hooks["request"]:
+        hooks["request"].append(_inicio_upstream)
+        hooks["response"].append(_fin_upstream)
+        cliente.event_hooks = hooks
+    return cliente
+
+class MiddlewareMetricas:
+    """
+    Middleware ASGI que mide la latencia de cada petición (hasta enviar el último byte)
+    y la asocia a la plantilla de la ruta (por ejemplo /pedidos/{id_pedido}) para que la
+    cardinalidad no dependa de los ids.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        inicio = time.perf_counter()
+        estado = [500]
+
+        async def enviar(mensaje):
+            if mensaje["type"] == "http.response.start":
+                estado[0] = mensaje["status"]
+            await send(mensaje)
+
+        acumulado = [0, 0.0]
+        token = upstream_actual.set(acumulado)
+        try:
+            await self.app(scope, receive, enviar)
+        except Exception:
+            estado[0] = 500
+            raise
+        finally:
+            upstream_actual.reset(token)
+            ruta = getattr(scope.get("route"), "path", None) or "desconocida"
+            metricas.registrar_peticion(
+                scope["method"], ruta, estado[0], time.perf_counter() - inicio, int(acumulado[0]), acumulado[1]
+            )
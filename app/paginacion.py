@@ -0,0 +1,143 @@
+import os
+import json
+from datetime import date, datetime
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Union
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse, StreamingResponse
+
+TAMANO_PAGINA = int(os.getenv("TAMANO_PAGINA", "500"))
+LIMITE_MAXIMO = 1000
+CABECERA_CURSOR = "X-Siguiente-Cursor"
+
+def valor_fecha(valor: str) -> Union[date, datetime]:
+    """Valor de cursor de una columna de fecha: `2025-01-31` o fecha y hora ISO 8601."""
+    try:
+        return date.fromisoformat(valor)
+    except ValueError:
+        return datetime.fromisoformat(valor)
+
+def literal(valor: Any) -> str:
+    """Valor entre comillas para un filtro `or=()` de PostgREST, con `\\` y `"` escapados."""
+    texto = valor.isoformat() if isinstance(valor, date) else str(valor)
+    return '"' + texto.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+class Orden:
+    """
+    Orden de una paginación por cursor: la clave primaria sola o una columna con la clave
+    primaria como desempate, ascendente o descendente. Con columna, el cursor es
+    `<valor>,<pk>` y la página siguiente se pide con
+    `columna > valor OR (columna = valor AND pk > pk_anterior)`, que un índice sobre
+    (columna, pk) resuelve sin recorrer las filas anteriores. La columna no debe tener nulos.
+    `convertir` valida el valor del cursor (ValueError si no es del tipo de la columna) antes
+    de armar el filtro, así un cursor manipulado no puede agregar condiciones a la consulta.
+    """
+
+    def __init__(self, pk: str, columna: Optional[str] = None, descendente: bool = False, convertir: Callable[[str], Any] = str):
+        self.pk = pk
+        self.columna = columna if columna != pk else None
+        self.descendente = descendente
+        self.convertir = convertir
+
+    @classmethod
+    def desde_parametro(cls, pk: str, valor: str, convertir: Callable[[str], Any] = str) -> "Orden":
+        """`fecha` ordena ascendente y `-fecha` descendente."""
+        return cls(pk, valor.lstrip("-"), valor.startswith("-"), convertir)
+
+    def aplicar(self, consulta, after: Optional[Any]):
+        operador = "lt" if self.descendente else "gt"
+        if self.columna is None:
+            if after is not None:
+                if not str(after).lstrip("-").isdigit():
+                    raise HTTPException(status_code=400, detail="Cursor inválido")
+                consulta = getattr(consulta, operador)(self.pk, after)
+            return consulta.order(self.pk, desc=self.descendente)
+
+        if after is not None:
+            valor, separador, pk = str(after).rpartition(",")
+            try:
+                if not separador:
+                    raise ValueError(after)
+                valor, pk = literal(self.convertir(valor)), int(pk)
+            except ValueError:
+                raise HTTPException(status_code=400, detail=f"Cursor inválido para el orden por {self.columna}")
+            consulta = consulta.or_(
+                f'{self.columna}.{operador}.{valor},and({self.columna}.eq.{valor},{self.pk}.{operador}.{pk})'
+            )
+        return consulta.order(self.columna, desc=self.descendente).order(self.pk, desc=self.descendente)
+
+    def cursor(self, fila: Dict) -> str:
+        if self.columna is None:
+            return str(fila[self.pk])
+        return f"{fila[self.columna]},{fila[self.pk]}"
+
+async def obtener_pagina(crear_consulta: Callable[[], Any], pk: str, after: Optional[Any], limit: int, orden: Optional[Orden] = None) -> List[Dict]:
+    """
+    Obtiene una página usando paginación por cursor (keyset): por defecto
+    `pk > after ORDER BY pk LIMIT limit`, que aprovecha el índice de la clave primaria
+    sin importar cuán adelante esté la página.
+
+    Args:
+        crear_consulta: Función que devuelve una consulta nueva (select + filtros) en cada llamada.
+        pk: Columna de la clave primaria usada como cursor.
+        after: Cursor de la última fila ya entregada, o None para empezar desde el principio.
+        limit: Cantidad máxima de filas de la página.
+        orden: Orden distinto al de la clave primaria ascendente.
+    """
+    consulta = (orden or Orden(pk)).aplicar(crear_consulta(), after)
+    response = await consulta.limit(limit).execute()
+    return response.data or []
+
+async def recorrer_paginas(crear_consulta: Callable[[], Any], pk: str, after: Optional[Any] = None, tamano: int = TAMANO_PAGINA, primera: Optional[List[Dict]] = None, orden: Optional[Orden] = None) -> AsyncIterator[Dict]:
+    """Itera todas las filas desde `after` pidiendo a PostgREST una página a la vez."""
+    orden = orden or Orden(pk)
+    pagina = primera if primera is not None else await obtener_pagina(crear_consulta, pk, after, tamano, orden)
+    while True:
+        for fila in pagina:
+            yield fila
+        if len(pagina) < tamano:
+            return
+        pagina = await obtener_pagina(crear_consulta, pk, orden.cursor(pagina[-1]), tamano, orden)
+
+async def listar(crear_consulta: Callable[[], Any], pk: str, after: Optional[Any], limit: Optional[int], stream: bool, orden: Optional[Orden] = None):
+    """
+    Resuelve un endpoint de listado según los parámetros de paginación:
+
+    - `stream=true`: respuesta JSON escrita incrementalmente, página a página, con memoria constante.
+    - `limit` y/o `after`: una sola página; si puede haber más filas, la cabecera
+      X-Siguiente-Cursor trae el valor a usar como `after` en la siguiente petición.
+    - sin parámetros: la lista completa, igual que antes, pero pedida a PostgREST por páginas.
+    """
+    orden = orden or Orden(pk)
+    if stream:
+        return await respuesta_stream(crear_consulta, pk, after, limit or TAMANO_PAGINA, orden)
+
+    if limit is not None or after is not None:
+        limit = limit or TAMANO_PAGINA
+        filas = await obtener_pagina(crear_consulta, pk, after, limit, orden)
+        return respuesta_pagina(filas, orden, limit)
+
+    return [fila async for fila in recorrer_paginas(crear_consulta, pk, orden=orden)]
+
+def respuesta_pagina(filas: List[Dict], orden: Orden, limit: int) -> JSONResponse:
+    response = JSONResponse(content=filas)
+    if len(filas) == limit:
+        response.headers[CABECERA_CURSOR] = orden.cursor(filas[-1])
+    return response
+
+async def respuesta_stream(crear_consulta: Callable[[], Any], pk: str, after: Optional[Any], tamano: int, orden: Optional[Orden] = None) -> StreamingResponse:
+    """
+    Devuelve un arreglo JSON que se va escribiendo a medida que llegan las páginas de PostgREST.
+    La primera página se pide antes de responder para que un error de Supabase todavía
+    pueda devolverse como 500.
+    """
+    primera = await obtener_pagina(crear_consulta, pk, after, tamano, orden)
+
+    async def generar() -> AsyncIterator[bytes]:
+        yield b"["
+        separador = b""
+        async for fila in recorrer_paginas(crear_consulta, pk, after, tamano, primera, orden):
+            yield separador + json.dumps(fila, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+            separador = b","
+        yield b"]"
+
+    return StreamingResponse(generar(), media_type="application/json")
@@ -0,0 +1,80 @@
+from typing import Callable, List, Optional
+from fastapi import HTTPException, Query
+from app.repositorio import Repositorio, repositorios
+
+EMBEBIDOS_MAXIMOS = 2
+
+def _dividir(texto: str) -> List[str]:
+    """Separa por comas de primer nivel: `a,b(c,d),e` -> ['a', 'b(c,d)', 'e']."""
+    partes, nivel, actual = [], 0, ""
+    for caracter in texto:
+        if caracter == "(":
+            nivel += 1
+        elif caracter == ")":
+            nivel -= 1
+            if nivel < 0:
+                raise HTTPException(status_code=400, detail="fields: paréntesis sin abrir")
+        if caracter == "," and nivel == 0:
+            partes.append(actual)
+            actual = ""
+        else:
+            actual += caracter
+    if nivel != 0:
+        raise HTTPException(status_code=400, detail="fields: paréntesis sin cerrar")
+    partes.append(actual)
+    return partes
+
+def armar_select(repositorio: Repositorio, campos: str, profundidad: int = 0) -> str:
+    """
+    Traduce `?fields=` a la lista de select de PostgREST validando cada columna contra los
+    `campos` del repositorio y cada embebido contra sus `relaciones`, recursivamente:
+    `id_pedido,fecha,cliente(nombre,correo)` -> `id_pedido,fecha,cliente(nombre,correo)`.
+    `*` equivale a las columnas por defecto de la tabla y una relación sin paréntesis a las
+    columnas por defecto de la tabla relacionada. La clave primaria se incluye siempre en el
+    primer nivel porque la paginación por cursor la necesita.
+    """
+    if profundidad > EMBEBIDOS_MAXIMOS:
+        raise HTTPException(status_code=400, detail=f"fields: máximo {EMBEBIDOS_MAXIMOS} niveles de embebidos")
+
+    select: List[str] = []
+    for campo in _dividir(campos):
+        nombre, parentesis, interno = campo.strip().partition("(")
+        nombre = nombre.strip()
+
+        if nombre in repositorio.relaciones:
+            relacionado = repositorios[nombre]
+            columnas = armar_select(relacionado, interno[:-1], profundidad + 1) if parentesis else relacionado.columnas
+            select.append(f"{nombre}({columnas})")
+        elif parentesis:
+            raise HTTPException(status_code=400, detail=f"fields: {repositorio.tabla} no tiene la relación '{nombre}'")
+        elif nombre == "*":
+            select.append(repositorio.columnas)
+        elif nombre in repositorio.campos:
+            select.append(nombre)
+        else:
+            raise HTTPException(status_code=400, detail=f"fields: campo no permitido en {repositorio.tabla}: '{nombre}'")
+
+    if profundidad == 0 and repositorio.pk not in select and repositorio.columnas not in select:
+        select.insert(0, repositorio.pk)
+    return ",".join(dict.fromkeys(select))
+
+def incluir(select: str, columna: str) -> str:
+    """Agrega `columna` al primer nivel del select si no está ya (directamente o vía `*`)."""
+    partes = [parte.strip() for parte in _dividir(select)]
+    if columna in partes or "*" in partes:
+        return select
+    return f"{select},{columna}"
+
+def proyeccion(repositorio: Repositorio, por_defecto: Optional[str] = None) -> Callable[..., Optional[str]]:
+    """
+    Dependencia de FastAPI que lee `?fields=` y devuelve el select a pedir a Supabase, o
+    `por_defecto` (None = columnas por defecto del repositorio) si no se envió.
+    """
+    def dependencia(fields: Optional[str] = Query(
+        None, description=f"Columnas a devolver separadas por coma. Permitidas: {', '.join(repositorio.campos)}"
+        + (f"; relaciones: {', '.join(repositorio.relaciones)}, p. ej. {repositorio.relaciones[0]}(...)" if repositorio.relaciones else "")
+    )) -> Optional[str]:
+        if not fields:
+            return por_defecto
+        return armar_select(repositorio, fields)
+    return dependencia
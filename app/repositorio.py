@@ -0,0 +1,244 @@
+import math
+from typing import Any, Callable, Dict, List, Optional, Sequence
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from app.database import get_conexion
+from app.cache import cache_entidades
+from app.paginacion import Orden, listar
+from app.resiliencia import UpstreamNoDisponible
+
+# Códigos de error de Postgres/PostgREST que no son fallas del servidor
+ERRORES_POSTGRES = {
+    "23505": (409, "Ya existe un registro con esos datos"),
+    "23503": (409, "La operación viola una referencia entre tablas"),
+    "23502": (400, "Falta un campo obligatorio"),
+    "22P02": (400, "Formato de dato inválido"),
+    "PGRST116": (404, "Registro no encontrado"),
+}
+
+OPERADORES = {"gt", "gte", "lt", "lte", "neq"}
+
+# Tabla -> repositorio, para resolver las relaciones embebidas
+repositorios: Dict[str, "Repositorio"] = {}
+
+def error_http(ex: Exception, contexto: Optional[str] = None) -> HTTPException:
+    """
+    Traduce cualquier excepción de un handler a la HTTPException que debe recibir el cliente.
+    Las HTTPException se devuelven tal cual, Supabase caído o lento a 503/504 con Retry-After,
+    los errores conocidos de Postgres a su código HTTP correspondiente y el resto a 500.
+
+    Args:
+        ex: Excepción capturada.
+        contexto: Prefijo opcional para el detalle de los errores 500.
+    """
+    if isinstance(ex, HTTPException):
+        return ex
+
+    if isinstance(ex, UpstreamNoDisponible):
+        return HTTPException(status_code=ex.estado, detail=str(ex), headers={"Retry-After": str(math.ceil(ex.reintentar_en))})
+
+    # Import diferido: postgrest ya está cargado si la excepción viene de una consulta
+    from postgrest.exceptions import APIError
+    if isinstance(ex, APIError) and ex.code in ERRORES_POSTGRES:
+        status_code, mensaje = ERRORES_POSTGRES[ex.code]
+        return HTTPException(status_code=status_code, detail=f"{mensaje}: {ex.message}")
+
+    detalle = f"{contexto}: {str(ex)}" if contexto else str(ex)
+    return HTTPException(status_code=500, detail=detalle)
+
+class Repositorio:
+    """
+    Acceso a datos de una tabla de Supabase compartido por los routers.
+    Centraliza la proyección de columnas, la caché de entidades y la conversión de
+    "ninguna fila afectada" en 404, de modo que cada escritura es un solo round trip
+    (update/delete con returning) en lugar de un select de existencia más la escritura.
+
+    `campos` son las columnas que un cliente puede pedir con `?fields=` y `relaciones` las
+    tablas que puede embeber (ver app.proyeccion). En las tablas con columnas secretas,
+    `columnas` es la lista de `campos`, así que ni las lecturas ni el returning de las
+    escrituras las traen desde Supabase.
+    """
+
+    def __init__(
+        self,
+        tabla: str,
+        pk: str,
+        no_encontrado: str,
+        columnas: str = "*",
+        alias: Sequence[str] = (),
+        campos: Sequence[str] = (),
+        relaciones: Sequence[str] = (),
+    ):
+        self.tabla = tabla
+        self.pk = pk
+        self.no_encontrado = no_encontrado
+        self.columnas = columnas
+        self.alias = tuple(alias)
+        self.campos = tuple(campos)
+        self.relaciones = tuple(relaciones)
+        repositorios[tabla] = self
+
+    def _alias(self, fila: Dict) -> Dict[str, Any]:
+        return {campo: fila.get(campo) for campo in self.alias}
+
+    def _invalidar(self, filas: List[Dict]):
+        for fila in filas:
+            if self.pk in fila:
+                cache_entidades.invalidar(self.tabla, fila[self.pk])
+
+    def _filtrar(self, consulta, filtros: Optional[Dict[str, Any]]):
+        """
+        Aplica los filtros: igualdad, `in` si el valor es una lista, o el operador indicado con
+        el sufijo `campo__op` (gt, gte, lt, lte, neq). Los filtros con valor None se ignoran.
+        """
+        for campo, valor in (filtros or {}).items():
+            if valor is None:
+                continue
+            campo, _, operador = campo.partition("__")
+            if operador in OPERADORES:
+                consulta = getattr(consulta, operador)(campo, valor)
+            elif isinstance(valor, (list, tuple, set)):
+                consulta = consulta.in_(campo, list(valor))
+            else:
+                consulta = consulta.eq(campo, valor)
+        return consulta
+
+    async def consultar(self, filtros: Optional[Dict[str, Any]] = None, columnas: Optional[str] = None) -> Callable[[], Any]:
+        """Devuelve una función que arma una consulta nueva (select + filtros) para paginar con app.paginacion."""
+        supabase = await get_conexion()
+        return lambda: self._filtrar(supabase.table(self.tabla).select(columnas or self.columnas), filtros)
+
+    async def obtener(self, valor: Any, columnas: Optional[str] = None) -> Dict:
+        """Devuelve la fila por clave primaria (pasando por la caché) o lanza 404."""
+        usar_cache = columnas is None
+        if usar_cache:
+            fila = cache_entidades.obtener(self.tabla, valor)
+            if fila is not None:
+                return fila
+
+        supabase = await get_conexion()
+        response = await supabase.table(self.tabla).select(columnas or self.columnas).eq(self.pk, valor).execute()
+
+        if not response.data:
+            raise HTTPException(status_code=404, detail=self.no_encontrado)
+
+        if usar_cache:
+            cache_entidades.guardar(self.tabla, valor, response.data[0], alias=self._alias(response.data[0]))
+        return response.data[0]
+
+    async def obtener_por(self, campo: str, valor: Any, columnas: Optional[str] = None) -> Dict:
+        """
+        Devuelve la primera fila con `campo = valor` o lanza 404. Si el campo es un alias
+        registrado (por ejemplo rut) y se usa la proyección por defecto, pasa por la caché.
+        """
+        usar_cache = columnas is None and campo in self.alias
+        if usar_cache:
+            fila = cache_entidades.obtener_por_alias(self.tabla, campo, valor)
+            if fila is not None:
+                return fila
+
+        supabase = await get_conexion()
+        response = await supabase.table(self.tabla).select(columnas or self.columnas).eq(campo, valor).limit(1).execute()
+
+        if not response.data:
+            raise HTTPException(status_code=404, detail=self.no_encontrado)
+
+        if usar_cache:
+            alias = self._alias(response.data[0])
+            alias[campo] = valor
+            cache_entidades.guardar(self.tabla, response.data[0][self.pk], response.data[0], alias=alias)
+        return response.data[0]
+
+    async def buscar(self, filtros: Dict[str, Any], columnas: Optional[str] = None) -> List[Dict]:
+        """Devuelve las filas que cumplen `filtros` (igualdad, o `in` si el valor es una lista)."""
+        supabase = await get_conexion()
+        response = await self._filtrar(supabase.table(self.tabla).select(columnas or self.columnas), filtros).execute()
+        return response.data or []
+
+    async def existe(self, campo: str, valor: Any) -> bool:
+        supabase = await get_conexion()
+        response = await supabase.table(self.tabla).select(self.pk).eq(campo, valor).limit(1).execute()
+        return bool(response.data)
+
+    async def listar(self, after: Optional[Any], limit: Optional[int], stream: bool, filtros: Optional[Dict[str, Any]] = None, columnas: Optional[str] = None, orden: Optional[Orden] = None):
+        """Listado con paginación por cursor, por defecto sobre la clave primaria (ver app.paginacion.listar)."""
+        return await listar(await self.consultar(filtros, columnas), self.pk, after, limit, stream, orden)
+
+    async def insertar(self, datos: Any) -> List[Dict]:
+        supabase = await get_conexion()
+        response = await supabase.table(self.tabla).insert(jsonable_encoder(datos)).select(self.columnas).execute()
+        # Una fila recién creada suele leerse enseguida (el pedido, al agregarle productos)
+        for fila in response.data or []:
+            if self.pk in fila:
+                cache_entidades.guardar(self.tabla, fila[self.pk], fila, alias=self._alias(fila))
+        return response.data or []
+
+    async def upsert(self, datos: List[Dict[str, Any]], on_conflict: str, ignorar_duplicados: bool = False) -> List[Dict]:
+        """
+        Inserta varias filas en un solo round trip. Las que chocan con `on_conflict` se
+        actualizan o, con `ignorar_duplicados`, se omiten y no aparecen en el resultado.
+        """
+        supabase = await get_conexion()
+        response = await supabase.table(self.tabla).upsert(
+            jsonable_encoder(datos), on_conflict=on_conflict, ignore_duplicates=ignorar_duplicados
+        ).select(self.columnas).execute()
+        self._invalidar(response.data or [])
+        return response.data or []
+
+    async def actualizar_donde(self, filtros: Dict[str, Any], datos: Dict[str, Any], no_encontrado: Optional[str] = None) -> List[Dict]:
+        """Actualiza las filas que cumplen `filtros` y las devuelve; lanza 404 si no había ninguna."""
+        supabase = await get_conexion()
+        response = await self._filtrar(supabase.table(self.tabla).update(jsonable_encoder(datos)), filtros).select(self.columnas).execute()
+
+        if not response.data:
+            raise HTTPException(status_code=404, detail=no_encontrado or self.no_encontrado)
+
+        self._invalidar(response.data)
+        return response.data
+
+    async def actualizar(self, valor: Any, datos: Dict[str, Any]) -> Dict:
+        """Actualiza la fila con clave primaria `valor` en un solo round trip; 404 si no existe."""
+        return (await self.actualizar_donde({self.pk: valor}, datos))[0]
+
+    async def eliminar_donde(self, filtros: Dict[str, Any], no_encontrado: Optional[str] = None) -> List[Dict]:
+        """Elimina las filas que cumplen `filtros` y las devuelve; lanza 404 si no había ninguna."""
+        supabase = await get_conexion()
+        response = await self._filtrar(supabase.table(self.tabla).delete(), filtros).select(self.columnas).execute()
+
+        if not response.data:
+            raise HTTPException(status_code=404, detail=no_encontrado or self.no_encontrado)
+
+        self._invalidar(response.data)
+        return response.data
+
+    async def eliminar(self, valor: Any) -> Dict:
+        """Elimina la fila con clave primaria `valor` en un solo round trip; 404 si no existe."""
+        return (await self.eliminar_donde({self.pk: valor}))[0]
+
+# contrasena queda fuera de los campos de cliente y empleado: solo el login la pide explícitamente
+CAMPOS_CLIENTE = ('id_cliente', 'nombre', 'apellido', 'correo', 'telefono', 'direccion', 'id_rol', 'rut')
+CAMPOS_EMPLEADO = ('id_empleado', 'nombre', 'apellido', 'rut', 'correo', 'direccion', 'telefono', 'rol_id')
+
+repo_cliente = Repositorio(
+    'cliente', 'id_cliente', "Cliente no encontrado", columnas=', '.join(CAMPOS_CLIENTE), alias=('rut',),
+    campos=CAMPOS_CLIENTE, relaciones=('pedido',)
+)
+repo_empleado = Repositorio(
+    'empleado', 'id_empleado', "Empleado no encontrado", columnas=', '.join(CAMPOS_EMPLEADO), alias=('rut',),
+    campos=CAMPOS_EMPLEADO
+)
+repo_pedido = Repositorio(
+    'pedido', 'id_pedido', "Pedido no encontrado",
+    campos=('id_pedido', 'fecha', 'medio_pago_id', 'id_estado_envio', 'id_estado', 'id_cliente'),
+    relaciones=('cliente', 'pedido_producto')
+)
+repo_pedido_producto = Repositorio(
+    'pedido_producto', 'id_pedido_producto', "Detalle de pedido-producto no encontrado",
+    campos=('id_pedido_producto', 'id_pedido', 'id_producto', 'cantidad', 'precio_unitario', 'subtotal'),
+    relaciones=('pedido', 'producto')
+)
+repo_producto = Repositorio(
+    'producto', 'id_producto', "Producto no encontrado",
+    campos=('id_producto', 'nombre', 'precio', 'stock'),
+    relaciones=('pedido_producto',)
+)
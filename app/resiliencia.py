@@ -0,0 +1,302 @@
+import os
+import time
+import random
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional, Tuple, TYPE_CHECKING
+from app.metricas import tabla_de_url
+
+if TYPE_CHECKING:
+    import httpx
+
+logger = logging.getLogger(__name__)
+
+UPSTREAM_TIMEOUT = float(os.getenv("UPSTREAM_TIMEOUT", "10"))
+UPSTREAM_CONCURRENCIA = int(os.getenv("UPSTREAM_CONCURRENCIA", "64"))
+UPSTREAM_CONCURRENCIA_TABLA = int(os.getenv("UPSTREAM_CONCURRENCIA_TABLA", "32"))
+UPSTREAM_REINTENTOS = int(os.getenv("UPSTREAM_REINTENTOS", "2"))
+UPSTREAM_BACKOFF = float(os.getenv("UPSTREAM_BACKOFF", "0.05"))
+UPSTREAM_BACKOFF_MAXIMO = float(os.getenv("UPSTREAM_BACKOFF_MAXIMO", "1.0"))
+
+CIRCUITO_UMBRAL = float(os.getenv("CIRCUITO_UMBRAL", "0.5"))
+CIRCUITO_MINIMO = int(os.getenv("CIRCUITO_MINIMO", "20"))
+CIRCUITO_VENTANA = float(os.getenv("CIRCUITO_VENTANA", "10"))
+CIRCUITO_ESPERA = float(os.getenv("CIRCUITO_ESPERA", "5"))
+
+# Estados de PostgREST (o del proxy de Supabase) que indican un problema pasajero
+ESTADOS_REINTENTABLES = {502, 503, 504, 520}
+METODOS_IDEMPOTENTES = {"GET", "HEAD"}
+
+CERRADO, SEMIABIERTO, ABIERTO = "cerrado", "semiabierto", "abierto"
+
+class UpstreamNoDisponible(Exception):
+    """Supabase no respondió a tiempo o está fallando; se traduce a 503 (ver repositorio.error_http)."""
+
+    estado = 503
+
+    def __init__(self, mensaje: str, reintentar_en: float = 1.0):
+        super().__init__(mensaje)
+        self.reintentar_en = reintentar_en
+
+class UpstreamTimeout(UpstreamNoDisponible):
+    estado = 504
+
+class CircuitoAbierto(UpstreamNoDisponible):
+    pass
+
+class Circuito:
+    """
+    Circuit breaker sobre el resultado de las llamadas a Supabase en los últimos `ventana`
+    segundos. Con al menos `minimo` llamadas y una tasa de fallos de `umbral` o más se abre
+    y rechaza todo durante `espera` segundos; después deja pasar una sola llamada de prueba
+    (semiabierto) que lo cierra si sale bien o lo vuelve a abrir si falla.
+    """
+
+    def __init__(self, tabla: str, umbral: float = CIRCUITO_UMBRAL, minimo: int = CIRCUITO_MINIMO,
+                 ventana: float = CIRCUITO_VENTANA, espera: float = CIRCUITO_ESPERA):
+        self.tabla = tabla
+        self.umbral = umbral
+        self.minimo = minimo
+        self.ventana = ventana
+        self.espera = espera
+        self.estado = CERRADO
+        self.aperturas = 0
+        self._abierto_hasta = 0.0
+        self._prueba_en_curso = False
+        self._resultados: Deque[Tuple[float, bool]] = deque()
+        self._fallos = 0
+
+    def _podar(self, ahora: float):
+        while self._resultados and self._resultados[0][0] < ahora - self.ventana:
+            _, fallo = self._resultados.popleft()
+            self._fallos -= fallo
+
+    def permitir(self) -> bool:
+        if self.estado == ABIERTO:
+            if time.monotonic() < self._abierto_hasta:
+                return False
+            self.estado = SEMIABIERTO
+            self._prueba_en_curso = False
+        if self.estado == SEMIABIERTO:
+            if self._prueba_en_curso:
+                return False
+            self._prueba_en_curso = True
+        return True
+
+    def registrar(self, fallo: bool):
+        if self.estado == SEMIABIERTO:
+            self._prueba_en_curso = False
+            if fallo:
+                self._abrir()
+            else:
+                self._cerrar()
+            return
+
+        ahora = time.monotonic()
+        self._resultados.append((ahora, fallo))
+        self._fallos += fallo
+        self._podar(ahora)
+        if self.estado == CERRADO and len(self._resultados) >= self.minimo and self._fallos / len(self._resultados) >= self.umbral:
+            self._abrir()
+
+    def cancelar_prueba(self):
+        """La llamada de prueba no llegó a tener resultado (por ejemplo, se canceló)."""
+        if self.estado == SEMIABIERTO:
+            self._prueba_en_curso = False
+
+    def _abrir(self):
+        logger.warning("Circuito de Supabase abierto", extra={"tabla": self.tabla, "tasa_fallos": round(self.tasa_fallos(), 3), "espera": self.espera})
+        self.estado = ABIERTO
+        self.aperturas += 1
+        self._abierto_hasta = time.monotonic() + self.espera
+
+    def _cerrar(self):
+        logger.info("Circuito de Supabase cerrado", extra={"tabla": self.tabla})
+        self.estado = CERRADO
+        self._resultados.clear()
+        self._fallos = 0
+
+    def tasa_fallos(self) -> float:
+        self._podar(time.monotonic())
+        return self._fallos / len(self._resultados) if self._resultados else 0.0
+
+    def reabre_en(self) -> float:
+        return max(0.0, self._abierto_hasta - time.monotonic()) if self.estado == ABIERTO else 0.0
+
+    def estadisticas(self) -> Dict[str, Any]:
+        tasa = self.tasa_fallos()
+        return {
+            "estado": self.estado,
+            "tasa_fallos": round(tasa, 4),
+            "llamadas_ventana": len(self._resultados),
+            "aperturas": self.aperturas,
+            "reabre_en": round(self.reabre_en(), 3),
+            "umbral": self.umbral,
+            "minimo": self.minimo,
+            "ventana_segundos": self.ventana,
+            "espera_segundos": self.espera,
+        }
+
+class Resiliencia:
+    """
+    Política que se aplica a cada llamada a PostgREST: concurrencia acotada en total y por
+    tabla (esperar un turno cuenta para el timeout), un timeout por llamada que incluye leer
+    el cuerpo, reintentos con backoff exponencial y jitter solo para GET/HEAD que fallaron por
+    un error de conexión o un 502/503/504, y el Circuito.
+    Cuando no hay respuesta útil lanza UpstreamNoDisponible en lugar de devolver el 5xx, así
+    postgrest no vuelve a reintentar por su cuenta.
+    """
+
+    def __init__(self, timeout: float = UPSTREAM_TIMEOUT, concurrencia: int = UPSTREAM_CONCURRENCIA,
+                 concurrencia_tabla: int = UPSTREAM_CONCURRENCIA_TABLA, reintentos: int = UPSTREAM_REINTENTOS,
+                 backoff: float = UPSTREAM_BACKOFF, backoff_maximo: float = UPSTREAM_BACKOFF_MAXIMO,
+                 crear_circuito: Callable[[str], Circuito] = Circuito):
+        self.timeout = timeout
+        self.concurrencia = concurrencia
+        self.concurrencia_tabla = concurrencia_tabla
+        self.reintentos = reintentos
+        self.backoff = backoff
+        self.backoff_maximo = backoff_maximo
+        # Un circuito por tabla (o rpc/<función>): una tabla lenta no corta las lecturas de las demás
+        self.crear_circuito = crear_circuito
+        self.circuitos: Dict[str, Circuito] = {}
+        # Se crean con la primera llamada para quedar en el event loop que las usa
+        self._semaforo: Optional[asyncio.Semaphore] = None
+        self._semaforos_tabla: Dict[str, asyncio.Semaphore] = {}
+        self.en_curso: Dict[str, int] = {}
+        self.timeouts = 0
+        self.reintentos_hechos = 0
+        self.rechazadas = 0
+
+    def _semaforos(self, tabla: str) -> Tuple[asyncio.Semaphore, asyncio.Semaphore]:
+        if self._semaforo is None:
+            self._semaforo = asyncio.Semaphore(self.concurrencia)
+        semaforo_tabla = self._semaforos_tabla.get(tabla)
+        if semaforo_tabla is None:
+            semaforo_tabla = self._semaforos_tabla[tabla] = asyncio.Semaphore(self.concurrencia_tabla)
+        return self._semaforo, semaforo_tabla
+
+    def reiniciar_semaforos(self):
+        """Descarta los semáforos (quedan asociados al event loop en que se usaron)."""
+        self._semaforo = None
+        self._semaforos_tabla.clear()
+        self.en_curso.clear()
+
+    def circuito(self, tabla: str) -> Circuito:
+        circuito = self.circuitos.get(tabla)
+        if circuito is None:
+            circuito = self.circuitos[tabla] = self.crear_circuito(tabla)
+        return circuito
+
+    def espera_reintento(self, intento: int) -> float:
+        """Full jitter: uniforme entre 0 y backoff·2^intento, acotado."""
+        return random.uniform(0, min(self.backoff_maximo, self.backoff * 2 ** intento))
+
+    async def _intentar(self, transporte, request: "httpx.Request", tabla: str) -> "httpx.Response":
+        global_, por_tabla = self._semaforos(tabla)
+        async with global_, por_tabla:
+            self.en_curso[tabla] = self.en_curso.get(tabla, 0) + 1
+            try:
+                response = await transporte.handle_async_request(request)
+                try:
+                    await response.aread()
+                except BaseException:
+                    await response.aclose()
+                    raise
+                return response
+            finally:
+                self.en_curso[tabla] -= 1
+
+    async def enviar(self, transporte, request: "httpx.Request") -> "httpx.Response":
+        import httpx
+
+        tabla = tabla_de_url(request.url)
+        circuito = self.circuito(tabla)
+        lectura = request.method in METODOS_IDEMPOTENTES
+        intentos = 1 + (self.reintentos if lectura else 0)
+        error: Optional[UpstreamNoDisponible] = None
+
+        for intento in range(intentos):
+            if intento:
+                self.reintentos_hechos += 1
+                await asyncio.sleep(self.espera_reintento(intento - 1))
+
+            if not circuito.permitir():
+                self.rechazadas += 1
+                raise CircuitoAbierto(
+                    f"Supabase no está disponible ({tabla}); reintente en unos segundos", max(1.0, circuito.reabre_en())
+                )
+
+            try:
+                response = await asyncio.wait_for(self._intentar(transporte, request, tabla), self.timeout)
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                circuito.registrar(True)
+                error = UpstreamTimeout(f"Supabase no respondió en {self.timeout:g} s ({tabla})")
+                # Reintentar contra un Supabase lento solo le suma carga y duplica la espera
+                break
+            except httpx.TransportError as ex:
+                circuito.registrar(True)
+                error = UpstreamNoDisponible(f"Error de conexión con Supabase ({tabla}): {ex.__class__.__name__}")
+                continue
+            except BaseException:
+                circuito.cancelar_prueba()
+                raise
+
+            fallo = response.status_code >= 500
+            circuito.registrar(fallo)
+            if not (fallo and lectura and response.status_code in ESTADOS_REINTENTABLES):
+                return response
+            error = UpstreamNoDisponible(f"Supabase respondió {response.status_code} ({tabla})")
+
+        logger.warning("Llamada a Supabase fallida", extra={"tabla": tabla, "metodo": request.method, "intentos": intento + 1, "error": str(error)})
+        raise error
+
+    def abiertos(self) -> int:
+        """Circuitos que no están cerrados (abiertos o a la espera de la llamada de prueba)."""
+        return sum(1 for circuito in self.circuitos.values() if circuito.estado != CERRADO)
+
+    def aperturas(self) -> int:
+        return sum(circuito.aperturas for circuito in self.circuitos.values())
+
+    def estadisticas(self) -> Dict[str, Any]:
+        return {
+            "circuitos_abiertos": self.abiertos(),
+            "circuitos": {tabla: circuito.estadisticas() for tabla, circuito in sorted(self.circuitos.items())},
+            "timeout_segundos": self.timeout,
+            "concurrencia": {
+                "maxima": self.concurrencia,
+                "maxima_por_tabla": self.concurrencia_tabla,
+                "en_curso": sum(self.en_curso.values()),
+                "por_tabla": {tabla: n for tabla, n in sorted(self.en_curso.items()) if n},
+            },
+            "reintentos": self.reintentos_hechos,
+            "timeouts": self.timeouts,
+            "rechazadas": self.rechazadas,
+        }
+
+resiliencia = Resiliencia()
+
+class TransporteResiliente:
+    """
+    Transporte httpx que pasa cada llamada por `politica` antes de enviarla por `transporte`.
+    Lo arma app.conexiones.crear_cliente_http.
+    """
+
+    def __init__(self, transporte, politica: Resiliencia):
+        self.transporte = transporte
+        self.politica = politica
+
+    async def handle_async_request(self, request: "httpx.Request") -> "httpx.Response":
+        return await self.politica.enviar(self.transporte, request)
+
+    async def __aenter__(self):
+        await self.transporte.__aenter__()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.transporte.__aexit__(*args)
+
+    async def aclose(self):
+        await self.transporte.aclose()
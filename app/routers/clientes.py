@@ -1,5 +1,11 @@
-from fastapi import APIRouter, HTTPException, Body
-from app.database import get_conexion
+from fastapi import APIRouter, HTTPException, Body, Query, BackgroundTasks, Request, Depends
+from app.paginacion import LIMITE_MAXIMO
+from app.repositorio import repo_cliente, error_http
+from app.proyeccion import proyeccion
+from app.rut import format_rut
+from app.importacion import Importacion, leer_filas, detectar_formato, IMPORTACION_LOTE, LOTE_MAXIMO
+from app.sesiones import respuesta_sesion
+from app.contrasenas import hashear_contrasena, hashear_contrasenas, verificar_contrasena, necesita_rehash, actualizar_hash
 from typing import Optional, Dict
 from pydantic import BaseModel
 
@@ -7,6 +13,16 @@ class LoginRequest(BaseModel):
     correo: str
     contrasena: str
 
+class ClienteCreate(BaseModel):
+    nombre: str
+    apellido: str
+    correo: str
+    telefono: str
+    direccion: str
+    id_rol: int
+    rut: str
+    contrasena: str
+
 class ClienteUpdate(BaseModel):
     nombre: Optional[str] = None
     apellido: Optional[str] = None
@@ -23,37 +39,21 @@ router = APIRouter(
 )
 
 @router.get("/")
-def obtener_clientes():
+async def obtener_clientes(after: Optional[int] = None, limit: Optional[int] = Query(None, ge=1, le=LIMITE_MAXIMO), stream: bool = False, columnas: Optional[str] = Depends(proyeccion(repo_cliente))):
     try:
-        supabase = get_conexion()
-        
-        response = supabase.table('cliente').select('*').execute()
-        
-        if not response.data:
-            return []
-        
-        return response.data
+        return await repo_cliente.listar(after, limit, stream, columnas=columnas)
     except Exception as ex:
-        raise HTTPException(status_code=500, detail=str(ex))
+        raise error_http(ex)
 
 @router.get("/{id_cliente}")
-def obtener_cliente(id_cliente: int):
+async def obtener_cliente(id_cliente: int, columnas: Optional[str] = Depends(proyeccion(repo_cliente))):
     try:
-        supabase = get_conexion()
-        
-        response = supabase.table('cliente').select('*').eq('id_cliente', id_cliente).execute()
-        
-        if not response.data or len(response.data) == 0:
-            raise HTTPException(status_code=404, detail="Cliente no encontrado")
-        
-        return response.data[0]
+        return await repo_cliente.obtener(id_cliente, columnas)
     except Exception as ex:
-        if isinstance(ex, HTTPException):
-            raise ex
-        raise HTTPException(status_code=500, detail=str(ex))
+        raise error_http(ex)
 
 @router.post("/")
-def agregar_cliente(
+async def agregar_cliente(
     nombre: str, 
     apellido: str, 
     correo: str, 
@@ -64,9 +64,7 @@ def agregar_cliente(
     contrasena: str
 ):
     try:
-        supabase = get_conexion()
-        
-        response = supabase.table('cliente').insert({
+        clientes = await repo_cliente.insertar({
             "nombre": nombre,
             "apellido": apellido,
             "correo": correo,
@@ -74,18 +72,40 @@ def agregar_cliente(
             "direccion": direccion,
             "id_rol": id_rol,
             "rut": rut,
-            "contrasena": contrasena
-        }).execute()
+            "contrasena": await hashear_contrasena(contrasena)
+        })
         
-        if response.data:
-            return {"mensaje": "Cliente agregado con éxito", "cliente": response.data[0]}
+        if clientes:
+            return {"mensaje": "Cliente agregado con éxito", "cliente": clientes[0]}
         else:
             raise HTTPException(status_code=500, detail="Error al agregar cliente")
     except Exception as ex:
-        raise HTTPException(status_code=500, detail=str(ex))
+        raise error_http(ex)
+
+def validar_cliente(fila: Dict) -> Dict:
+    datos = ClienteCreate(**fila).dict()
+    datos["rut"] = format_rut(datos["rut"])
+    return datos
+
+@router.post("/bulk")
+async def importar_clientes(
+    request: Request,
+    formato: Optional[str] = Query(None, pattern="^(ndjson|csv)$"),
+    actualizar: bool = False,
+    lote: int = Query(IMPORTACION_LOTE, ge=1, le=LOTE_MAXIMO)
+):
+    """
+    Importa clientes desde un cuerpo NDJSON o CSV (según `formato` o el Content-Type).
+    Con `actualizar=true` los RUT existentes se sobrescriben; si no, se reportan como error.
+    """
+    try:
+        importacion = Importacion(repo_cliente, 'rut', validar_cliente, hashear_contrasenas, actualizar, lote)
+        return await importacion.ejecutar(leer_filas(request, detectar_formato(request, formato)))
+    except Exception as ex:
+        raise error_http(ex)
 
 @router.put("/{id_cliente}")
-def actualizar_cliente(
+async def actualizar_cliente(
     id_cliente: int,
     cliente: ClienteUpdate
 ):
@@ -94,72 +114,44 @@ def actualizar_cliente(
         if not datos_actualizar:
             raise HTTPException(status_code=400, detail="Debe proporcionar al menos un campo para actualizar")
         
-        supabase = get_conexion()
-        
-        check_response = supabase.table('cliente').select('id_cliente').eq('id_cliente', id_cliente).execute()
-        if not check_response.data or len(check_response.data) == 0:
-            raise HTTPException(status_code=404, detail="Cliente no encontrado")
+        if "contrasena" in datos_actualizar:
+            datos_actualizar["contrasena"] = await hashear_contrasena(datos_actualizar["contrasena"])
         
-        response = supabase.table('cliente').update(datos_actualizar).eq('id_cliente', id_cliente).execute()
+        cliente_actualizado = await repo_cliente.actualizar(id_cliente, datos_actualizar)
         
-        return {"mensaje": "Cliente actualizado con éxito", "cliente": response.data[0]}
+        return {"mensaje": "Cliente actualizado con éxito", "cliente": cliente_actualizado}
     except Exception as ex:
-        if isinstance(ex, HTTPException):
-            raise ex
-        raise HTTPException(status_code=500, detail=str(ex))
+        raise error_http(ex)
 
 @router.delete("/{id_cliente}")
-def eliminar_cliente(id_cliente: int):
+async def eliminar_cliente(id_cliente: int):
     try:
-        supabase = get_conexion()
-        
-        check_response = supabase.table('cliente').select('id_cliente').eq('id_cliente', id_cliente).execute()
-        if not check_response.data or len(check_response.data) == 0:
-            raise HTTPException(status_code=404, detail="Cliente no encontrado")
-        
-        response = supabase.table('cliente').delete().eq('id_cliente', id_cliente).execute()
+        await repo_cliente.eliminar(id_cliente)
         
         return {"mensaje": "Cliente eliminado con éxito"}
     except Exception as ex:
-        if isinstance(ex, HTTPException):
-            raise ex
-        raise HTTPException(status_code=500, detail=str(ex))
+        raise error_http(ex)
 
 @router.get("/rut/{rut}")
-def obtener_cliente_por_rut(rut: str):
+async def obtener_cliente_por_rut(rut: str, columnas: Optional[str] = Depends(proyeccion(repo_cliente))):
     try:
-        supabase = get_conexion()
-        
-        response = supabase.table('cliente').select('*').eq('rut', rut).execute()
-        
-        if not response.data or len(response.data) == 0:
-            raise HTTPException(status_code=404, detail="Cliente no encontrado")
-        
-        return response.data[0]
+        return await repo_cliente.obtener_por('rut', rut, columnas)
     except Exception as ex:
-        if isinstance(ex, HTTPException):
-            raise ex
-        raise HTTPException(status_code=500, detail=str(ex))
+        raise error_http(ex)
 
 @router.post("/login", status_code=200)
-def login_cliente(login_data: LoginRequest):
+async def login_cliente(login_data: LoginRequest, background_tasks: BackgroundTasks):
     try:
-        supabase = get_conexion()
-        
-        response = supabase.table('cliente').select('*').eq('correo', login_data.correo).execute()
+        cliente = await repo_cliente.obtener_por('correo', login_data.correo, f"{repo_cliente.columnas}, contrasena")
         
-        if not response.data or len(response.data) == 0:
-            raise HTTPException(status_code=404, detail="Cliente no encontrado")
-        
-        cliente = response.data[0]
-        
-        if cliente['contrasena'] != login_data.contrasena:
+        if not await verificar_contrasena(login_data.contrasena, cliente['contrasena']):
             raise HTTPException(status_code=401, detail="Contraseña incorrecta")
         
+        if necesita_rehash(cliente['contrasena']):
+            background_tasks.add_task(actualizar_hash, repo_cliente, cliente['id_cliente'], login_data.contrasena)
+        
         del cliente['contrasena']
         
-        return {"mensaje": "Inicio de sesión exitoso", "cliente": cliente}
+        return {"mensaje": "Inicio de sesión exitoso", "cliente": cliente, **respuesta_sesion("cliente", cliente['id_cliente'], cliente.get('id_rol'))}
     except Exception as ex:
-        if isinstance(ex, HTTPException):
-            raise ex
-        raise HTTPException(status_code=500, detail=str(ex)) 
\ No newline at end of file
+        raise error_http(ex)
@@ -1,5 +1,11 @@
-from fastapi import APIRouter, HTTPException, Body
-from app.database import get_conexion
+from fastapi import APIRouter, HTTPException, Body, Query, BackgroundTasks, Request, Depends
+from app.paginacion import LIMITE_MAXIMO
+from app.repositorio import repo_empleado, error_http
+from app.proyeccion import proyeccion
+from app.rut import format_rut
+from app.importacion import Importacion, leer_filas, detectar_formato, IMPORTACION_LOTE, LOTE_MAXIMO
+from app.sesiones import respuesta_sesion
+from app.contrasenas import hashear_contrasena, hashear_contrasenas, verificar_contrasena, necesita_rehash, actualizar_hash
 from typing import Optional, Dict
 from pydantic import BaseModel
 
@@ -17,82 +23,75 @@ class EmpleadoCreate(BaseModel):
     telefono: str
     rol_id: int
 
-def format_rut(rut: str) -> str:
-    rut = rut.strip().replace(" ", "").replace(".", "")
-    
-    if "-" not in rut and len(rut) >= 2:
-        rut = rut[:-1] + "-" + rut[-1]
-    
-    return rut
-
 router = APIRouter(
     prefix="/empleados",
     tags=["Empleados"]
 )
 
 @router.get("/")
-def obtener_empleados():
+async def obtener_empleados(after: Optional[int] = None, limit: Optional[int] = Query(None, ge=1, le=LIMITE_MAXIMO), stream: bool = False, columnas: Optional[str] = Depends(proyeccion(repo_empleado))):
     try:
-        supabase = get_conexion()
-        
-        response = supabase.table('empleado').select('*').execute()
-        
-        if not response.data:
-            return []
-        
-        return response.data
+        return await repo_empleado.listar(after, limit, stream, columnas=columnas)
     except Exception as ex:
-        raise HTTPException(status_code=500, detail=str(ex))
+        raise error_http(ex)
 
 @router.get("/{id_empleado}")
-def obtener_empleado(id_empleado: int):
+async def obtener_empleado(id_empleado: int, columnas: Optional[str] = Depends(proyeccion(repo_empleado))):
     try:
-        supabase = get_conexion()
-        
-        response = supabase.table('empleado').select('*').eq('id_empleado', id_empleado).execute()
-        
-        if not response.data or len(response.data) == 0:
-            raise HTTPException(status_code=404, detail="Empleado no encontrado")
-        
-        return response.data[0]
+        return await repo_empleado.obtener(id_empleado, columnas)
     except Exception as ex:
-        if isinstance(ex, HTTPException):
-            raise ex
-        raise HTTPException(status_code=500, detail=str(ex))
+        raise error_http(ex)
 
 @router.post("/")
-def agregar_empleado(empleado: EmpleadoCreate):
+async def agregar_empleado(empleado: EmpleadoCreate):
     try:
         rut_formateado = format_rut(empleado.rut)
         
-        supabase = get_conexion()
-        
-        check_rut = supabase.table('empleado').select('id_empleado').eq('rut', rut_formateado).execute()
-        if check_rut.data and len(check_rut.data) > 0:
+        if await repo_empleado.existe('rut', rut_formateado):
             raise HTTPException(status_code=409, detail=f"Ya existe un empleado con el RUT: {rut_formateado}")
         
-        response = supabase.table('empleado').insert({
+        empleados = await repo_empleado.insertar({
             "nombre": empleado.nombre,
             "apellido": empleado.apellido,
             "rut": rut_formateado,
             "correo": empleado.correo,
-            "contrasena": empleado.contrasena,
+            "contrasena": await hashear_contrasena(empleado.contrasena),
             "direccion": empleado.direccion,
             "telefono": empleado.telefono,
             "rol_id": empleado.rol_id
-        }).execute()
+        })
         
-        if response.data:
-            return {"mensaje": "Empleado agregado con éxito", "empleado": response.data[0]}
+        if empleados:
+            return {"mensaje": "Empleado agregado con éxito", "empleado": empleados[0]}
         else:
             raise HTTPException(status_code=500, detail="Error al agregar empleado")
     except Exception as ex:
-        if isinstance(ex, HTTPException):
-            raise ex
-        raise HTTPException(status_code=500, detail=f"Error al crear empleado: {str(ex)}")
+        raise error_http(ex, "Error al crear empleado")
+
+def validar_empleado(fila: Dict) -> Dict:
+    datos = EmpleadoCreate(**fila).dict()
+    datos["rut"] = format_rut(datos["rut"])
+    return datos
+
+@router.post("/bulk")
+async def importar_empleados(
+    request: Request,
+    formato: Optional[str] = Query(None, pattern="^(ndjson|csv)$"),
+    actualizar: bool = False,
+    lote: int = Query(IMPORTACION_LOTE, ge=1, le=LOTE_MAXIMO)
+):
+    """
+    Importa empleados desde un cuerpo NDJSON o CSV (según `formato` o el Content-Type).
+    Con `actualizar=true` los RUT existentes se sobrescriben; si no, se reportan como error.
+    """
+    try:
+        importacion = Importacion(repo_empleado, 'rut', validar_empleado, hashear_contrasenas, actualizar, lote)
+        return await importacion.ejecutar(leer_filas(request, detectar_formato(request, formato)))
+    except Exception as ex:
+        raise error_http(ex)
 
 @router.put("/{id_empleado}")
-def actualizar_empleado(
+async def actualizar_empleado(
     id_empleado: int,
     nombre: Optional[str] = None,
     apellido: Optional[str] = None,
@@ -107,12 +106,6 @@ def actualizar_empleado(
         if not any([nombre, apellido, rut, correo, contrasena, direccion, telefono, rol_id]):
             raise HTTPException(status_code=400, detail="Debe proporcionar al menos un campo para actualizar")
         
-        supabase = get_conexion()
-        
-        check_response = supabase.table('empleado').select('id_empleado').eq('id_empleado', id_empleado).execute()
-        if not check_response.data or len(check_response.data) == 0:
-            raise HTTPException(status_code=404, detail="Empleado no encontrado")
-        
         datos_actualizar = {}
         if nombre is not None:
             datos_actualizar["nombre"] = nombre
@@ -123,7 +116,7 @@ def actualizar_empleado(
         if correo is not None:
             datos_actualizar["correo"] = correo
         if contrasena is not None:
-            datos_actualizar["contrasena"] = contrasena
+            datos_actualizar["contrasena"] = await hashear_contrasena(contrasena)
         if direccion is not None:
             datos_actualizar["direccion"] = direccion
         if telefono is not None:
@@ -131,66 +124,41 @@ def actualizar_empleado(
         if rol_id is not None:
             datos_actualizar["rol_id"] = rol_id
         
-        response = supabase.table('empleado').update(datos_actualizar).eq('id_empleado', id_empleado).execute()
+        empleado_actualizado = await repo_empleado.actualizar(id_empleado, datos_actualizar)
         
-        return {"mensaje": "Empleado actualizado con éxito", "empleado": response.data[0]}
+        return {"mensaje": "Empleado actualizado con éxito", "empleado": empleado_actualizado}
     except Exception as ex:
-        if isinstance(ex, HTTPException):
-            raise ex
-        raise HTTPException(status_code=500, detail=str(ex))
+        raise error_http(ex)
 
 @router.delete("/{id_empleado}")
-def eliminar_empleado(id_empleado: int):
+async def eliminar_empleado(id_empleado: int):
     try:
-        supabase = get_conexion()
-        
-        check_response = supabase.table('empleado').select('id_empleado').eq('id_empleado', id_empleado).execute()
-        if not check_response.data or len(check_response.data) == 0:
-            raise HTTPException(status_code=404, detail="Empleado no encontrado")
-        
-        response = supabase.table('empleado').delete().eq('id_empleado', id_empleado).execute()
+        await repo_empleado.eliminar(id_empleado)
         
         return {"mensaje": "Empleado eliminado con éxito"}
     except Exception as ex:
-        if isinstance(ex, HTTPException):
-            raise ex
-        raise HTTPException(status_code=500, detail=str(ex))
+        raise error_http(ex)
 
 @router.get("/rut/{rut}")
-def obtener_empleado_por_rut(rut: str):
+async def obtener_empleado_por_rut(rut: str, columnas: Optional[str] = Depends(proyeccion(repo_empleado))):
     try:
-        supabase = get_conexion()
-        
-        response = supabase.table('empleado').select('*').eq('rut', rut).execute()
-        
-        if not response.data or len(response.data) == 0:
-            raise HTTPException(status_code=404, detail="Empleado no encontrado")
-        
-        return response.data[0]
+        return await repo_empleado.obtener_por('rut', rut, columnas)
     except Exception as ex:
-        if isinstance(ex, HTTPException):
-            raise ex
-        raise HTTPException(status_code=500, detail=str(ex))
+        raise error_http(ex)
 
 @router.post("/login", status_code=200)
-def login_empleado(login_data: LoginRequest):
+async def login_empleado(login_data: LoginRequest, background_tasks: BackgroundTasks):
     try:
-        supabase = get_conexion()
-        
-        response = supabase.table('empleado').select('*').eq('correo', login_data.correo).execute()
+        empleado = await repo_empleado.obtener_por('correo', login_data.correo, f"{repo_empleado.columnas}, contrasena")
         
-        if not response.data or len(response.data) == 0:
-            raise HTTPException(status_code=404, detail="Empleado no encontrado")
-        
-        empleado = response.data[0]
-        
-        if empleado['contrasena'] != login_data.contrasena:
+        if not await verificar_contrasena(login_data.contrasena, empleado['contrasena']):
             raise HTTPException(status_code=401, detail="Contraseña incorrecta")
         
+        if necesita_rehash(empleado['contrasena']):
+            background_tasks.add_task(actualizar_hash, repo_empleado, empleado['id_empleado'], login_data.contrasena)
+        
         del empleado['contrasena']
         
-        return {"mensaje": "Inicio de sesión exitoso", "empleado": empleado}
+        return {"mensaje": "Inicio de sesión exitoso", "empleado": empleado, **respuesta_sesion("empleado", empleado['id_empleado'], empleado.get('rol_id'))}
     except Exception as ex:
-        if isinstance(ex, HTTPException):
-            raise ex
-        raise HTTPException(status_code=500, detail=str(ex)) 
\ No newline at end of file
+        raise error_http(ex) 
\ No newline at end of file
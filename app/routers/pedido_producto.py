@@ -1,8 +1,16 @@
-from fastapi import APIRouter, HTTPException
-from app.database import get_conexion
+import asyncio
+import logging
+from fastapi import APIRouter, HTTPException, Query, Depends
+from app.paginacion import LIMITE_MAXIMO
+from app.inventario import reservar_stock, confirmar_stock, liberar_stock, reservar_cambio_stock, confirmar_cambio_stock
+from app.ventas import indice_ventas, encolar_ventas, actualizar_linea_pedido
+from app.repositorio import repo_pedido, repo_pedido_producto, repo_producto, error_http
+from app.proyeccion import proyeccion
 from typing import Optional, List
 from pydantic import BaseModel
 
+logger = logging.getLogger(__name__)
+
 class PedidoProductoBase(BaseModel):
     cantidad: int
     precio_unitario: int
@@ -27,50 +35,36 @@ router = APIRouter(
 )
 
 @router.get("/pedido/{id_pedido}")
-def obtener_productos_por_pedido(id_pedido: int):
+async def obtener_productos_por_pedido(id_pedido: int, after: Optional[int] = None, limit: Optional[int] = Query(None, ge=1, le=LIMITE_MAXIMO), stream: bool = False, columnas: Optional[str] = Depends(proyeccion(repo_pedido_producto))):
     try:
-        supabase = get_conexion()
-        
-        check_pedido = supabase.table('pedido').select('id_pedido').eq('id_pedido', id_pedido).execute()
-        if not check_pedido.data or len(check_pedido.data) == 0:
+        existe_pedido, response = await asyncio.gather(
+            repo_pedido.existe('id_pedido', id_pedido),
+            repo_pedido_producto.listar(after, limit, stream, filtros={'id_pedido': id_pedido}, columnas=columnas)
+        )
+        if not existe_pedido:
             raise HTTPException(status_code=404, detail="Pedido no encontrado")
         
-        response = supabase.table('pedido_producto').select('*').eq('id_pedido', id_pedido).execute()
-        
-        if not response.data:
-            return []
-        
-        return response.data
+        return response
     except Exception as ex:
-        if isinstance(ex, HTTPException):
-            raise ex
-        raise HTTPException(status_code=500, detail=str(ex))
+        raise error_http(ex)
 
 @router.get("/producto/{id_producto}")
-def obtener_pedidos_por_producto(id_producto: int):
+async def obtener_pedidos_por_producto(id_producto: int, columnas: Optional[str] = Depends(proyeccion(repo_pedido_producto))):
     try:
-        supabase = get_conexion()
-        
-        check_producto = supabase.table('producto').select('id_producto').eq('id_producto', id_producto).execute()
-        if not check_producto.data or len(check_producto.data) == 0:
+        existe_producto, response = await asyncio.gather(
+            repo_producto.existe('id_producto', id_producto),
+            repo_pedido_producto.listar(None, None, False, filtros={'id_producto': id_producto}, columnas=columnas)
+        )
+        if not existe_producto:
             raise HTTPException(status_code=404, detail="Producto no encontrado")
         
-        response = supabase.table('pedido_producto').select('*').eq('id_producto', id_producto).execute()
-        
-        if not response.data:
-            return []
-        
-        return response.data
+        return response
     except Exception as ex:
-        if isinstance(ex, HTTPException):
-            raise ex
-        raise HTTPException(status_code=500, detail=str(ex))
+        raise error_http(ex)
 
 @router.post("/")
-def agregar_producto_a_pedido(pedido_producto: PedidoProductoCreate):
+async def agregar_producto_a_pedido(pedido_producto: PedidoProductoCreate):
     try:
-        supabase = get_conexion()
-        
         datos_producto = {
             "cantidad": pedido_producto.cantidad,
             "precio_unitario": pedido_producto.precio_unitario,
@@ -79,75 +73,55 @@ def agregar_producto_a_pedido(pedido_producto: PedidoProductoCreate):
             "id_producto": pedido_producto.id_producto
         }
         
-        print(f"Intentando insertar producto {datos_producto['id_producto']} en pedido {datos_producto['id_pedido']}")
+        logger.debug("Insertando producto en pedido", extra={"id_pedido": datos_producto['id_pedido'], "id_producto": datos_producto['id_producto']})
         
+        # Si el pedido se pagó por transferencia, lo que sube respecto de la línea guardada (toda la
+        # cantidad si no existe) se reserva antes de escribir (409 si no alcanza)
+        reserva = await reservar_cambio_stock(datos_producto['id_pedido'], datos_producto['id_producto'], datos_producto['cantidad'])
         try:
-            check_existente = supabase.table('pedido_producto').select('id_pedido_producto').eq('id_pedido', datos_producto['id_pedido']).eq('id_producto', datos_producto['id_producto']).execute()
+            # Si la línea ya existe se actualiza en la misma llamada, que devuelve la cantidad anterior. Solo
+            # se inserta si no devolvió filas: si la llamada falla (pudo haberse aplicado) se responde el error
+            filas, delta = await actualizar_linea_pedido(datos_producto['id_pedido'], datos_producto['id_producto'], {
+                "cantidad": datos_producto['cantidad'],
+                "precio_unitario": datos_producto['precio_unitario'],
+                "subtotal": datos_producto['subtotal']
+            })
+            insertados = [] if filas else await repo_pedido_producto.insertar(datos_producto)
+        except Exception:
+            liberar_stock(reserva)
+            raise
+        
+        if filas:
+            logger.debug("Producto ya existe en el pedido, cantidad actualizada", extra={"id_pedido": datos_producto['id_pedido'], "id_producto": datos_producto['id_producto']})
             
-            if check_existente.data and len(check_existente.data) > 0:
-                print(f"Producto ya existe en el pedido. Actualizando cantidad.")
-                
-                response = supabase.table('pedido_producto').update({
-                    "cantidad": datos_producto['cantidad'],
-                    "precio_unitario": datos_producto['precio_unitario'],
-                    "subtotal": datos_producto['subtotal']
-                }).eq('id_pedido', datos_producto['id_pedido']).eq('id_producto', datos_producto['id_producto']).execute()
-                
-                return {"mensaje": "Producto actualizado en el pedido", "pedido_producto": response.data[0] if response.data else None}
-        except Exception as check_ex:
-            print(f"Error al verificar existencia del producto: {str(check_ex)}. Continuando con inserción.")
-        
-        response = supabase.table('pedido_producto').insert(datos_producto).execute()
-        
-        if response.data and len(response.data) > 0:
-            try:
-                pedido_response = supabase.table('pedido').select('medio_pago_id').eq('id_pedido', datos_producto['id_pedido']).execute()
-                
-                if pedido_response.data and len(pedido_response.data) > 0 and pedido_response.data[0]['medio_pago_id'] == 1:
-                    try:
-                        producto_response = supabase.table('producto').select('stock').eq('id_producto', datos_producto['id_producto']).execute()
-                        
-                        if producto_response.data and len(producto_response.data) > 0:
-                            producto = producto_response.data[0]
-                            
-                            nuevo_stock = max(0, producto['stock'] - datos_producto['cantidad'])
-                            
-                            update_response = supabase.table('producto').update({'stock': nuevo_stock}).eq('id_producto', datos_producto['id_producto']).execute()
-                            
-                            if update_response.error:
-                                print(f"Error al actualizar stock del producto {datos_producto['id_producto']}: {update_response.error}")
-                            else:
-                                print(f"Stock actualizado para producto {datos_producto['id_producto']}: {producto['stock']} -> {nuevo_stock}")
-                    except Exception as stock_ex:
-                        print(f"Error al actualizar stock del producto: {str(stock_ex)}")
-            except Exception as pedido_ex:
-                print(f"Error al verificar el tipo de pago del pedido: {str(pedido_ex)}")
+            await asyncio.gather(
+                encolar_ventas({datos_producto['id_producto']: delta}),
+                confirmar_cambio_stock(datos_producto['id_pedido'], {datos_producto['id_producto']: delta}, reserva)
+            )
             
-            return response.data[0]
+            return {"mensaje": "Producto actualizado en el pedido", "pedido_producto": filas[0]}
+        
+        if insertados:
+            # Ventas y stock se ajustan en segundo plano
+            await asyncio.gather(
+                encolar_ventas({datos_producto['id_producto']: datos_producto['cantidad']}),
+                confirmar_cambio_stock(datos_producto['id_pedido'], {datos_producto['id_producto']: datos_producto['cantidad']}, reserva)
+            )
+            
+            return insertados[0]
         else:
-            print("No se recibieron datos en la respuesta de inserción de producto")
+            liberar_stock(reserva)
+            logger.warning("No se recibieron datos en la respuesta de inserción de producto")
             return datos_producto
             
     except Exception as ex:
-        print(f"Error al agregar producto a pedido: {str(ex)}")
-        raise HTTPException(status_code=500, detail=str(ex))
+        if not isinstance(ex, HTTPException):
+            logger.error("Error al agregar producto a pedido", exc_info=ex)
+        raise error_http(ex)
 
 @router.post("/bulk/{id_pedido}")
-def agregar_multiples_productos(id_pedido: int, productos: ProductosEnPedido):
+async def agregar_multiples_productos(id_pedido: int, productos: ProductosEnPedido):
     try:
-        supabase = get_conexion()
-        
-        try:
-            check_pedido = supabase.table('pedido').select('id_pedido, medio_pago_id').eq('id_pedido', id_pedido).execute()
-            if not check_pedido.data or len(check_pedido.data) == 0:
-                raise HTTPException(status_code=404, detail="Pedido no encontrado")
-            
-            pedido = check_pedido.data[0]
-            es_transferencia = pedido['medio_pago_id'] == 1
-        except Exception as ex:
-            print(f"Error al verificar existencia del pedido: {str(ex)}")
-            es_transferencia = False
-        
         productos_a_insertar = []
         for producto in productos.productos:
             if producto.id_pedido != id_pedido:
@@ -169,146 +143,122 @@ def agregar_multiples_productos(id_pedido: int, productos: ProductosEnPedido):
                 }
                 productos_a_insertar.append(producto_dict)
         
-        print(f"Intentando insertar {len(productos_a_insertar)} productos en el pedido {id_pedido}")
-        print(f"Primer producto: {productos_a_insertar[0] if productos_a_insertar else 'No hay productos'}")
+        logger.debug("Insertando productos en pedido", extra={"id_pedido": id_pedido, "productos": len(productos_a_insertar)})
+        
+        items = [(producto['id_producto'], producto['cantidad']) for producto in productos_a_insertar]
+        # Todos los productos o ninguno: si alguno no tiene stock suficiente no se inserta nada
+        reserva = await reservar_stock(id_pedido, items)
         
         try:
-            response = supabase.table('pedido_producto').insert(productos_a_insertar).execute()
+            try:
+                insertados = await repo_pedido_producto.insertar(productos_a_insertar)
+            except Exception:
+                liberar_stock(reserva)
+                raise
             
-            if response.data:
-                if es_transferencia:
-                    print(f"Actualizando stock para {len(productos_a_insertar)} productos (pago por transferencia)")
-                    for producto in productos_a_insertar:
-                        try:
-                            producto_response = supabase.table('producto').select('stock').eq('id_producto', producto['id_producto']).execute()
-                            
-                            if producto_response.data and len(producto_response.data) > 0:
-                                stock_actual = producto_response.data[0]['stock']
-                                
-                                nuevo_stock = max(0, stock_actual - producto['cantidad'])
-                                
-                                update_response = supabase.table('producto').update({'stock': nuevo_stock}).eq('id_producto', producto['id_producto']).execute()
-                                
-                                if update_response.error:
-                                    print(f"Error al actualizar stock del producto {producto['id_producto']}: {update_response.error}")
-                                else:
-                                    print(f"Stock actualizado para producto {producto['id_producto']}: {stock_actual} -> {nuevo_stock}")
-                        except Exception as stock_ex:
-                            print(f"Error al actualizar stock del producto {producto['id_producto']}: {str(stock_ex)}")
+            if insertados:
+                ventas = {}
+                for producto in productos_a_insertar:
+                    ventas[producto['id_producto']] = ventas.get(producto['id_producto'], 0) + producto['cantidad']
+                await asyncio.gather(
+                    encolar_ventas(ventas),
+                    confirmar_stock(id_pedido, items, reserva)
+                )
                 
-                return {"mensaje": f"Se agregaron {len(response.data)} productos al pedido con éxito", "productos": response.data}
+                return {"mensaje": f"Se agregaron {len(insertados)} productos al pedido con éxito", "productos": insertados}
             else:
-                print("No se obtuvieron datos en la respuesta de inserción de productos")
+                liberar_stock(reserva)
+                logger.warning("No se obtuvieron datos en la respuesta de inserción de productos", extra={"id_pedido": id_pedido})
                 raise HTTPException(status_code=500, detail="Error al agregar productos al pedido: No se recibieron datos de respuesta")
         except Exception as insert_ex:
-            print(f"Error específico al insertar productos: {str(insert_ex)}")
-            raise HTTPException(status_code=500, detail=f"Error al insertar productos: {str(insert_ex)}")
+            logger.error("Error al insertar productos", extra={"id_pedido": id_pedido}, exc_info=insert_ex)
+            raise error_http(insert_ex, "Error al insertar productos")
     except Exception as ex:
-        if isinstance(ex, HTTPException):
-            raise ex
-        print(f"Error general al agregar productos al pedido: {str(ex)}")
-        raise HTTPException(status_code=500, detail=str(ex))
+        if not isinstance(ex, HTTPException):
+            logger.error("Error general al agregar productos al pedido", exc_info=ex)
+        raise error_http(ex)
 
 @router.put("/{id_pedido}/{id_producto}")
-def actualizar_producto_en_pedido(id_pedido: int, id_producto: int, datos: PedidoProductoUpdate):
+async def actualizar_producto_en_pedido(id_pedido: int, id_producto: int, datos: PedidoProductoUpdate):
     try:
-        supabase = get_conexion()
-        
-        check_existente = supabase.table('pedido_producto').select('id_pedido_producto').eq('id_pedido', id_pedido).eq('id_producto', id_producto).execute()
-        if not check_existente.data or len(check_existente.data) == 0:
-            raise HTTPException(status_code=404, detail="El producto no existe en el pedido especificado")
-        
         datos_actualizar = {k: v for k, v in datos.dict().items() if v is not None}
         
         if not datos_actualizar:
             raise HTTPException(status_code=400, detail="No se proporcionaron datos para actualizar")
         
-        response = supabase.table('pedido_producto').update(datos_actualizar).eq('id_pedido', id_pedido).eq('id_producto', id_producto).execute()
+        no_encontrado = "El producto no existe en el pedido especificado"
         
-        return {"mensaje": "Producto en pedido actualizado con éxito", "pedido_producto": response.data[0]}
+        # Un cambio de cantidad necesita la cantidad anterior para ajustar producto_ventas: la
+        # devuelve la misma llamada que actualiza, leída con la fila bloqueada
+        if 'cantidad' in datos_actualizar:
+            # Lo que sube se reserva en el libro antes de escribir; lo que baja se devuelve después
+            reserva = await reservar_cambio_stock(id_pedido, id_producto, datos_actualizar['cantidad'])
+            try:
+                filas, delta = await actualizar_linea_pedido(id_pedido, id_producto, datos_actualizar)
+            except Exception:
+                liberar_stock(reserva)
+                raise
+            if not filas:
+                liberar_stock(reserva)
+                raise HTTPException(status_code=404, detail=no_encontrado)
+            await asyncio.gather(
+                encolar_ventas({id_producto: delta}),
+                confirmar_cambio_stock(id_pedido, {id_producto: delta}, reserva)
+            )
+        else:
+            filas = await repo_pedido_producto.actualizar_donde({'id_pedido': id_pedido, 'id_producto': id_producto}, datos_actualizar, no_encontrado=no_encontrado)
+        
+        return {"mensaje": "Producto en pedido actualizado con éxito", "pedido_producto": filas[0]}
     except Exception as ex:
-        if isinstance(ex, HTTPException):
-            raise ex
-        raise HTTPException(status_code=500, detail=str(ex))
+        raise error_http(ex)
 
 @router.delete("/{id_pedido}/{id_producto}")
-def eliminar_producto_de_pedido(id_pedido: int, id_producto: int):
+async def eliminar_producto_de_pedido(id_pedido: int, id_producto: int):
     try:
-        supabase = get_conexion()
-        
-        check_existente = supabase.table('pedido_producto').select('id_pedido_producto').eq('id_pedido', id_pedido).eq('id_producto', id_producto).execute()
-        if not check_existente.data or len(check_existente.data) == 0:
-            raise HTTPException(status_code=404, detail="El producto no existe en el pedido especificado")
+        reserva = await reservar_cambio_stock(id_pedido, id_producto, 0)
+        filas = await repo_pedido_producto.eliminar_donde(
+            {'id_pedido': id_pedido, 'id_producto': id_producto},
+            no_encontrado="El producto no existe en el pedido especificado"
+        )
         
-        response = supabase.table('pedido_producto').delete().eq('id_pedido', id_pedido).eq('id_producto', id_producto).execute()
+        # Las unidades de la línea vuelven a ventas y, si el pedido descontó stock, al stock
+        eliminadas = sum(fila['cantidad'] for fila in filas)
+        await asyncio.gather(
+            encolar_ventas({id_producto: -eliminadas}),
+            confirmar_cambio_stock(id_pedido, {id_producto: -eliminadas}, reserva)
+        )
         
         return {"mensaje": "Producto eliminado del pedido con éxito"}
     except Exception as ex:
-        if isinstance(ex, HTTPException):
-            raise ex
-        raise HTTPException(status_code=500, detail=str(ex))
+        raise error_http(ex)
 
 @router.get("/{id_pedido_producto}")
-def obtener_detalle_pedido_producto(id_pedido_producto: int):
+async def obtener_detalle_pedido_producto(id_pedido_producto: int, columnas: Optional[str] = Depends(proyeccion(repo_pedido_producto))):
     try:
-        supabase = get_conexion()
-        
-        response = supabase.table('pedido_producto').select('*').eq('id_pedido_producto', id_pedido_producto).execute()
-        
-        if not response.data or len(response.data) == 0:
-            raise HTTPException(status_code=404, detail="Detalle de pedido-producto no encontrado")
-        
-        return response.data[0]
+        return await repo_pedido_producto.obtener(id_pedido_producto, columnas)
     except Exception as ex:
-        if isinstance(ex, HTTPException):
-            raise ex
-        raise HTTPException(status_code=500, detail=str(ex))
+        raise error_http(ex)
 
 @router.get("/productos/mas-vendidos")
-def obtener_productos_mas_vendidos(limit: Optional[int] = 15):
+async def obtener_productos_mas_vendidos(limit: Optional[int] = 15):
     try:
-        supabase = get_conexion()
-        
-        pedido_productos = supabase.table('pedido_producto').select('id_producto, cantidad').execute()
+        productos_ordenados = await indice_ventas.top(limit)
         
-        if not pedido_productos.data:
+        if not productos_ordenados:
             return []
         
-        ventas_por_producto = {}
-        for item in pedido_productos.data:
-            id_producto = item['id_producto']
-            cantidad = item['cantidad']
-            
-            if id_producto in ventas_por_producto:
-                ventas_por_producto[id_producto] += cantidad
-            else:
-                ventas_por_producto[id_producto] = cantidad
+        ids_productos = [id_producto for id_producto, _ in productos_ordenados]
         
-        productos_ordenados = sorted(
-            ventas_por_producto.items(), 
-            key=lambda x: x[1], 
-            reverse=True
-        )
-        
-        if limit > 0:
-            productos_ordenados = productos_ordenados[:limit]
-        
-        ids_productos = [producto[0] for producto in productos_ordenados]
-        
-        if not ids_productos:
-            return []
+        producto_info = await repo_producto.buscar({'id_producto': ids_productos})
+        productos_por_id = {producto['id_producto']: producto for producto in producto_info}
         
         productos = []
         for id_producto, total_vendido in productos_ordenados:
-            producto_info = supabase.table('producto').select('*').eq('id_producto', id_producto).execute()
-            
-            if producto_info.data and len(producto_info.data) > 0:
-                producto = producto_info.data[0]
+            producto = productos_por_id.get(id_producto)
+            if producto:
                 producto['total_vendido'] = total_vendido
                 productos.append(producto)
         
         return productos
     except Exception as ex:
-        if isinstance(ex, HTTPException):
-            raise ex
-        raise HTTPException(status_code=500, detail=f"Error al obtener productos más vendidos: {str(ex)}") 
\ No newline at end of file
+        raise error_http(ex, "Error al obtener productos más vendidos") 
\ No newline at end of file
@@ -1,8 +1,14 @@
-from fastapi import APIRouter, HTTPException, Body
-from app.database import get_conexion
-from typing import Optional, Dict, List
+from fastapi import APIRouter, HTTPException, Body, Query, Depends
+from app.paginacion import LIMITE_MAXIMO, TAMANO_PAGINA, Orden, valor_fecha
+from app.exportacion import respuesta_exportacion
+from app.repositorio import repo_cliente, repo_pedido, error_http
+from app.proyeccion import proyeccion, incluir
+from typing import Any, Optional, Dict, List, Literal
 from pydantic import BaseModel
-from datetime import datetime
+from datetime import date, datetime
+import logging
+
+logger = logging.getLogger(__name__)
 
 class PedidoBase(BaseModel):
     fecha: Optional[str] = None
@@ -21,46 +27,121 @@ class PedidoUpdate(BaseModel):
     id_estado: Optional[int] = None
     id_cliente: Optional[int] = None
 
+# La contraseña del cliente nunca se embebe en un pedido
+SELECT_CLIENTE = f'cliente({repo_cliente.columnas})'
+COLUMNAS_EXPORTACION = (
+    f'*, {SELECT_CLIENTE}, '
+    'pedido_producto(id_pedido_producto, id_producto, cantidad, precio_unitario, subtotal)'
+)
+COLUMNAS_COMPLETO = f'*, {SELECT_CLIENTE}, pedido_producto(*, producto(*))'
+COLUMNAS_PEDIDO = ['id_pedido', 'fecha', 'medio_pago_id', 'id_estado', 'id_estado_envio', 'id_cliente']
+COLUMNAS_CLIENTE = ['rut', 'nombre', 'apellido', 'correo', 'telefono', 'direccion']
+COLUMNAS_LINEA = ['id_pedido_producto', 'id_producto', 'cantidad', 'precio_unitario', 'subtotal']
+COLUMNAS_CSV = COLUMNAS_PEDIDO + [f'cliente_{columna}' for columna in COLUMNAS_CLIENTE] + COLUMNAS_LINEA
+
+def aplanar_pedido(pedido: Dict):
+    """Una fila CSV por producto del pedido (o una sola, sin producto, si el pedido está vacío)."""
+    base = {columna: pedido.get(columna) for columna in COLUMNAS_PEDIDO}
+    cliente = pedido.get('cliente') or {}
+    base.update({f'cliente_{columna}': cliente.get(columna) for columna in COLUMNAS_CLIENTE})
+    for linea in pedido.get('pedido_producto') or [{}]:
+        yield {**base, **{columna: linea.get(columna) for columna in COLUMNAS_LINEA}}
+
+def totales_pedido(lineas: List[Dict]) -> Dict:
+    return {
+        "productos": len(lineas),
+        "unidades": sum(linea.get('cantidad') or 0 for linea in lineas),
+        "total": sum(linea.get('subtotal') or 0 for linea in lineas),
+    }
+
+def filtros_pedidos(
+    id_estado: Optional[List[int]] = Query(None, description="Uno o más estados (?id_estado=1&id_estado=2)"),
+    id_estado_envio: Optional[List[int]] = Query(None, description="Uno o más estados de envío"),
+    medio_pago_id: Optional[List[int]] = Query(None, description="Uno o más medios de pago"),
+    desde: Optional[date] = Query(None, description="Fecha mínima, inclusive"),
+    hasta: Optional[date] = Query(None, description="Fecha máxima, inclusive"),
+) -> Dict[str, Any]:
+    """Dependencia con los filtros de pedidos, en el formato de Repositorio._filtrar."""
+    if desde and hasta and desde > hasta:
+        raise HTTPException(status_code=400, detail="'desde' no puede ser posterior a 'hasta'")
+    return {
+        'id_estado': id_estado or None,
+        'id_estado_envio': id_estado_envio or None,
+        'medio_pago_id': medio_pago_id or None,
+        'fecha__gte': desde.isoformat() if desde else None,
+        'fecha__lte': hasta.isoformat() if hasta else None,
+    }
+
 router = APIRouter(
     prefix="/pedidos",
     tags=["Pedidos"]
 )
 
 @router.get("/")
-def obtener_pedidos():
+async def obtener_pedidos(
+    after: Optional[str] = Query(None, description="Valor de X-Siguiente-Cursor de la página anterior"),
+    limit: Optional[int] = Query(None, ge=1, le=LIMITE_MAXIMO),
+    stream: bool = False,
+    orden: Literal["id_pedido", "-id_pedido", "fecha", "-fecha"] = "id_pedido",
+    filtros: Dict[str, Any] = Depends(filtros_pedidos),
+    columnas: str = Depends(proyeccion(repo_pedido, f'*, {SELECT_CLIENTE}'))
+):
+    """
+    Lista pedidos filtrados por estado, estado de envío, medio de pago y rango de fechas,
+    ordenados por id o fecha (`-` para descendente). Los filtros y el orden se resuelven en
+    Supabase y se combinan con la paginación por cursor; con orden por fecha el cursor
+    es `<fecha>,<id_pedido>`.
+    """
     try:
-        supabase = get_conexion()
-        
-        response = supabase.table('pedido').select('*, cliente(*)').execute()
-        
-        if not response.data:
-            return []
-        
-        return response.data
+        orden_pedidos = Orden.desde_parametro('id_pedido', orden, convertir=valor_fecha)
+        if orden_pedidos.columna:
+            columnas = incluir(columnas, orden_pedidos.columna)
+        return await repo_pedido.listar(after, limit, stream, filtros=filtros, columnas=columnas, orden=orden_pedidos)
+    except Exception as ex:
+        raise error_http(ex)
+
+@router.get("/export")
+async def exportar_pedidos(
+    formato: Literal["ndjson", "csv"] = "ndjson",
+    filtros: Dict[str, Any] = Depends(filtros_pedidos),
+    lote: int = Query(TAMANO_PAGINA, ge=1, le=LIMITE_MAXIMO)
+):
+    """
+    Exporta los pedidos con su cliente y sus productos en NDJSON (un pedido por línea, con
+    `cliente` y `pedido_producto` anidados) o CSV (una línea por producto). Supabase se recorre
+    en páginas de `lote` pedidos, así que la memoria no crece con el tamaño de la exportación.
+    """
+    try:
+        consulta = await repo_pedido.consultar(filtros, COLUMNAS_EXPORTACION)
+        return await respuesta_exportacion(consulta, 'id_pedido', formato, 'pedidos', COLUMNAS_CSV, aplanar_pedido, lote)
     except Exception as ex:
-        raise HTTPException(status_code=500, detail=str(ex))
+        raise error_http(ex)
 
 @router.get("/{id_pedido}")
-def obtener_pedido(id_pedido: int):
+async def obtener_pedido(id_pedido: int, columnas: Optional[str] = Depends(proyeccion(repo_pedido))):
     try:
-        supabase = get_conexion()
-        
-        response = supabase.table('pedido').select('*').eq('id_pedido', id_pedido).execute()
-        
-        if not response.data or len(response.data) == 0:
-            raise HTTPException(status_code=404, detail="Pedido no encontrado")
-        
-        return response.data[0]
+        return await repo_pedido.obtener(id_pedido, columnas)
     except Exception as ex:
-        if isinstance(ex, HTTPException):
-            raise ex
-        raise HTTPException(status_code=500, detail=str(ex))
+        raise error_http(ex)
+
+@router.get("/{id_pedido}/completo")
+async def obtener_pedido_completo(id_pedido: int):
+    """
+    El pedido con su cliente, sus productos (cada uno con el detalle del producto) y los
+    totales, en una sola consulta a Supabase con recursos embebidos.
+    """
+    try:
+        pedido = await repo_pedido.obtener(id_pedido, COLUMNAS_COMPLETO)
+        pedido['pedido_producto'] = pedido.get('pedido_producto') or []
+        pedido['totales'] = totales_pedido(pedido['pedido_producto'])
+        return pedido
+    except Exception as ex:
+        raise error_http(ex)
 
 @router.post("/")
-def crear_pedido(pedido: PedidoCreate):
+async def crear_pedido(pedido: PedidoCreate):
+    # Un pedido nuevo no tiene líneas todavía: el stock se descuenta al agregarlas en /pedido-producto
     try:
-        supabase = get_conexion()
-        
         datos_pedido = {
             "fecha": datetime.now().strftime('%Y-%m-%d'),
             "medio_pago_id": pedido.medio_pago_id,
@@ -69,171 +150,63 @@ def crear_pedido(pedido: PedidoCreate):
             "id_cliente": pedido.id_cliente
         }
         
-        print(f"Intentando insertar pedido con datos simplificados: {datos_pedido}")
+        logger.debug("Insertando pedido", extra={"pedido": datos_pedido})
+        
+        insertados = await repo_pedido.insertar(datos_pedido)
+        if not insertados:
+            logger.warning("No se recibieron datos en la respuesta de inserción del pedido")
+            raise HTTPException(status_code=500, detail="Error al crear pedido: No se recibieron datos de respuesta")
         
-        try:
-            tabla = 'pedido'
-            campos = ", ".join(datos_pedido.keys())
-            valores = ", ".join([f"'{v}'" if isinstance(v, str) else str(v) for v in datos_pedido.values()])
-            print(f"Consulta SQL aproximada: INSERT INTO {tabla} ({campos}) VALUES ({valores})")
-            
-            response = supabase.table('pedido').insert(datos_pedido).execute()
-            print(f"Respuesta de la inserción: {response}")
-            
-            if response.data and len(response.data) > 0:
-                pedido_creado = response.data[0]
-                
-                if pedido.medio_pago_id == 1:
-                    try:
-                        detalles_response = supabase.table('pedido_producto').select('*').eq('id_pedido', pedido_creado['id_pedido']).execute()
-                        
-                        if detalles_response.data and len(detalles_response.data) > 0:
-                            print(f"Actualizando stock para {len(detalles_response.data)} productos")
-                            
-                            for detalle in detalles_response.data:
-                                try:
-                                    producto_response = supabase.table('producto').select('stock').eq('id_producto', detalle['id_producto']).execute()
-                                    
-                                    if producto_response.data and len(producto_response.data) > 0:
-                                        producto = producto_response.data[0]
-                                        
-                                        nuevo_stock = max(0, producto['stock'] - detalle['cantidad'])
-                                        
-                                        update_response = supabase.table('producto').update({'stock': nuevo_stock}).eq('id_producto', detalle['id_producto']).execute()
-                                        
-                                        if update_response.error:
-                                            print(f"Error al actualizar stock del producto {detalle['id_producto']}: {update_response.error}")
-                                        else:
-                                            print(f"Stock actualizado para producto {detalle['id_producto']}: {producto['stock']} -> {nuevo_stock}")
-                                except Exception as prod_ex:
-                                    print(f"Error al actualizar stock del producto {detalle['id_producto']}: {str(prod_ex)}")
-                    except Exception as stock_ex:
-                        print(f"Error al actualizar stock de productos: {str(stock_ex)}")
-                
-                return pedido_creado
-            else:
-                print("No se recibieron datos en la respuesta de inserción")
-                return {
-                    "id_pedido": 1,
-                    "fecha": datos_pedido["fecha"],
-                    "medio_pago_id": datos_pedido["medio_pago_id"],
-                    "id_estado_envio": datos_pedido["id_estado_envio"],
-                    "id_estado": datos_pedido["id_estado"],
-                    "id_cliente": datos_pedido["id_cliente"]
-                }
-        except Exception as insert_ex:
-            print(f"Error específico al insertar el pedido: {str(insert_ex)}")
-            try:
-                print("Intentando inserción alternativa...")
-                current_date = datetime.now().strftime('%Y-%m-%d')
-                simple_query = f"""
-                INSERT INTO pedido (fecha, medio_pago_id, id_estado_envio, id_estado, id_cliente)
-                VALUES ('{current_date}', {pedido.medio_pago_id}, {pedido.id_estado_envio}, {pedido.id_estado}, {pedido.id_cliente})
-                RETURNING *
-                """
-                response = supabase.rpc('ejecutar_sql', {'query': simple_query}).execute()
-                print(f"Respuesta de la inserción alternativa: {response}")
-                
-                return {
-                    "id_pedido": 1,
-                    "fecha": datetime.now().strftime('%Y-%m-%d'),
-                    "medio_pago_id": pedido.medio_pago_id,
-                    "id_estado_envio": pedido.id_estado_envio,
-                    "id_estado": pedido.id_estado,
-                    "id_cliente": pedido.id_cliente
-                }
-            except Exception as alt_ex:
-                print(f"Error en inserción alternativa: {str(alt_ex)}")
-                raise HTTPException(status_code=500, detail=f"Error al insertar pedido: {str(insert_ex)}")
+        return insertados[0]
     except Exception as ex:
-        if isinstance(ex, HTTPException):
-            raise ex
-        print(f"Error general al crear pedido: {str(ex)}")
-        raise HTTPException(status_code=500, detail=f"Error al crear pedido: {str(ex)}")
+        if not isinstance(ex, HTTPException):
+            logger.error("Error general al crear pedido", exc_info=ex)
+        raise error_http(ex, "Error al crear pedido")
 
 @router.put("/{id_pedido}")
-def actualizar_pedido(id_pedido: int, pedido: PedidoUpdate):
+async def actualizar_pedido(id_pedido: int, pedido: PedidoUpdate):
     try:
-        supabase = get_conexion()
-        
-        check_response = supabase.table('pedido').select('id_pedido').eq('id_pedido', id_pedido).execute()
-        if not check_response.data or len(check_response.data) == 0:
-            raise HTTPException(status_code=404, detail="Pedido no encontrado")
-        
         datos_actualizar = {k: v for k, v in pedido.dict().items() if v is not None}
         
         if not datos_actualizar:
             raise HTTPException(status_code=400, detail="No se proporcionaron datos para actualizar")
         
-        response = supabase.table('pedido').update(datos_actualizar).eq('id_pedido', id_pedido).execute()
+        pedido_actualizado = await repo_pedido.actualizar(id_pedido, datos_actualizar)
         
-        return {"mensaje": "Pedido actualizado con éxito", "pedido": response.data[0]}
+        return {"mensaje": "Pedido actualizado con éxito", "pedido": pedido_actualizado}
     except Exception as ex:
-        if isinstance(ex, HTTPException):
-            raise ex
-        raise HTTPException(status_code=500, detail=str(ex))
+        raise error_http(ex)
 
 @router.delete("/{id_pedido}")
-def eliminar_pedido(id_pedido: int):
+async def eliminar_pedido(id_pedido: int):
     try:
-        supabase = get_conexion()
-        
-        check_response = supabase.table('pedido').select('id_pedido').eq('id_pedido', id_pedido).execute()
-        if not check_response.data or len(check_response.data) == 0:
-            raise HTTPException(status_code=404, detail="Pedido no encontrado")
-        
-        response = supabase.table('pedido').delete().eq('id_pedido', id_pedido).execute()
+        await repo_pedido.eliminar(id_pedido)
         
         return {"mensaje": "Pedido eliminado con éxito"}
     except Exception as ex:
-        if isinstance(ex, HTTPException):
-            raise ex
-        raise HTTPException(status_code=500, detail=str(ex))
+        raise error_http(ex)
 
 @router.get("/cliente/{id_cliente}")
-def obtener_pedidos_por_cliente(id_cliente: int):
+async def obtener_pedidos_por_cliente(id_cliente: int, after: Optional[int] = None, limit: Optional[int] = Query(None, ge=1, le=LIMITE_MAXIMO), stream: bool = False, columnas: Optional[str] = Depends(proyeccion(repo_pedido))):
     try:
-        supabase = get_conexion()
-        
-        response = supabase.table('pedido').select('*').eq('id_cliente', id_cliente).execute()
-        
-        if not response.data:
-            return []
-        
-        return response.data
+        return await repo_pedido.listar(after, limit, stream, filtros={'id_cliente': id_cliente}, columnas=columnas)
     except Exception as ex:
-        raise HTTPException(status_code=500, detail=str(ex))
+        raise error_http(ex)
 
 @router.patch("/{id_pedido}/estado")
-def actualizar_estado_pedido(id_pedido: int, id_estado: int):
+async def actualizar_estado_pedido(id_pedido: int, id_estado: int):
     try:
-        supabase = get_conexion()
-        
-        check_response = supabase.table('pedido').select('id_pedido').eq('id_pedido', id_pedido).execute()
-        if not check_response.data or len(check_response.data) == 0:
-            raise HTTPException(status_code=404, detail="Pedido no encontrado")
+        pedido = await repo_pedido.actualizar(id_pedido, {"id_estado": id_estado})
         
-        response = supabase.table('pedido').update({"id_estado": id_estado}).eq('id_pedido', id_pedido).execute()
-        
-        return {"mensaje": "Estado del pedido actualizado con éxito", "pedido": response.data[0]}
+        return {"mensaje": "Estado del pedido actualizado con éxito", "pedido": pedido}
     except Exception as ex:
-        if isinstance(ex, HTTPException):
-            raise ex
-        raise HTTPException(status_code=500, detail=str(ex))
+        raise error_http(ex)
 
 @router.patch("/{id_pedido}/estado-envio")
-def actualizar_estado_envio(id_pedido: int, estado_envio: int = Body(...)):
+async def actualizar_estado_envio(id_pedido: int, estado_envio: int = Body(...)):
     try:
-        supabase = get_conexion()
-        
-        check_response = supabase.table('pedido').select('id_pedido').eq('id_pedido', id_pedido).execute()
-        if not check_response.data or len(check_response.data) == 0:
-            raise HTTPException(status_code=404, detail="Pedido no encontrado")
-        
-        response = supabase.table('pedido').update({"id_estado_envio": estado_envio}).eq('id_pedido', id_pedido).execute()
+        pedido = await repo_pedido.actualizar(id_pedido, {"id_estado_envio": estado_envio})
         
-        return {"mensaje": "Estado de envío actualizado con éxito", "pedido": response.data[0]}
+        return {"mensaje": "Estado de envío actualizado con éxito", "pedido": pedido}
     except Exception as ex:
-        if isinstance(ex, HTTPException):
-            raise ex
-        raise HTTPException(status_code=500, detail=str(ex)) 
\ No newline at end of file
+        raise error_http(ex) 
\ No newline at end of file
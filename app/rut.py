@@ -0,0 +1,7 @@
+def format_rut(rut: str) -> str:
+    rut = rut.strip().replace(" ", "").replace(".", "")
+    
+    if "-" not in rut and len(rut) >= 2:
+        rut = rut[:-1] + "-" + rut[-1]
+    
+    return rut
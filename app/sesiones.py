@@ -0,0 +1,120 @@
+import os
+import hmac
+import json
+import time
+import base64
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Dict, Optional
+from fastapi import Depends, HTTPException
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+# SESION_SECRETO debe ser el mismo en todas las instancias; si falta se genera uno por proceso
+# y los tokens dejan de valer al reiniciar (útil solo en desarrollo).
+SESION_SECRETO = os.getenv("SESION_SECRETO")
+SESION_DURACION = int(os.getenv("SESION_DURACION", str(8 * 3600)))
+SESION_CACHE_MAX = int(os.getenv("SESION_CACHE_MAX", "10000"))
+
+_secreto_aleatorio = not SESION_SECRETO
+if _secreto_aleatorio:
+    SESION_SECRETO = base64.urlsafe_b64encode(os.urandom(32)).decode("ascii")
+
+_CLAVE = SESION_SECRETO.encode("utf-8")
+_CABECERA = "eyJhbGciOiJIUzI1NiIsInR5cCI6IkpXVCJ9"  # {"alg":"HS256","typ":"JWT"}
+
+class Sesion(BaseModel):
+    tipo: str
+    id: int
+    rol: Optional[int] = None
+    exp: int
+
+def _b64(datos: bytes) -> str:
+    return base64.urlsafe_b64encode(datos).decode("ascii").rstrip("=")
+
+def _desde_b64(texto: str) -> bytes:
+    return base64.urlsafe_b64decode(texto + "=" * (-len(texto) % 4))
+
+def _firmar(contenido: str) -> str:
+    return _b64(hmac.new(_CLAVE, contenido.encode("ascii"), hashlib.sha256).digest())
+
+def emitir_token(tipo: str, id: int, rol: Optional[int]) -> str:
+    """
+    Emite un JWT HS256 con el tipo de usuario ("cliente" o "empleado"), su id y su rol,
+    que vence a los SESION_DURACION segundos.
+    """
+    global _secreto_aleatorio
+    if _secreto_aleatorio:
+        logger.warning("SESION_SECRETO no está configurado; se usa un secreto aleatorio por proceso")
+        _secreto_aleatorio = False
+
+    ahora = int(time.time())
+    datos = {"sub": str(id), "tipo": tipo, "rol": rol, "iat": ahora, "exp": ahora + SESION_DURACION}
+    contenido = f"{_CABECERA}.{_b64(json.dumps(datos, separators=(',', ':')).encode('utf-8'))}"
+    return f"{contenido}.{_firmar(contenido)}"
+
+class CacheSesiones:
+    """
+    Tokens ya verificados, para no repetir la firma ni la decodificación en cada petición.
+    Acotada por LRU; cada entrada deja de valer cuando vence el token.
+    """
+
+    def __init__(self, max_entradas: int = SESION_CACHE_MAX):
+        self.max_entradas = max_entradas
+        self._entradas: "OrderedDict[str, Sesion]" = OrderedDict()
+
+    def obtener(self, token: str) -> Optional[Sesion]:
+        sesion = self._entradas.get(token)
+        if sesion is None:
+            return None
+        if sesion.exp <= time.time():
+            del self._entradas[token]
+            return None
+        self._entradas.move_to_end(token)
+        return sesion
+
+    def guardar(self, token: str, sesion: Sesion):
+        self._entradas[token] = sesion
+        if len(self._entradas) > self.max_entradas:
+            self._entradas.popitem(last=False)
+
+    def limpiar(self):
+        self._entradas.clear()
+
+cache_sesiones = CacheSesiones()
+
+def verificar_token(token: str) -> Sesion:
+    """Valida firma y vencimiento del token sin consultar Supabase; lanza 401 si no es válido."""
+    sesion = cache_sesiones.obtener(token)
+    if sesion is not None:
+        return sesion
+
+    try:
+        cabecera, contenido, firma = token.split(".")
+        if not hmac.compare_digest(_firmar(f"{cabecera}.{contenido}"), firma):
+            raise ValueError("firma inválida")
+        datos = json.loads(_desde_b64(contenido))
+        sesion = Sesion(tipo=datos["tipo"], id=int(datos["sub"]), rol=datos.get("rol"), exp=int(datos["exp"]))
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=401, detail="Token inválido", headers={"WWW-Authenticate": "Bearer"})
+
+    if sesion.exp <= time.time():
+        raise HTTPException(status_code=401, detail="Token vencido", headers={"WWW-Authenticate": "Bearer"})
+
+    cache_sesiones.guardar(token, sesion)
+    return sesion
+
+_bearer = HTTPBearer(auto_error=False)
+
+async def sesion_actual(credenciales: Optional[HTTPAuthorizationCredentials] = Depends(_bearer)) -> Sesion:
+    """Dependencia de FastAPI que identifica al usuario a partir de `Authorization: Bearer <token>`."""
+    if credenciales is None:
+        raise HTTPException(status_code=401, detail="Falta el token de sesión", headers={"WWW-Authenticate": "Bearer"})
+    return verificar_token(credenciales.credentials)
+
+def respuesta_sesion(tipo: str, id: int, rol: Optional[int]) -> Dict:
+    """Campos que agregan los endpoints de login a su respuesta."""
+    return {"token": emitir_token(tipo, id, rol), "token_tipo": "bearer", "expira_en": SESION_DURACION}
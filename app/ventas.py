@@ -0,0 +1,158 @@
+import os
+import time
+import heapq
+import asyncio
+import logging
+from typing import Any, Dict, List, Tuple
+from app.database import get_conexion
+from app.cache import cache_entidades
+from app.efectos import cola_efectos
+
+logger = logging.getLogger(__name__)
+
+TOP_VENTAS_K = int(os.getenv("TOP_VENTAS_K", "100"))
+TOP_VENTAS_TTL = float(os.getenv("TOP_VENTAS_TTL", "60"))
+
+class IndiceVentas:
+    """
+    Mantiene en memoria los K productos más vendidos como un min-heap acotado de
+    (total_vendido, id_producto), alimentado con los totales que devuelve `ajustar_ventas`.
+    El heap se recarga desde la tabla producto_ventas cuando vence el TTL (para recoger
+    las ventas registradas por otras instancias) o cuando una baja puede haber dejado
+    fuera del heap a un producto que ahora debería estar dentro.
+    """
+
+    def __init__(self, k: int = TOP_VENTAS_K, ttl: float = TOP_VENTAS_TTL):
+        self.k = k
+        self.ttl = ttl
+        self._heap: List[Tuple[int, int]] = []
+        self._totales: Dict[int, int] = {}
+        self._cargado_en = 0.0
+        self._valido = False
+        self._lock = asyncio.Lock()
+
+    def invalidar(self):
+        self._valido = False
+
+    async def cargar(self):
+        supabase = await get_conexion()
+        response = await supabase.table('producto_ventas').select('id_producto, total_vendido').gt('total_vendido', 0).order('total_vendido', desc=True).limit(self.k).execute()
+
+        self._totales = {fila['id_producto']: fila['total_vendido'] for fila in response.data or []}
+        self._heap = [(total, id_producto) for id_producto, total in self._totales.items()]
+        heapq.heapify(self._heap)
+        self._cargado_en = time.monotonic()
+        self._valido = True
+
+    async def top(self, limit: int) -> List[Tuple[int, int]]:
+        """
+        Devuelve hasta `limit` pares (id_producto, total_vendido) ordenados de mayor a menor.
+        Un `limit` menor o igual a 0, o mayor que K, se acota a K.
+        """
+        if not self._valido or time.monotonic() - self._cargado_en > self.ttl:
+            async with self._lock:
+                if not self._valido or time.monotonic() - self._cargado_en > self.ttl:
+                    await self.cargar()
+
+        limit = self.k if limit <= 0 else min(limit, self.k)
+        return [(id_producto, total) for total, id_producto in heapq.nlargest(limit, self._heap)]
+
+    def aplicar(self, totales: Dict[int, int]):
+        """Actualiza el heap con los totales absolutos recién escritos en producto_ventas."""
+        if not self._valido:
+            return
+
+        reconstruir = False
+        for id_producto, total in totales.items():
+            anterior = self._totales.get(id_producto)
+            if anterior is not None:
+                if total < anterior and len(self._totales) >= self.k:
+                    self._valido = False
+                    return
+                if total > 0:
+                    self._totales[id_producto] = total
+                else:
+                    del self._totales[id_producto]
+                reconstruir = True
+            elif total > 0 and len(self._heap) < self.k:
+                self._totales[id_producto] = total
+                heapq.heappush(self._heap, (total, id_producto))
+            elif self._heap and total > self._heap[0][0]:
+                _, expulsado = heapq.heapreplace(self._heap, (total, id_producto))
+                del self._totales[expulsado]
+                self._totales[id_producto] = total
+
+        if reconstruir:
+            self._heap = [(total, id_producto) for id_producto, total in self._totales.items()]
+            heapq.heapify(self._heap)
+
+indice_ventas = IndiceVentas()
+
+async def registrar_ventas(efectos: Dict[str, Dict[int, int]]):
+    """
+    Suma (o resta, con deltas negativos) unidades vendidas al agregado producto_ventas
+    y propaga los nuevos totales al índice de más vendidos. Cada efecto se aplica una sola
+    vez aunque se reenvíe (ver sql/efectos_aplicados.sql). Si falla, invalida el índice
+    y vuelve a lanzar el error para que la cola de efectos reintente.
+
+    Args:
+        efectos: Id de cada efecto -> variación de unidades vendidas por id_producto.
+    """
+    efectos = {
+        efecto: {id_producto: delta for id_producto, delta in deltas.items() if delta}
+        for efecto, deltas in efectos.items()
+    }
+    if not any(efectos.values()):
+        return
+
+    try:
+        supabase = await get_conexion()
+        response = await supabase.rpc('aplicar_efectos_ventas', {
+            'efectos': [
+                {'id': efecto, 'deltas': [{'id_producto': id_producto, 'delta': delta} for id_producto, delta in deltas.items()]}
+                for efecto, deltas in efectos.items() if deltas
+            ]
+        }).execute()
+
+        indice_ventas.aplicar({fila['id_producto']: fila['total_vendido'] for fila in response.data or []})
+    except Exception:
+        indice_ventas.invalidar()
+        raise
+
+async def actualizar_linea_pedido(id_pedido: int, id_producto: int, datos: Dict[str, Any]) -> Tuple[List[Dict], int]:
+    """
+    Actualiza la línea (id_pedido, id_producto) con la función `actualizar_linea_pedido` de
+    Postgres (ver sql/producto_ventas.sql), que lee la cantidad anterior con la fila bloqueada.
+
+    Returns:
+        Tuple[List[Dict], int]: Las filas actualizadas (vacío si la línea no existe) y la
+        variación de unidades a registrar en producto_ventas.
+    """
+    supabase = await get_conexion()
+    response = await supabase.rpc('actualizar_linea_pedido', {
+        'pedido_id': id_pedido, 'producto_id': id_producto, 'cambios': datos
+    }).execute()
+
+    filas = response.data or []
+    delta = 0
+    for fila in filas:
+        delta += fila['cantidad'] - fila.pop('cantidad_anterior')
+        cache_entidades.invalidar('pedido_producto', fila['id_pedido_producto'])
+    return filas, delta
+
+async def registrar_ventas_lote(lote: List[Dict]):
+    """Procesador de los efectos "ventas" de la cola: aplica los deltas de todo el lote en una llamada."""
+    efectos: Dict[str, Dict[int, int]] = {}
+    for efecto in lote:
+        deltas = efectos.setdefault(efecto['efecto'], {})
+        for id_producto, delta in efecto['deltas']:
+            deltas[id_producto] = deltas.get(id_producto, 0) + delta
+    await registrar_ventas(efectos)
+
+async def encolar_ventas(deltas: Dict[int, int]):
+    """Encola el ajuste de producto_ventas; los deltas en cero se descartan."""
+    deltas = {id_producto: delta for id_producto, delta in deltas.items() if delta}
+    if deltas:
+        await cola_efectos.encolar('ventas', {'deltas': [[id_producto, delta] for id_producto, delta in deltas.items()]})
+
+cola_efectos.registrar('ventas', registrar_ventas_lote)
@@ -0,0 +1,87 @@
+"""
+Compara el rendimiento de los handlers síncronos originales (cliente bloqueante de Supabase,
+un hilo del threadpool de Starlette por petición) con los handlers asíncronos actuales.
+
+Uso:
+    python benchmarks/benchmark_async.py [--latencia 0.1] [--concurrencias 50 200 1000]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import httpx
+from fastapi import FastAPI, HTTPException
+from supabase import create_client, ClientOptions
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import database
+from benchmarks.postgrest_falso import PostgRESTFalso, sembrar_datos, URL_FALSA, KEY_FALSA
+
+def crear_app_sincrona(falso: PostgRESTFalso) -> FastAPI:
+    supabase = create_client(URL_FALSA, KEY_FALSA, ClientOptions(httpx_client=httpx.Client(transport=falso.transporte_sync())))
+    app_sync = FastAPI()
+
+    @app_sync.get("/clientes/{id_cliente}")
+    def obtener_cliente(id_cliente: int):
+        response = supabase.table('cliente').select('*').eq('id_cliente', id_cliente).execute()
+        if not response.data:
+            raise HTTPException(status_code=404, detail="Cliente no encontrado")
+        return response.data[0]
+
+    @app_sync.get("/pedido-producto/pedido/{id_pedido}")
+    def obtener_productos_por_pedido(id_pedido: int):
+        check_pedido = supabase.table('pedido').select('id_pedido').eq('id_pedido', id_pedido).execute()
+        if not check_pedido.data:
+            raise HTTPException(status_code=404, detail="Pedido no encontrado")
+        response = supabase.table('pedido_producto').select('*').eq('id_pedido', id_pedido).execute()
+        return response.data or []
+
+    return app_sync
+
+def crear_app_asincrona(falso: PostgRESTFalso) -> FastAPI:
+    database.SUPABASE_URL = URL_FALSA
+    database.SUPABASE_KEY = KEY_FALSA
+    database.reiniciar_conexion(falso.transporte_async())
+    from app.main import app
+    return app
+
+async def medir(app: FastAPI, rutas, concurrencia: int) -> float:
+    total = concurrencia * 3
+    semaforo = asyncio.Semaphore(concurrencia)
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://api") as cliente:
+        await cliente.get(rutas[0])
+
+        async def una(i: int):
+            async with semaforo:
+                respuesta = await cliente.get(rutas[i % len(rutas)])
+                respuesta.raise_for_status()
+
+        inicio = time.perf_counter()
+        await asyncio.gather(*(una(i) for i in range(total)))
+        return total / (time.perf_counter() - inicio)
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latencia", type=float, default=0.1, help="Latencia simulada de cada llamada a PostgREST (s)")
+    parser.add_argument("--concurrencias", type=int, nargs="+", default=[50, 200, 1000])
+    args = parser.parse_args()
+
+    falso = PostgRESTFalso(latencia=args.latencia)
+    sembrar_datos(falso)
+    app_sync = crear_app_sincrona(falso)
+    app_async = crear_app_asincrona(falso)
+
+    for ruta in ("/clientes/{}", "/pedido-producto/pedido/{}"):
+        rutas = [ruta.format(i) for i in range(1, 51)]
+        print(f"\n{ruta} (latencia upstream {args.latencia * 1000:.0f} ms)")
+        print(f"{'concurrencia':>12} {'antes req/s':>12} {'después req/s':>14} {'mejora':>8}")
+        for concurrencia in args.concurrencias:
+            antes = await medir(app_sync, rutas, concurrencia)
+            despues = await medir(app_async, rutas, concurrencia)
+            print(f"{concurrencia:>12} {antes:>12.0f} {despues:>14.0f} {despues / antes:>7.1f}x")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,80 @@
+"""
+Mide el single-flight de GETs idénticos contra el PostgREST simulado en memoria: ráfagas de
+peticiones concurrentes a la misma URL (como cuando cientos de clientes abren la portada en
+el mismo segundo), con y sin coalescencia. Reporta latencia, req/s y llamadas a Supabase.
+
+Uso:
+    python benchmarks/benchmark_coalescencia.py [--rafagas 20] [--concurrencia 100] [--latencia 0.02]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+import httpx
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import database, coalescencia
+from app.coalescencia import coalescedor
+from benchmarks.postgrest_falso import PostgRESTFalso, sembrar_datos, URL_FALSA, KEY_FALSA
+
+RUTAS = [
+    "/pedido-producto/productos/mas-vendidos?limit=10",
+    "/pedidos/?limit=50&orden=-fecha",
+    "/pedidos/?id_estado=1",
+]
+
+async def rafagas(cliente: httpx.AsyncClient, falso: PostgRESTFalso, ruta: str, cantidad: int, concurrencia: int, pausa: float):
+    tiempos = []
+    llamadas = falso.llamadas
+
+    async def pedir():
+        inicio = time.perf_counter()
+        respuesta = await cliente.get(ruta)
+        respuesta.raise_for_status()
+        tiempos.append(time.perf_counter() - inicio)
+
+    inicio = time.perf_counter()
+    for _ in range(cantidad):
+        await asyncio.gather(*(pedir() for _ in range(concurrencia)))
+        # Pausa mayor que la ventana para medir solo el efecto de compartir el vuelo en curso
+        await asyncio.sleep(pausa)
+    total = time.perf_counter() - inicio - pausa * cantidad
+    return statistics.median(tiempos) * 1000, len(tiempos) / total, falso.llamadas - llamadas
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latencia", type=float, default=0.02, help="Latencia simulada de cada llamada a PostgREST (s)")
+    parser.add_argument("--rafagas", type=int, default=20)
+    parser.add_argument("--concurrencia", type=int, default=100, help="Peticiones idénticas por ráfaga")
+    parser.add_argument("--clientes", type=int, default=500)
+    parser.add_argument("--pedidos", type=int, default=2000)
+    args = parser.parse_args()
+
+    falso = PostgRESTFalso(latencia=args.latencia)
+    sembrar_datos(falso, clientes=args.clientes, pedidos=args.pedidos)
+    database.SUPABASE_URL = URL_FALSA
+    database.SUPABASE_KEY = KEY_FALSA
+    database.reiniciar_conexion(falso.transporte_async())
+    from app.main import app
+
+    pausa = coalescedor.ventana + 0.05
+    print(f"{args.rafagas} ráfagas de {args.concurrencia} GET idénticos, latencia upstream {args.latencia * 1000:.0f} ms")
+    print(f"{'ruta':<52} {'modo':<16} {'p50 ms':>8} {'req/s':>9} {'upstream':>9}")
+
+    rutas_coalescibles = coalescencia.RUTAS_COALESCIBLES
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://api") as cliente:
+        for ruta in RUTAS:
+            for modo, coalescibles in (("sin coalescer", []), ("single-flight", rutas_coalescibles)):
+                coalescencia.RUTAS_COALESCIBLES = coalescibles
+                coalescedor.limpiar()
+                p50, rps, llamadas = await rafagas(cliente, falso, ruta, args.rafagas, args.concurrencia, pausa)
+                print(f"{ruta:<52} {modo:<16} {p50:>8.1f} {rps:>9.1f} {llamadas:>9}")
+    coalescencia.RUTAS_COALESCIBLES = rutas_coalescibles
+    print(coalescedor.estadisticas())
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,93 @@
+"""
+Mide la compresión de las respuestas grandes contra el PostgREST simulado en memoria:
+bytes sin comprimir y comprimidos por codificación (gzip y, si está instalado, brotli),
+CPU que cuesta comprimir cada respuesta y req/s de la ruta con y sin la caché de
+respuestas ya comprimidas.
+
+Uso:
+    python benchmarks/benchmark_compresion.py [--peticiones 200] [--concurrencia 20] [--clientes 1000] [--pedidos 1000]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import httpx
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import database, compresion
+from app.compresion import cache_compresion, codificaciones_disponibles, comprimir
+from benchmarks.postgrest_falso import PostgRESTFalso, sembrar_datos, URL_FALSA, KEY_FALSA
+
+RUTAS = [
+    "/pedidos/",
+    "/pedidos/?limit=100",
+    "/clientes/",
+    "/pedido-producto/productos/mas-vendidos?limit=100",
+]
+
+def cpu_por_respuesta(cuerpo: bytes, codificacion: str, repeticiones: int = 20) -> float:
+    """Milisegundos de CPU por compresión del cuerpo."""
+    inicio = time.process_time()
+    for _ in range(repeticiones):
+        comprimir(cuerpo, codificacion)
+    return (time.process_time() - inicio) / repeticiones * 1000
+
+async def req_s(cliente: httpx.AsyncClient, ruta: str, codificacion: str, peticiones: int, concurrencia: int) -> float:
+    semaforo = asyncio.Semaphore(concurrencia)
+
+    async def pedir():
+        async with semaforo:
+            respuesta = await cliente.get(ruta, headers={"Accept-Encoding": codificacion})
+            respuesta.raise_for_status()
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(pedir() for _ in range(peticiones)))
+    return peticiones / (time.perf_counter() - inicio)
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latencia", type=float, default=0.0, help="Latencia simulada de cada llamada a PostgREST (s)")
+    parser.add_argument("--peticiones", type=int, default=200, help="Peticiones por ruta y modo")
+    parser.add_argument("--concurrencia", type=int, default=20)
+    parser.add_argument("--clientes", type=int, default=1000)
+    parser.add_argument("--pedidos", type=int, default=1000)
+    args = parser.parse_args()
+
+    falso = PostgRESTFalso(latencia=args.latencia)
+    sembrar_datos(falso, clientes=args.clientes, pedidos=args.pedidos)
+    database.SUPABASE_URL = URL_FALSA
+    database.SUPABASE_KEY = KEY_FALSA
+    database.reiniciar_conexion(falso.transporte_async())
+    from app.main import app
+
+    codificaciones = codificaciones_disponibles()
+    print(f"codificaciones: {', '.join(codificaciones)} (gzip nivel {compresion.GZIP_NIVEL}, brotli calidad {compresion.BROTLI_CALIDAD}), "
+          f"{args.peticiones} peticiones por modo, concurrencia {args.concurrencia}")
+    print(f"{'ruta':<52} {'cod.':<8} {'bytes':>10} {'ahorro':>7} {'CPU ms':>7} {'req/s':>8} {'sin caché':>10}")
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://api") as cliente:
+        for ruta in RUTAS:
+            respuesta = await cliente.get(ruta, headers={"Accept-Encoding": "identity"})
+            cuerpo = respuesta.content
+            base = await req_s(cliente, ruta, "identity", args.peticiones, args.concurrencia)
+            print(f"{ruta:<52} {'identity':<8} {len(cuerpo):>10} {'':>7} {'':>7} {base:>8.1f} {'':>10}")
+
+            for codificacion in codificaciones:
+                comprimido = comprimir(cuerpo, codificacion)
+                ahorro = 1 - len(comprimido) / len(cuerpo)
+                cpu = cpu_por_respuesta(cuerpo, codificacion)
+
+                cache_compresion.limpiar()
+                con_cache = await req_s(cliente, ruta, codificacion, args.peticiones, args.concurrencia)
+                cache_compresion.limpiar()
+                max_bytes, cache_compresion.max_bytes = cache_compresion.max_bytes, 0
+                sin_cache = await req_s(cliente, ruta, codificacion, args.peticiones, args.concurrencia)
+                cache_compresion.max_bytes = max_bytes
+
+                print(f"{'':<52} {codificacion:<8} {len(comprimido):>10} {ahorro:>6.0%} {cpu:>7.2f} {con_cache:>8.1f} {sin_cache:>10.1f}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,89 @@
+"""
+Compara aplicar los ajustes de stock y producto_ventas dentro de cada POST /pedido-producto con
+encolarlos en la cola de efectos (app/efectos.py) contra el PostgREST simulado en memoria.
+Reporta la latencia de las peticiones, las llamadas a PostgREST por petición (incluidas las de
+los workers, que agrupan los ajustes de muchas peticiones por producto), cuánto tardó en vaciarse
+la cola después de la última respuesta y si el stock final es el esperado en ambos modos.
+
+Uso:
+    python benchmarks/benchmark_efectos.py [--peticiones 1000] [--concurrencia 50] [--latencia 0.01] [--productos 20]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+from typing import List
+
+import httpx
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("EFECTOS_DIARIO", ":memory:")
+# El stock pasa por la cola (sin libro de inventario, ver benchmark_inventario.py)
+os.environ.setdefault("INVENTARIO_LIBRO", "0")
+
+from app import database
+from app.efectos import cola_efectos
+from app.inventario import MEDIO_PAGO_TRANSFERENCIA
+from benchmarks.postgrest_falso import PostgRESTFalso, sembrar_datos, percentil, stock, URL_FALSA, KEY_FALSA
+
+async def correr(args, en_segundo_plano: bool):
+    falso = PostgRESTFalso(latencia=args.latencia)
+    sembrar_datos(falso, clientes=50, pedidos=args.peticiones, lineas_por_pedido=0, productos=args.productos)
+    database.reiniciar_conexion(falso.transporte_async())
+    from app.main import app
+    cola_efectos.en_segundo_plano = en_segundo_plano
+    pedidos = {fila["id_pedido"]: fila["medio_pago_id"] for fila in falso.tablas["pedido"]}
+    inicial = stock(falso)
+    esperado = dict(inicial)
+
+    semaforo = asyncio.Semaphore(args.concurrencia)
+    tiempos: List[float] = []
+
+    async def agregar(cliente: httpx.AsyncClient, i: int):
+        id_pedido, id_producto = i + 1, i % args.productos + 1
+        if pedidos[id_pedido] == MEDIO_PAGO_TRANSFERENCIA:
+            esperado[id_producto] -= 1
+        async with semaforo:
+            inicio = time.perf_counter()
+            respuesta = await cliente.post("/pedido-producto/", json={
+                "cantidad": 1, "precio_unitario": 1000, "subtotal": 1000, "id_pedido": id_pedido, "id_producto": id_producto
+            })
+            respuesta.raise_for_status()
+            tiempos.append(time.perf_counter() - inicio)
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://api") as cliente:
+        llamadas = falso.llamadas
+        inicio = time.perf_counter()
+        await asyncio.gather(*(agregar(cliente, i) for i in range(args.peticiones)))
+        duracion = time.perf_counter() - inicio
+        inicio = time.perf_counter()
+        await cola_efectos.drenar()
+        drenado = time.perf_counter() - inicio
+        llamadas = falso.llamadas - llamadas
+    await cola_efectos.detener()
+
+    modo = "cola de efectos" if en_segundo_plano else "en la petición"
+    correcto = "sí" if stock(falso) == esperado else "NO"
+    print(f"{modo:<16} {args.peticiones / duracion:>8.0f} {statistics.median(tiempos) * 1000:>8.1f} {percentil(tiempos, 0.99) * 1000:>8.1f} "
+          f"{llamadas / args.peticiones:>11.2f} {drenado * 1000:>11.0f} {correcto:>10}")
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latencia", type=float, default=0.01, help="Latencia simulada de cada llamada a PostgREST (s)")
+    parser.add_argument("--peticiones", type=int, default=1000, help="POST /pedido-producto, cada uno a un pedido distinto")
+    parser.add_argument("--concurrencia", type=int, default=50)
+    parser.add_argument("--productos", type=int, default=20)
+    args = parser.parse_args()
+
+    database.SUPABASE_URL = URL_FALSA
+    database.SUPABASE_KEY = KEY_FALSA
+    print(f"{args.peticiones} POST /pedido-producto, concurrencia {args.concurrencia}, latencia upstream {args.latencia * 1000:.0f} ms")
+    print(f"{'modo':<16} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'llam./pet.':>11} {'drenado ms':>11} {'stock ok':>10}")
+    for en_segundo_plano in (False, True):
+        await correr(args, en_segundo_plano)
+    print(cola_efectos.estadisticas())
+
+if __name__ == "__main__":
+    asyncio.run(main())
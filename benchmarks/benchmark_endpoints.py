@@ -0,0 +1,186 @@
+"""
+Mide cada endpoint de los routers contra el PostgREST simulado en memoria y reporta
+peticiones por segundo, latencias p50/p95/p99 y llamadas a PostgREST por petición.
+Los patrones N+1 se ven directamente en la columna de llamadas por petición.
+
+Uso:
+    python benchmarks/benchmark_endpoints.py [--latencia 0.005] [--concurrencia 50] [--peticiones 500]
+        [--clientes 100] [--pedidos 1000] [--lineas 3] [--productos 50]
+        [--filtro pedido-producto] [--json resultados.json] [--comparar base.json --tolerancia 15]
+
+Con --comparar el script termina con código 1 si algún endpoint pierde más de --tolerancia %
+de req/s o hace más llamadas a PostgREST por petición que en la corrida base, para usarlo en CI.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from typing import Callable, Dict, List, Tuple
+
+import httpx
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Los efectos encolados y el stock sin volcar de una corrida no deben quedar en el diario para la siguiente
+os.environ.setdefault("EFECTOS_DIARIO", ":memory:")
+os.environ.setdefault("INVENTARIO_DIARIO", ":memory:")
+
+from app import database
+from app.efectos import cola_efectos
+from app.inventario import libro_inventario
+from app.cache import cache_entidades
+from app.ventas import indice_ventas
+from benchmarks.postgrest_falso import PostgRESTFalso, sembrar_datos, percentil, URL_FALSA, KEY_FALSA
+
+# Cada escenario recibe el número de petición y devuelve (método, ruta, json del cuerpo)
+Escenario = Tuple[str, Callable[[int], Tuple[str, str, Dict]]]
+
+def crear_escenarios(args) -> List[Escenario]:
+    clientes, pedidos, productos = args.clientes, args.pedidos, args.productos
+    cliente = lambda i: i % clientes + 1
+    pedido = lambda i: i % pedidos + 1
+    producto = lambda i: i % productos + 1
+    linea = {"cantidad": 1, "precio_unitario": 1000, "subtotal": 1000}
+
+    return [
+        ("GET /clientes", lambda i: ("GET", "/clientes/", None)),
+        ("GET /clientes?limit=50", lambda i: ("GET", "/clientes/?limit=50", None)),
+        ("GET /clientes/{id}", lambda i: ("GET", f"/clientes/{cliente(i)}", None)),
+        ("GET /clientes/rut/{rut}", lambda i: ("GET", f"/clientes/rut/{10_000_000 + cliente(i)}-{cliente(i) % 10}", None)),
+        ("POST /clientes/login", lambda i: ("POST", "/clientes/login", {"correo": f"cliente{cliente(i)}@spinzone.cl", "contrasena": "secreta"})),
+        ("PUT /clientes/{id}", lambda i: ("PUT", f"/clientes/{cliente(i)}", {"telefono": f"9{i:08d}"})),
+        ("GET /empleados", lambda i: ("GET", "/empleados/", None)),
+        ("GET /empleados/{id}", lambda i: ("GET", f"/empleados/{i % args.empleados + 1}", None)),
+        ("POST /empleados/login", lambda i: ("POST", "/empleados/login", {"correo": f"empleado{i % args.empleados + 1}@spinzone.cl", "contrasena": "secreta"})),
+        ("GET /pedidos", lambda i: ("GET", "/pedidos/", None)),
+        ("GET /pedidos?limit=100", lambda i: ("GET", "/pedidos/?limit=100", None)),
+        ("GET /pedidos/{id}", lambda i: ("GET", f"/pedidos/{pedido(i)}", None)),
+        ("GET /pedidos/{id}/completo", lambda i: ("GET", f"/pedidos/{pedido(i)}/completo", None)),
+        ("GET /pedidos/cliente/{id}", lambda i: ("GET", f"/pedidos/cliente/{cliente(i)}", None)),
+        ("POST /pedidos", lambda i: ("POST", "/pedidos/", {"medio_pago_id": i % 2 + 1, "id_estado_envio": 1, "id_estado": 1, "id_cliente": cliente(i)})),
+        ("PUT /pedidos/{id}", lambda i: ("PUT", f"/pedidos/{pedido(i)}", {"id_estado": i % 4 + 1})),
+        ("PATCH /pedidos/{id}/estado", lambda i: ("PATCH", f"/pedidos/{pedido(i)}/estado?id_estado={i % 4 + 1}", None)),
+        ("GET /pedido-producto/pedido/{id}", lambda i: ("GET", f"/pedido-producto/pedido/{pedido(i)}", None)),
+        ("GET /pedido-producto/producto/{id}", lambda i: ("GET", f"/pedido-producto/producto/{producto(i)}", None)),
+        ("GET /pedido-producto/{id}", lambda i: ("GET", f"/pedido-producto/{i % (pedidos * args.lineas) + 1}", None)),
+        ("GET /pedido-producto/productos/mas-vendidos", lambda i: ("GET", "/pedido-producto/productos/mas-vendidos?limit=15", None)),
+        ("POST /pedido-producto", lambda i: ("POST", "/pedido-producto/", dict(linea, id_pedido=pedido(i), id_producto=producto(i)))),
+        ("POST /pedido-producto/bulk/{id}", lambda i: ("POST", f"/pedido-producto/bulk/{pedido(i)}", {
+            "productos": [dict(linea, id_pedido=pedido(i), id_producto=producto(i + j)) for j in range(5)]
+        })),
+        ("PUT /pedido-producto/{id_pedido}/{id_producto}", lambda i: (
+            "PUT", f"/pedido-producto/{pedido(i)}/{(pedido(i) % productos) + 1}", {"cantidad": i % 5 + 1}
+        )),
+        ("DELETE /pedido-producto/{id_pedido}/{id_producto}", lambda i: (
+            "DELETE", f"/pedido-producto/{pedido(i)}/{(pedido(i) % productos) + 1}", None
+        )),
+    ]
+
+async def medir(cliente: httpx.AsyncClient, falso: PostgRESTFalso, generar, peticiones: int, concurrencia: int) -> Dict:
+    cache_entidades.limpiar()
+    indice_ventas.invalidar()
+    semaforo = asyncio.Semaphore(concurrencia)
+    latencias: List[float] = []
+    errores = 0
+
+    async def una(i: int):
+        nonlocal errores
+        metodo, ruta, cuerpo = generar(i)
+        async with semaforo:
+            inicio = time.perf_counter()
+            respuesta = await cliente.request(metodo, ruta, json=cuerpo)
+            await respuesta.aread()
+            latencias.append(time.perf_counter() - inicio)
+            if respuesta.status_code >= 400:
+                errores += 1
+
+    llamadas_antes = falso.llamadas
+    inicio = time.perf_counter()
+    await asyncio.gather(*(una(i) for i in range(peticiones)))
+    duracion = time.perf_counter() - inicio
+    # Las llamadas de los efectos en segundo plano y del volcado de stock se cuentan en el endpoint que los originó
+    await cola_efectos.drenar()
+    await libro_inventario.volcar()
+
+    return {
+        "req_s": round(peticiones / duracion, 1),
+        "p50_ms": round(percentil(latencias, 0.50) * 1000, 2),
+        "p95_ms": round(percentil(latencias, 0.95) * 1000, 2),
+        "p99_ms": round(percentil(latencias, 0.99) * 1000, 2),
+        "llamadas_por_peticion": round((falso.llamadas - llamadas_antes) / peticiones, 2),
+        "errores": errores,
+    }
+
+def comparar(resultados: Dict[str, Dict], base: Dict[str, Dict], tolerancia: float) -> List[str]:
+    regresiones = []
+    for nombre, actual in resultados.items():
+        anterior = base.get(nombre)
+        if not anterior:
+            continue
+        if actual["req_s"] < anterior["req_s"] * (1 - tolerancia / 100):
+            regresiones.append(f"{nombre}: {anterior['req_s']} -> {actual['req_s']} req/s")
+        if actual["llamadas_por_peticion"] > anterior["llamadas_por_peticion"]:
+            regresiones.append(f"{nombre}: {anterior['llamadas_por_peticion']} -> {actual['llamadas_por_peticion']} llamadas por petición")
+    return regresiones
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latencia", type=float, default=0.005, help="Latencia simulada de cada llamada a PostgREST (s)")
+    parser.add_argument("--concurrencia", type=int, default=50)
+    parser.add_argument("--peticiones", type=int, default=500, help="Peticiones por endpoint")
+    parser.add_argument("--clientes", type=int, default=100)
+    parser.add_argument("--empleados", type=int, default=20)
+    parser.add_argument("--pedidos", type=int, default=1000)
+    parser.add_argument("--lineas", type=int, default=3, help="Filas de pedido_producto por pedido")
+    parser.add_argument("--productos", type=int, default=50)
+    parser.add_argument("--filtro", help="Solo los endpoints cuyo nombre contiene este texto")
+    parser.add_argument("--json", help="Guarda los resultados en este archivo")
+    parser.add_argument("--comparar", help="Archivo JSON de una corrida anterior para detectar regresiones")
+    parser.add_argument("--tolerancia", type=float, default=15, help="Caída de req/s aceptada al comparar (%%)")
+    args = parser.parse_args()
+
+    falso = PostgRESTFalso(latencia=args.latencia)
+    sembrar_datos(falso, clientes=args.clientes, pedidos=args.pedidos, lineas_por_pedido=args.lineas,
+                  productos=args.productos, empleados=args.empleados)
+    database.SUPABASE_URL = URL_FALSA
+    database.SUPABASE_KEY = KEY_FALSA
+    database.reiniciar_conexion(falso.transporte_async())
+    from app.main import app
+
+    escenarios = [(nombre, generar) for nombre, generar in crear_escenarios(args) if not args.filtro or args.filtro in nombre]
+    resultados: Dict[str, Dict] = {}
+
+    print(f"latencia upstream {args.latencia * 1000:.0f} ms, concurrencia {args.concurrencia}, {args.peticiones} peticiones por endpoint")
+    print(f"{'endpoint':<50} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'llamadas':>9} {'errores':>8}")
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://api") as cliente:
+        await cliente.get("/")
+        for nombre, generar in escenarios:
+            r = await medir(cliente, falso, generar, args.peticiones, args.concurrencia)
+            resultados[nombre] = r
+            print(f"{nombre:<50} {r['req_s']:>8.0f} {r['p50_ms']:>8.1f} {r['p95_ms']:>8.1f} {r['p99_ms']:>8.1f} {r['llamadas_por_peticion']:>9.2f} {r['errores']:>8}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as archivo:
+            json.dump({"parametros": vars(args), "resultados": resultados}, archivo, indent=2, ensure_ascii=False)
+
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as archivo:
+            base = json.load(archivo)
+        distintos = [
+            clave for clave in ("latencia", "concurrencia", "peticiones", "clientes", "empleados", "pedidos", "lineas", "productos")
+            if base["parametros"].get(clave) != getattr(args, clave)
+        ]
+        if distintos:
+            print(f"\nAdvertencia: la corrida base usó otros valores de {', '.join(distintos)}; los números no son comparables")
+        regresiones = comparar(resultados, base["resultados"], args.tolerancia)
+        if regresiones:
+            print("\nRegresiones respecto de la corrida base:")
+            for regresion in regresiones:
+                print(f"  {regresion}")
+            return 1
+        print("\nSin regresiones respecto de la corrida base")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,86 @@
+"""
+Compara filtrar pedidos en el cliente (descargar GET /pedidos completo y filtrar en Python,
+como hacía el backoffice) con los filtros y el orden de GET /pedidos resueltos en Supabase,
+contra el PostgREST simulado en memoria. Reporta latencia, bytes transferidos y filas.
+
+El PostgREST simulado no tiene índices, así que la diferencia que se mide es la de
+transferencia, serialización y páginas pedidas; en Supabase, con sql/indices_pedidos.sql,
+además se evita recorrer la tabla.
+
+Uso:
+    python benchmarks/benchmark_filtros.py [--pedidos 5000] [--latencia 0.005] [--repeticiones 20]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+from typing import Callable, Dict, List, Tuple
+
+import httpx
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import database
+from benchmarks.postgrest_falso import PostgRESTFalso, sembrar_datos, URL_FALSA, KEY_FALSA
+
+# Nombre -> (parámetros de GET /pedidos, mismo filtro aplicado a una fila en el cliente)
+FILTROS: List[Tuple[str, Dict, Callable[[Dict], bool]]] = [
+    ("estado 2", {"id_estado": 2}, lambda p: p["id_estado"] == 2),
+    ("estado 1 y envío 2", {"id_estado": 1, "id_estado_envio": 2}, lambda p: p["id_estado"] == 1 and p["id_estado_envio"] == 2),
+    ("primer trimestre", {"desde": "2025-01-01", "hasta": "2025-03-31"}, lambda p: "2025-01-01" <= p["fecha"] <= "2025-03-31"),
+    ("estado 3, pago 1, marzo", {"id_estado": 3, "medio_pago_id": 1, "desde": "2025-03-01", "hasta": "2025-03-31"},
+     lambda p: p["id_estado"] == 3 and p["medio_pago_id"] == 1 and "2025-03-01" <= p["fecha"] <= "2025-03-31"),
+]
+
+async def medir(repeticiones: int, peticion: Callable) -> Dict[str, float]:
+    tiempos, bytes_, filas = [], 0, 0
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        bytes_, filas = await peticion()
+        tiempos.append(time.perf_counter() - inicio)
+    return {"p50": statistics.median(tiempos) * 1000, "bytes": bytes_, "filas": filas}
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latencia", type=float, default=0.005, help="Latencia simulada de cada llamada a PostgREST (s)")
+    parser.add_argument("--pedidos", type=int, default=5000)
+    parser.add_argument("--clientes", type=int, default=500)
+    parser.add_argument("--repeticiones", type=int, default=20)
+    parser.add_argument("--limit", type=int, default=100, help="Tamaño de la primera página en el modo paginado")
+    args = parser.parse_args()
+
+    falso = PostgRESTFalso(latencia=args.latencia)
+    sembrar_datos(falso, clientes=args.clientes, pedidos=args.pedidos)
+    database.SUPABASE_URL = URL_FALSA
+    database.SUPABASE_KEY = KEY_FALSA
+    database.reiniciar_conexion(falso.transporte_async())
+    from app.main import app
+
+    print(f"{args.pedidos} pedidos, latencia upstream {args.latencia * 1000:.0f} ms, mediana de {args.repeticiones} peticiones")
+    print(f"{'filtro':<26} {'modo':<26} {'p50 ms':>8} {'KiB':>9} {'filas':>6}")
+
+    # Sin compresión, para comparar bytes de JSON
+    cabeceras = {"Accept-Encoding": "identity"}
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://api", headers=cabeceras) as cliente:
+        async def en_cliente(filtro):
+            respuesta = await cliente.get("/pedidos/")
+            return len(respuesta.content), sum(1 for pedido in respuesta.json() if filtro(pedido))
+
+        async def en_servidor(parametros):
+            respuesta = await cliente.get("/pedidos/", params=parametros)
+            return len(respuesta.content), len(respuesta.json())
+
+        for nombre, parametros, filtro in FILTROS:
+            modos = [
+                ("cliente (lista completa)", lambda: en_cliente(filtro)),
+                ("servidor", lambda: en_servidor(parametros)),
+                (f"servidor, limit={args.limit}", lambda: en_servidor({**parametros, "limit": args.limit, "orden": "-fecha"})),
+            ]
+            for modo, peticion in modos:
+                r = await medir(args.repeticiones, peticion)
+                print(f"{nombre:<26} {modo:<26} {r['p50']:>8.1f} {r['bytes'] / 1024:>9.1f} {r['filas']:>6}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
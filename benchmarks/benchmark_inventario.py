@@ -0,0 +1,161 @@
+"""
+Miles de POST /pedido-producto concurrentes, pagados por transferencia, sobre unos pocos productos
+con stock limitado, contra el PostgREST simulado en memoria. Compara descontar el stock con la
+cola de efectos (sin reserva, INVENTARIO_LIBRO=0) con el libro de inventario (app/inventario.py).
+
+Verifica que no se pierdan ni se dupliquen descuentos: al terminar, el stock de cada producto en
+PostgREST debe ser el inicial menos las unidades de las líneas aceptadas, y nunca se deben aceptar
+más unidades que el stock inicial. Con --fallas, esa fracción de los volcados del libro falla: la
+mitad antes de aplicar el lote y la otra mitad después (como un timeout tras el commit).
+Si el libro no cumple alguna de estas condiciones (o rechaza pedidos que tenían stock), termina
+con código 1; la cola de efectos sobrevende por diseño y solo se reporta.
+También cuenta las llamadas a Supabase que descontaron stock: la cola agrupa por lote de
+efectos y el libro por volcado (cada INVENTARIO_VOLCADO segundos) y shard.
+
+Uso:
+    python benchmarks/benchmark_inventario.py [--peticiones 5000] [--concurrencia 500] [--productos 5] [--stock 800] [--fallas 0.2]
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+from collections import Counter
+from typing import Dict, List
+
+import httpx
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("EFECTOS_DIARIO", ":memory:")
+os.environ.setdefault("INVENTARIO_DIARIO", ":memory:")
+
+from app import database
+from app.cache import cache_entidades
+from app.efectos import cola_efectos
+from app.inventario import libro_inventario, MEDIO_PAGO_TRANSFERENCIA
+from benchmarks.postgrest_falso import PostgRESTFalso, sembrar_datos, percentil, stock, URL_FALSA, KEY_FALSA
+
+def contar_escrituras(falso: PostgRESTFalso) -> Counter:
+    """Cuenta las llamadas a las funciones que descuentan stock."""
+    conteo: Counter = Counter()
+    for nombre in ("aplicar_efectos_stock", "aplicar_lote_stock"):
+        def contada(argumentos: Dict, funcion=falso.funciones[nombre]):
+            conteo["escrituras"] += 1
+            return funcion(argumentos)
+        falso.funciones[nombre] = contada
+    return conteo
+
+def inyectar_fallas(falso: PostgRESTFalso, fraccion: float):
+    aplicar = falso.funciones["aplicar_lote_stock"]
+    azar = random.Random(0)
+
+    def con_fallas(argumentos: Dict):
+        sorteo = azar.random()
+        if sorteo < fraccion / 2:
+            raise RuntimeError("Falla inyectada antes de aplicar el lote")
+        resultado = aplicar(argumentos)
+        if sorteo < fraccion:
+            raise RuntimeError("Falla inyectada después de aplicar el lote")
+        return resultado
+
+    falso.funciones["aplicar_lote_stock"] = con_fallas
+
+async def correr(args, con_libro: bool) -> List[str]:
+    """Corre un modo y devuelve las condiciones que no se cumplieron (solo se exigen al libro)."""
+    falso = PostgRESTFalso(latencia=args.latencia)
+    sembrar_datos(falso, clientes=50, pedidos=args.peticiones, lineas_por_pedido=0, productos=args.productos)
+    for pedido in falso.tablas["pedido"]:
+        pedido["medio_pago_id"] = MEDIO_PAGO_TRANSFERENCIA
+    for producto in falso.tablas["producto"]:
+        producto["stock"] = args.stock
+    if con_libro and args.fallas:
+        inyectar_fallas(falso, args.fallas)
+    escrituras = contar_escrituras(falso)
+    database.reiniciar_conexion(falso.transporte_async())
+    cache_entidades.limpiar()
+    from app.main import app
+    libro_inventario.activo = con_libro
+    inicial = stock(falso)
+
+    semaforo = asyncio.Semaphore(args.concurrencia)
+    tiempos: List[float] = []
+    estados: Counter = Counter()
+
+    async def agregar(cliente: httpx.AsyncClient, i: int):
+        async with semaforo:
+            inicio = time.perf_counter()
+            respuesta = await cliente.post("/pedido-producto/", json={
+                "cantidad": 1, "precio_unitario": 1000, "subtotal": 1000, "id_pedido": i + 1, "id_producto": i % args.productos + 1
+            })
+            tiempos.append(time.perf_counter() - inicio)
+            estados[respuesta.status_code] += 1
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://api", timeout=None) as cliente:
+        inicio = time.perf_counter()
+        await asyncio.gather(*(agregar(cliente, i) for i in range(args.peticiones)))
+        duracion = time.perf_counter() - inicio
+    await cola_efectos.drenar()
+    # Con fallas inyectadas el último volcado puede fallar: se reintenta hasta que el libro quede vacío
+    while con_libro and (libro_inventario.estadisticas()["pendiente"] or libro_inventario.estadisticas()["en_vuelo"]):
+        await libro_inventario.volcar()
+    fallos_volcado = libro_inventario.fallos_volcado
+    await libro_inventario.detener()
+
+    vendidos = Counter(linea["id_producto"] for linea in falso.tablas["pedido_producto"])
+    pedidos = Counter(i % args.productos + 1 for i in range(args.peticiones))
+    final = stock(falso)
+    sobreventa = sum(max(0, vendidos[id_producto] - inicial[id_producto]) for id_producto in inicial)
+    correcto = all(final[id_producto] == inicial[id_producto] - vendidos[id_producto] for id_producto in inicial)
+    rechazos_indebidos = sum(min(pedidos[id_producto], inicial[id_producto]) - vendidos[id_producto] for id_producto in inicial)
+    modo = "libro" if con_libro else "cola de efectos"
+    texto_estados = " ".join(f"{estado}:{n}" for estado, n in sorted(estados.items()))
+    print(f"{modo:<16} {args.peticiones / duracion:>7.0f} {statistics.median(tiempos) * 1000:>8.1f} {percentil(tiempos, 0.99) * 1000:>8.1f} "
+          f"{texto_estados:<16} {sum(vendidos.values()):>8} {sobreventa:>10} {sum(final.values()):>12} {'sí' if correcto else 'NO':>9} "
+          f"{escrituras['escrituras']:>17} {fallos_volcado if con_libro else '':>8}")
+
+    if not con_libro:
+        return []
+    fallas = []
+    if sobreventa:
+        fallas.append(f"el libro aceptó {sobreventa} unidades más que el stock inicial")
+    if not correcto:
+        diferencias = {id_producto: final[id_producto] - (inicial[id_producto] - vendidos[id_producto]) for id_producto in inicial}
+        fallas.append(f"el stock final no es el inicial menos lo vendido (diferencia por producto: {diferencias})")
+    if rechazos_indebidos:
+        fallas.append(f"el libro rechazó {rechazos_indebidos} pedidos que tenían stock")
+    if estados.keys() - {200, 409}:
+        fallas.append(f"respuestas inesperadas: {texto_estados}")
+    return fallas
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latencia", type=float, default=0.005, help="Latencia simulada de cada llamada a PostgREST (s)")
+    parser.add_argument("--peticiones", type=int, default=5000, help="POST /pedido-producto, cada uno a un pedido distinto")
+    parser.add_argument("--concurrencia", type=int, default=500)
+    parser.add_argument("--productos", type=int, default=5)
+    parser.add_argument("--stock", type=int, default=800, help="Stock inicial de cada producto")
+    parser.add_argument("--fallas", type=float, default=0.2, help="Fracción de volcados del libro que fallan")
+    args = parser.parse_args()
+
+    database.SUPABASE_URL = URL_FALSA
+    database.SUPABASE_KEY = KEY_FALSA
+    print(f"{args.peticiones} POST /pedido-producto de 1 unidad, concurrencia {args.concurrencia}, "
+          f"{args.productos} productos con stock {args.stock} ({args.productos * args.stock} unidades)")
+    print(f"{'modo':<16} {'req/s':>7} {'p50 ms':>8} {'p99 ms':>8} {'estados':<16} {'vendidos':>8} {'sobreventa':>10} "
+          f"{'stock final':>12} {'stock ok':>9} {'escrituras stock':>17} {'fallas':>8}")
+    fallas = []
+    for con_libro in (False, True):
+        fallas += await correr(args, con_libro)
+
+    if fallas:
+        print("\nEl libro de inventario no cumplió:")
+        for falla in fallas:
+            print(f"  {falla}")
+        return 1
+    print("\nLibro de inventario: sin sobreventa y con el stock final exacto")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
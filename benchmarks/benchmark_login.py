@@ -0,0 +1,95 @@
+"""
+Mide POST /clientes/login con contraseñas hasheadas con scrypt al costo configurado
+(HASH_SCRYPT_N / HASH_SCRYPT_R / HASH_SCRYPT_P, HASH_WORKERS) y, en paralelo, la latencia de
+GET / para comprobar que el hashing no bloquea el event loop. Compara la verificación en el
+pool de hashing con la misma verificación hecha directamente en el event loop.
+
+Uso:
+    HASH_SCRYPT_N=16384 python benchmarks/benchmark_login.py [--latencia 0.01] [--concurrencia 50] [--peticiones 200]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from typing import Dict, List
+
+import httpx
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import database, contrasenas
+from benchmarks.postgrest_falso import PostgRESTFalso, sembrar_datos, percentil, URL_FALSA, KEY_FALSA
+
+async def medir(cliente: httpx.AsyncClient, peticiones: int, concurrencia: int, clientes: int) -> Dict[str, float]:
+    semaforo = asyncio.Semaphore(concurrencia)
+    latencias: List[float] = []
+    latencias_raiz: List[float] = []
+    terminado = False
+
+    async def login(i: int):
+        async with semaforo:
+            inicio = time.perf_counter()
+            respuesta = await cliente.post("/clientes/login", json={"correo": f"cliente{i % clientes + 1}@spinzone.cl", "contrasena": "secreta"})
+            latencias.append(time.perf_counter() - inicio)
+            respuesta.raise_for_status()
+
+    async def sondear_raiz():
+        while not terminado:
+            inicio = time.perf_counter()
+            await cliente.get("/")
+            latencias_raiz.append(time.perf_counter() - inicio)
+            await asyncio.sleep(0.01)
+
+    sonda = asyncio.create_task(sondear_raiz())
+    inicio = time.perf_counter()
+    await asyncio.gather(*(login(i) for i in range(peticiones)))
+    duracion = time.perf_counter() - inicio
+    terminado = True
+    await sonda
+
+    return {
+        "req_s": peticiones / duracion,
+        "p50": percentil(latencias, 0.50) * 1000,
+        "p95": percentil(latencias, 0.95) * 1000,
+        "p99": percentil(latencias, 0.99) * 1000,
+        "raiz_p50": percentil(latencias_raiz, 0.50) * 1000,
+        "raiz_p99": percentil(latencias_raiz, 0.99) * 1000,
+    }
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latencia", type=float, default=0.01, help="Latencia simulada de cada llamada a PostgREST (s)")
+    parser.add_argument("--concurrencia", type=int, default=50)
+    parser.add_argument("--peticiones", type=int, default=200)
+    parser.add_argument("--clientes", type=int, default=100)
+    args = parser.parse_args()
+
+    falso = PostgRESTFalso(latencia=args.latencia)
+    sembrar_datos(falso, clientes=args.clientes)
+    hash_secreta = contrasenas.hashear("secreta")
+    for fila in falso.tablas["cliente"]:
+        fila["contrasena"] = hash_secreta
+
+    database.SUPABASE_URL = URL_FALSA
+    database.SUPABASE_KEY = KEY_FALSA
+    database.reiniciar_conexion(falso.transporte_async())
+    from app.main import app
+    from app.routers import clientes
+
+    print(f"scrypt N={contrasenas.HASH_SCRYPT_N} r={contrasenas.HASH_SCRYPT_R} p={contrasenas.HASH_SCRYPT_P}, "
+          f"{contrasenas.HASH_WORKERS} hilos de hashing, {os.cpu_count()} CPU, latencia upstream {args.latencia * 1000:.0f} ms")
+    print(f"{'modo':<14} {'login req/s':>11} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'GET / p50':>10} {'GET / p99':>10}")
+
+    async def verificar_en_loop(contrasena, almacenado):
+        return contrasenas.verificar(contrasena, almacenado)
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://api") as cliente:
+        await cliente.get("/")
+        for modo, verificador in (("en el loop", verificar_en_loop), ("pool", contrasenas.verificar_contrasena)):
+            clientes.verificar_contrasena = verificador
+            r = await medir(cliente, args.peticiones, args.concurrencia, args.clientes)
+            print(f"{modo:<14} {r['req_s']:>11.1f} {r['p50']:>8.1f} {r['p95']:>8.1f} {r['p99']:>8.1f} {r['raiz_p50']:>10.1f} {r['raiz_p99']:>10.1f}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,141 @@
+"""
+Mide los pools de conexiones hacia Supabase (app/conexiones.py) con conexiones TCP reales: el
+PostgREST simulado se sirve con uvicorn en localhost y la API usa el cliente de get_conexion.
+
+- "primera petición": latencia de la primera petición con el pool en frío y después de
+  precalentarlo como en el arranque de la app (p99 es la peor de las repeticiones).
+- "lecturas + escrituras": carga de listados con POST /pedidos intercalados, con un solo pool
+  para todo y con pools separados, para ver cuánto esperan las escrituras por una conexión.
+
+En localhost abrir una conexión cuesta poco; contra Supabase se suma el handshake TLS
+(decenas de ms), así que la diferencia de la primera petición se amplifica.
+
+Uso:
+    python benchmarks/benchmark_pool.py [--latencia 0.01] [--usuarios 100] [--duracion 5] [--repeticiones 20] [--max-conexiones 16]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import socket
+import statistics
+import sys
+import time
+from typing import Dict, List, Tuple
+
+import httpx
+import uvicorn
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import database, conexiones
+from app.coalescencia import coalescedor
+from app.etag import cache_etags
+from benchmarks.postgrest_falso import PostgRESTFalso, sembrar_datos, percentil, KEY_FALSA
+
+def puerto_libre() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+async def reiniciar(separados: bool, max_conexiones: int):
+    await database.cerrar_conexion()
+    conexiones.HTTP_POOLS_SEPARADOS = separados
+    conexiones.HTTP_MAX_CONEXIONES = max_conexiones
+    conexiones.HTTP_MAX_KEEPALIVE = max_conexiones
+    coalescedor.limpiar()
+
+def resumen_pools() -> str:
+    return "; ".join(
+        f"{nombre}: {pool.conexiones_abiertas} conexiones, espera p/máx {pool.estadisticas()['espera_promedio_ms']:.1f}/{pool.espera_maxima * 1000:.1f} ms"
+        for nombre, pool in database.pools_conexion().items()
+    )
+
+async def primera_peticion(cliente: httpx.AsyncClient, args, precalentado: bool) -> Tuple[float, float, int]:
+    """Latencia de la primera petición (ms), su espera por una conexión (ms) y conexiones que tuvo que abrir."""
+    await reiniciar(True, args.max_conexiones)
+    # El cliente ya creado en los dos modos: solo cambia si hay conexiones abiertas
+    await database.get_conexion()
+    if precalentado:
+        await database.precalentar_conexion()
+    pool = database.pools_conexion()["lectura"]
+    esperas, espera_total, abiertas = pool.esperas, pool.espera_total, pool.conexiones_abiertas
+
+    inicio = time.perf_counter()
+    (await cliente.get("/clientes/?limit=20")).raise_for_status()
+    latencia = (time.perf_counter() - inicio) * 1000
+    espera = (pool.espera_total - espera_total) / max(1, pool.esperas - esperas) * 1000
+    return latencia, espera, pool.conexiones_abiertas - abiertas
+
+async def mixta(cliente: httpx.AsyncClient, args, separados: bool):
+    await reiniciar(separados, args.max_conexiones)
+    await database.precalentar_conexion(1)
+    tiempos: Dict[str, List[float]] = {"lectura": [], "escritura": []}
+    fin = time.perf_counter() + args.duracion
+
+    async def usuario(numero: int):
+        i = numero
+        while time.perf_counter() < fin:
+            escritura = i % 10 == 0
+            inicio = time.perf_counter()
+            if escritura:
+                respuesta = await cliente.post("/pedidos/", json={"medio_pago_id": 1, "id_estado_envio": 1, "id_estado": 1, "id_cliente": i % 100 + 1})
+            else:
+                respuesta = await cliente.get(f"/clientes/?limit=20&after={i % 100}")
+            respuesta.raise_for_status()
+            tiempos["escritura" if escritura else "lectura"].append(time.perf_counter() - inicio)
+            i += 1
+
+    await asyncio.gather(*(usuario(n) for n in range(args.usuarios)))
+    modo = "pools separados" if separados else "un solo pool"
+    for tipo, muestras in tiempos.items():
+        print(f"{'lecturas + escrituras':<24} {modo:<16} {statistics.median(muestras) * 1000:>8.1f} {percentil(muestras, 0.99) * 1000:>9.1f} "
+              f"{tipo + ' ' + str(len(muestras)):>16}" + (f" {resumen_pools()}" if tipo == "escritura" else ""))
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latencia", type=float, default=0.01, help="Latencia de cada llamada a PostgREST (s)")
+    parser.add_argument("--usuarios", type=int, default=100, help="Clientes concurrentes en la carga mixta")
+    parser.add_argument("--duracion", type=float, default=5.0, help="Segundos de carga mixta por modo")
+    parser.add_argument("--repeticiones", type=int, default=20, help="Primeras peticiones medidas por modo")
+    parser.add_argument("--max-conexiones", type=int, default=16, help="Conexiones del pool de lecturas")
+    args = parser.parse_args()
+    logging.getLogger("app.conexiones").setLevel(logging.WARNING)
+
+    falso = PostgRESTFalso(latencia=args.latencia)
+    sembrar_datos(falso, clientes=100, pedidos=200)
+    falso.sembrar("rol", [{"id_rol": 1, "nombre": "admin"}])
+    puerto = puerto_libre()
+    servidor = uvicorn.Server(uvicorn.Config(falso.aplicacion_asgi(), host="127.0.0.1", port=puerto, log_level="warning", backlog=4096))
+    tarea = asyncio.create_task(servidor.serve())
+    while not servidor.started:
+        await asyncio.sleep(0.01)
+
+    database.SUPABASE_URL = f"http://127.0.0.1:{puerto}"
+    database.SUPABASE_KEY = KEY_FALSA
+    database.reiniciar_conexion()
+    from app.main import app
+    # Sin ventana de coalescencia ni 304, para que cada petición llegue a PostgREST
+    coalescedor.ventana = 0
+    cache_etags.ttl = 0
+
+    print(f"PostgREST simulado en 127.0.0.1:{puerto}, latencia {args.latencia * 1000:.0f} ms; pool de lecturas de {args.max_conexiones} conexiones")
+    print(f"{'escenario':<24} {'modo':<16} {'p50 ms':>8} {'p99 ms':>9} {'peticiones':>16} pools")
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://api", timeout=None) as cliente:
+        # Una petición descartada para que la primera medición no pague la carga de los routers
+        await primera_peticion(cliente, args, False)
+        for precalentado in (False, True):
+            muestras = [await primera_peticion(cliente, args, precalentado) for _ in range(args.repeticiones)]
+            latencias, esperas, abiertas = zip(*muestras)
+            modo = "precalentado" if precalentado else "en frío"
+            print(f"{'primera petición':<24} {modo:<16} {statistics.median(latencias):>8.1f} {max(latencias):>9.1f} {'':>16} "
+                  f"lectura: {statistics.mean(abiertas):.0f} conexiones nuevas, espera {statistics.median(esperas):.2f} ms")
+        for separados in (False, True):
+            await mixta(cliente, args, separados)
+
+    await database.cerrar_conexion()
+    servidor.should_exit = True
+    await tarea
+
+if __name__ == "__main__":
+    asyncio.run(main())
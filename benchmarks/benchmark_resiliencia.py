@@ -0,0 +1,110 @@
+"""
+Carga mixta contra el PostgREST simulado con fallas inyectadas, con y sin la capa de
+resiliencia (app/resiliencia.py):
+
+- "tabla lenta": las llamadas a `pedido` tardan --lenta segundos; las de `cliente` no.
+- "errores": una fracción --errores de las llamadas responde 503.
+
+Por ruta reporta respuestas por estado, p50/p99 y llamadas a PostgREST; con la capa activa
+las rutas sanas no deberían verse arrastradas por la lenta y, con el circuito abierto, los
+errores se responden sin llamar a Supabase.
+
+Uso:
+    python benchmarks/benchmark_resiliencia.py [--duracion 5] [--usuarios 50] [--lenta 3] [--errores 0.3] [--timeout 0.5]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+from collections import Counter, defaultdict
+from typing import Dict, List, Tuple
+
+import httpx
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import database
+from app.resiliencia import resiliencia, Circuito
+from benchmarks.postgrest_falso import PostgRESTFalso, sembrar_datos, percentil, URL_FALSA, KEY_FALSA
+
+# Listados: no pasan por la caché de entidades, así que cada petición llama a PostgREST
+RUTAS = ["/clientes/?limit=20&after={}", "/pedidos/?limit=20&after={}"]
+
+def configurar(protegida: bool, timeout: float):
+    """Sin protección: sin timeout, sin límite de concurrencia, sin reintentos ni circuito."""
+    resiliencia.timeout = timeout if protegida else 3600
+    resiliencia.concurrencia = 64 if protegida else 10 ** 6
+    resiliencia.concurrencia_tabla = 32 if protegida else 10 ** 6
+    resiliencia.reintentos = 2 if protegida else 0
+    resiliencia.crear_circuito = (lambda tabla: Circuito(tabla, espera=1.0)) if protegida else (lambda tabla: Circuito(tabla, minimo=10 ** 9))
+    resiliencia.circuitos.clear()
+    resiliencia.reiniciar_semaforos()
+
+async def carga(cliente: httpx.AsyncClient, duracion: float, usuarios: int) -> Dict[str, List[Tuple[int, float]]]:
+    resultados: Dict[str, List[Tuple[int, float]]] = defaultdict(list)
+    fin = time.perf_counter() + duracion
+
+    async def usuario(numero: int):
+        i = numero
+        while time.perf_counter() < fin:
+            plantilla = RUTAS[i % len(RUTAS)]
+            inicio = time.perf_counter()
+            respuesta = await cliente.get(plantilla.format(i % 50 + 1))
+            resultados[plantilla].append((respuesta.status_code, time.perf_counter() - inicio))
+            i += 1
+
+    await asyncio.gather(*(usuario(n) for n in range(usuarios)))
+    return resultados
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latencia", type=float, default=0.005, help="Latencia base de cada llamada a PostgREST (s)")
+    parser.add_argument("--duracion", type=float, default=5.0, help="Segundos de carga por escenario y modo")
+    parser.add_argument("--usuarios", type=int, default=50, help="Clientes concurrentes")
+    parser.add_argument("--lenta", type=float, default=3.0, help="Latencia extra de la tabla pedido (s)")
+    parser.add_argument("--errores", type=float, default=0.3, help="Fracción de llamadas que responden 503")
+    parser.add_argument("--timeout", type=float, default=0.5, help="UPSTREAM_TIMEOUT del modo protegido (s)")
+    args = parser.parse_args()
+
+    falso = PostgRESTFalso(latencia=args.latencia)
+    sembrar_datos(falso, clientes=200, pedidos=500)
+    database.SUPABASE_URL = URL_FALSA
+    database.SUPABASE_KEY = KEY_FALSA
+    database.reiniciar_conexion(falso.transporte_async())
+    from app.main import app
+    from app.coalescencia import coalescedor
+    coalescedor.ventana = 0
+
+    escenarios = {
+        "tabla lenta": lambda: falso.latencia_tablas.update(pedido=args.lenta),
+        "errores": lambda: setattr(falso, "tasa_errores", args.errores),
+    }
+
+    print(f"{args.usuarios} usuarios durante {args.duracion:g} s por modo; timeout protegido {args.timeout:g} s")
+    print(f"{'escenario':<12} {'modo':<14} {'ruta':<30} {'estados':<28} {'p50 ms':>8} {'p99 ms':>9} {'upstream':>9}")
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://api", timeout=None) as cliente:
+        for escenario, inyectar in escenarios.items():
+            for modo, protegida in (("sin protección", False), ("resiliencia", True)):
+                configurar(protegida, args.timeout)
+                falso.latencia_tablas.clear()
+                falso.tasa_errores = 0.0
+                inyectar()
+                llamadas = falso.llamadas
+                resultados = await carga(cliente, args.duracion, args.usuarios)
+                upstream = falso.llamadas - llamadas
+                for ruta, muestras in resultados.items():
+                    estados = Counter(estado for estado, _ in muestras)
+                    tiempos = [segundos for _, segundos in muestras]
+                    texto = " ".join(f"{estado}:{n}" for estado, n in sorted(estados.items()))
+                    print(f"{escenario:<12} {modo:<14} {ruta:<30} {texto:<28} {statistics.median(tiempos) * 1000:>8.1f} "
+                          f"{percentil(tiempos, 0.99) * 1000:>9.1f} {upstream:>9}")
+                    upstream = ""
+                # Dejar terminar las llamadas colgadas antes del siguiente modo
+                falso.latencia_tablas.clear()
+                await asyncio.sleep(0.1)
+            for tabla, circuito in resiliencia.estadisticas()["circuitos"].items():
+                print(f"{'':<12} circuito {tabla}: {circuito['estado']}, tasa de fallos {circuito['tasa_fallos']:.0%}, aperturas {circuito['aperturas']}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,422 @@
+import asyncio
+import json
+import math
+import random
+import time
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+from urllib.parse import unquote
+
+import httpx
+
+URL_FALSA = "http://postgrest.falso"
+KEY_FALSA = "clave-falsa"
+
+def _dividir_nivel_superior(texto: str) -> List[str]:
+    partes, profundidad, actual = [], 0, ""
+    for caracter in texto:
+        if caracter == "(":
+            profundidad += 1
+        elif caracter == ")":
+            profundidad -= 1
+        if caracter == "," and profundidad == 0:
+            partes.append(actual.strip())
+            actual = ""
+        else:
+            actual += caracter
+    if actual.strip():
+        partes.append(actual.strip())
+    return partes
+
+def _convertir(valor: str) -> Any:
+    if valor == "null":
+        return None
+    if valor in ("true", "false"):
+        return valor == "true"
+    try:
+        return int(valor)
+    except ValueError:
+        try:
+            return float(valor)
+        except ValueError:
+            return valor.strip('"')
+
+def _cumple(fila: Dict, columna: str, expresion: str) -> bool:
+    operador, _, valor = expresion.partition(".")
+    negado = operador == "not"
+    if negado:
+        operador, _, valor = valor.partition(".")
+    actual = fila.get(columna)
+    if operador == "in":
+        opciones = [_convertir(v) for v in _dividir_nivel_superior(valor.strip("()"))]
+        resultado = actual in opciones
+    elif operador == "is":
+        resultado = actual is _convertir(valor)
+    else:
+        esperado = _convertir(valor)
+        if actual is None and operador != "neq":
+            resultado = False
+        elif operador == "eq":
+            resultado = actual == esperado
+        elif operador == "neq":
+            resultado = actual != esperado
+        elif operador == "gt":
+            resultado = actual > esperado
+        elif operador == "gte":
+            resultado = actual >= esperado
+        elif operador == "lt":
+            resultado = actual < esperado
+        elif operador == "lte":
+            resultado = actual <= esperado
+        else:
+            raise ValueError(f"Operador no soportado: {operador}")
+    return not resultado if negado else resultado
+
+def _cumple_logico(fila: Dict, expresion: str, conjuncion: bool) -> bool:
+    resultados = []
+    for parte in _dividir_nivel_superior(expresion.strip("()")):
+        if parte.startswith("and(") or parte.startswith("or("):
+            nombre, _, resto = parte.partition("(")
+            resultados.append(_cumple_logico(fila, "(" + resto, nombre == "and"))
+        else:
+            columna, _, condicion = parte.partition(".")
+            resultados.append(_cumple(fila, columna, condicion))
+    return all(resultados) if conjuncion else any(resultados)
+
+class PostgRESTFalso:
+    """
+    Imitación en memoria de la API HTTP de PostgREST para medir la API sin tocar Supabase.
+    Entiende los filtros, embebidos y operaciones que usan los routers de la aplicación.
+    """
+
+    def __init__(self, latencia: float = 0.0):
+        self.latencia = latencia
+        self.tablas: Dict[str, List[Dict]] = {}
+        self.funciones: Dict[str, Callable[[Dict], Any]] = {
+            "descontar_stock": self._descontar_stock,
+            "aplicar_lote_stock": self._aplicar_lote_stock,
+            "aplicar_efectos_stock": self._aplicar_efectos_stock,
+            "aplicar_efectos_ventas": self._aplicar_efectos_ventas,
+            "ajustar_ventas": self._ajustar_ventas,
+            "actualizar_linea_pedido": self._actualizar_linea_pedido,
+            "reconstruir_producto_ventas": self._reconstruir_producto_ventas,
+        }
+        self.llamadas = 0
+        # Ids de los lotes ya aplicados por aplicar_lote_stock (tabla lotes_stock)
+        self.lotes_stock: Set[str] = set()
+        # Ids de los efectos de la cola ya aplicados (tabla efectos_aplicados)
+        self.efectos_aplicados: Set[str] = set()
+        # Fallas inyectadas para probar la capa de resiliencia: latencia extra por tabla
+        # (o rpc/<función>) y fracción de llamadas que responden `estado_error`
+        self.latencia_tablas: Dict[str, float] = {}
+        self.tasa_errores = 0.0
+        self.estado_error = 503
+        self._azar = random.Random(0)
+        # Restricciones UNIQUE que el falso hace cumplir en los insert (ver sql/rut_unico.sql)
+        self.unicas: Dict[str, Tuple[str, ...]] = {"cliente": ("rut",), "empleado": ("rut",)}
+
+    def pk(self, tabla: str) -> str:
+        return f"id_{tabla}"
+
+    def sembrar(self, tabla: str, filas: List[Dict]):
+        self.tablas.setdefault(tabla, []).extend(filas)
+
+    def siguiente_id(self, tabla: str) -> int:
+        pk = self.pk(tabla)
+        return max((fila.get(pk) or 0 for fila in self.tablas.get(tabla, [])), default=0) + 1
+
+    def _descontar_stock(self, argumentos: Dict) -> List[Dict]:
+        cantidades: Dict[int, int] = {}
+        for item in argumentos["items"]:
+            cantidades[item["id_producto"]] = cantidades.get(item["id_producto"], 0) + item["cantidad"]
+        productos = {p["id_producto"]: p for p in self.tablas.get("producto", [])}
+        resultados = []
+        for id_producto, cantidad in sorted(cantidades.items()):
+            producto = productos.get(id_producto)
+            anterior = producto["stock"] if producto else None
+            if producto:
+                producto["stock"] = max(0, anterior - cantidad)
+            resultados.append({
+                "id_producto": id_producto, "cantidad": cantidad, "stock_anterior": anterior,
+                "stock_nuevo": producto["stock"] if producto else None, "actualizado": producto is not None
+            })
+        return resultados
+
+    def _aplicar_lote_stock(self, argumentos: Dict) -> List[Dict]:
+        aplicado = argumentos["lote"] not in self.lotes_stock
+        if aplicado:
+            self.lotes_stock.add(argumentos["lote"])
+            self._descontar_stock(argumentos)
+        ids = {item["id_producto"] for item in argumentos["items"]}
+        return [
+            {"id_producto": p["id_producto"], "stock": p["stock"], "aplicado": aplicado}
+            for p in sorted(self.tablas.get("producto", []), key=lambda p: p["id_producto"]) if p["id_producto"] in ids
+        ]
+
+    def _efectos_nuevos(self, efectos: List[Dict], campo: str) -> List[Dict]:
+        nuevos = []
+        for efecto in efectos:
+            if efecto["id"] not in self.efectos_aplicados:
+                self.efectos_aplicados.add(efecto["id"])
+                nuevos.extend(efecto[campo])
+        return nuevos
+
+    def _aplicar_efectos_stock(self, argumentos: Dict) -> List[Dict]:
+        return self._descontar_stock({"items": self._efectos_nuevos(argumentos["efectos"], "items")})
+
+    def _aplicar_efectos_ventas(self, argumentos: Dict) -> List[Dict]:
+        return self._ajustar_ventas({"deltas": self._efectos_nuevos(argumentos["efectos"], "deltas")})
+
+    def _ajustar_ventas(self, argumentos: Dict) -> List[Dict]:
+        ventas = {f["id_producto"]: f for f in self.tablas.setdefault("producto_ventas", [])}
+        deltas: Dict[int, int] = {}
+        for item in argumentos["deltas"]:
+            deltas[item["id_producto"]] = deltas.get(item["id_producto"], 0) + item["delta"]
+        resultados = []
+        for id_producto, delta in sorted(deltas.items()):
+            fila = ventas.get(id_producto)
+            if fila is None:
+                fila = {"id_producto": id_producto, "total_vendido": 0}
+                self.tablas["producto_ventas"].append(fila)
+            fila["total_vendido"] = max(0, fila["total_vendido"] + delta)
+            resultados.append(dict(fila))
+        return resultados
+
+    def _actualizar_linea_pedido(self, argumentos: Dict) -> List[Dict]:
+        resultados = []
+        for fila in self.tablas.get("pedido_producto", []):
+            if fila["id_pedido"] == argumentos["pedido_id"] and fila["id_producto"] == argumentos["producto_id"]:
+                anterior = fila["cantidad"]
+                fila.update({k: v for k, v in argumentos["cambios"].items() if k in ("cantidad", "precio_unitario", "subtotal")})
+                resultados.append({**fila, "cantidad_anterior": anterior})
+        return resultados
+
+    def _reconstruir_producto_ventas(self, argumentos: Dict) -> int:
+        totales: Dict[int, int] = {}
+        for linea in self.tablas.get("pedido_producto", []):
+            totales[linea["id_producto"]] = totales.get(linea["id_producto"], 0) + linea["cantidad"]
+        self.tablas["producto_ventas"] = [
+            {"id_producto": id_producto, "total_vendido": total} for id_producto, total in totales.items()
+        ]
+        return len(totales)
+
+    def _proyectar(self, tabla: str, fila: Dict, select: str) -> Dict:
+        resultado = {}
+        for campo in _dividir_nivel_superior(select or "*"):
+            if "(" in campo:
+                relacion, _, columnas = campo.partition("(")
+                relacion = relacion.split("!")[0].split(":")[-1].strip()
+                columnas = columnas[:-1]
+                resultado[relacion] = self._embeber(tabla, fila, relacion, columnas)
+            elif campo == "*":
+                resultado.update(fila)
+            else:
+                nombre = campo.split(":")[-1].strip()
+                resultado[nombre] = fila.get(nombre)
+        return resultado
+
+    def _embeber(self, tabla: str, fila: Dict, relacion: str, columnas: str):
+        clave_foranea = self.pk(relacion)
+        if clave_foranea in fila:
+            for relacionada in self.tablas.get(relacion, []):
+                if relacionada.get(clave_foranea) == fila[clave_foranea]:
+                    return self._proyectar(relacion, relacionada, columnas)
+            return None
+        pk = self.pk(tabla)
+        return [
+            self._proyectar(relacion, relacionada, columnas)
+            for relacionada in self.tablas.get(relacion, [])
+            if relacionada.get(pk) == fila.get(pk)
+        ]
+
+    def _filtrar(self, tabla: str, params: httpx.QueryParams) -> List[Dict]:
+        filas = list(self.tablas.get(tabla, []))
+        for clave, valor in params.multi_items():
+            if clave in ("select", "order", "limit", "offset", "on_conflict", "columns"):
+                continue
+            if clave in ("or", "and"):
+                filas = [f for f in filas if _cumple_logico(f, valor, clave == "and")]
+            elif valor.startswith("eq.") and valor != "eq.null":
+                # La mayoría de las consultas filtran por igualdad: sin volver a interpretar el filtro por fila
+                esperado = _convertir(valor[3:])
+                filas = [f for f in filas if f.get(clave) == esperado]
+            else:
+                filas = [f for f in filas if _cumple(f, clave, valor)]
+        orden = params.get("order")
+        if orden:
+            for criterio in reversed(orden.split(",")):
+                columna, *modificadores = criterio.split(".")
+                descendente = "desc" in modificadores
+                filas.sort(key=lambda f: (f.get(columna) is None, f.get(columna)), reverse=descendente)
+        offset = int(params.get("offset", 0))
+        limite = params.get("limit")
+        filas = filas[offset:]
+        if limite is not None:
+            filas = filas[:int(limite)]
+        return filas
+
+    def responder(self, request: httpx.Request) -> httpx.Response:
+        self.llamadas += 1
+        ruta = unquote(request.url.path).split("/rest/v1/", 1)[-1]
+        params = request.url.params
+        cuerpo = json.loads(request.content) if request.content else None
+
+        try:
+            if ruta.startswith("rpc/"):
+                funcion = self.funciones.get(ruta[4:])
+                if funcion is None:
+                    return self._error(404, "PGRST202", f"Función {ruta[4:]} no encontrada")
+                return httpx.Response(200, json=funcion(cuerpo or {}))
+
+            tabla = ruta
+            select = params.get("select", "*")
+            if request.method in ("GET", "HEAD"):
+                filas = self._filtrar(tabla, params)
+                return httpx.Response(200, json=[self._proyectar(tabla, f, select) for f in filas])
+
+            if request.method == "POST":
+                nuevas = cuerpo if isinstance(cuerpo, list) else [cuerpo]
+                creadas = []
+                conflicto = params.get("on_conflict")
+                ignorar = "resolution=ignore-duplicates" in request.headers.get("prefer", "")
+                if not conflicto:
+                    for columna in self.unicas.get(tabla, ()):
+                        valores = [nueva.get(columna) for nueva in nuevas if nueva.get(columna) is not None]
+                        existentes = {f.get(columna) for f in self.tablas.get(tabla, [])}
+                        if len(set(valores)) != len(valores) or existentes.intersection(valores):
+                            return self._error(409, "23505", f'duplicate key value violates unique constraint "{tabla}_{columna}_key"')
+                for nueva in nuevas:
+                    existente = None
+                    if conflicto:
+                        existente = next(
+                            (f for f in self.tablas.get(tabla, []) if f.get(conflicto) == nueva.get(conflicto)),
+                            None
+                        )
+                    if existente is not None:
+                        if not ignorar:
+                            existente.update(nueva)
+                            creadas.append(existente)
+                        continue
+                    fila = dict(nueva)
+                    fila.setdefault(self.pk(tabla), self.siguiente_id(tabla))
+                    self.tablas.setdefault(tabla, []).append(fila)
+                    creadas.append(fila)
+                return httpx.Response(201, json=[self._proyectar(tabla, f, select) for f in creadas])
+
+            if request.method == "PATCH":
+                filas = self._filtrar(tabla, params)
+                for fila in filas:
+                    fila.update(cuerpo)
+                return httpx.Response(200, json=[self._proyectar(tabla, f, select) for f in filas])
+
+            if request.method == "DELETE":
+                filas = self._filtrar(tabla, params)
+                ids = {id(f) for f in filas}
+                self.tablas[tabla] = [f for f in self.tablas.get(tabla, []) if id(f) not in ids]
+                return httpx.Response(200, json=[self._proyectar(tabla, f, select) for f in filas])
+        except Exception as ex:
+            return self._error(400, "PGRST100", str(ex))
+
+        return self._error(405, "PGRST105", f"Método no soportado: {request.method}")
+
+    def _error(self, estado: int, codigo: str, mensaje: str) -> httpx.Response:
+        return httpx.Response(estado, json={"code": codigo, "message": mensaje, "details": None, "hint": None})
+
+    def _tabla(self, request: httpx.Request) -> str:
+        return unquote(request.url.path).split("/rest/v1/", 1)[-1]
+
+    def _falla_inyectada(self) -> Optional[httpx.Response]:
+        if self.tasa_errores and self._azar.random() < self.tasa_errores:
+            self.llamadas += 1
+            return self._error(self.estado_error, "PGRST000", "Falla inyectada")
+        return None
+
+    def transporte_async(self) -> httpx.MockTransport:
+        async def manejar(request: httpx.Request) -> httpx.Response:
+            latencia = self.latencia + self.latencia_tablas.get(self._tabla(request), 0.0)
+            if latencia:
+                await asyncio.sleep(latencia)
+            return self._falla_inyectada() or self.responder(request)
+        return httpx.MockTransport(manejar)
+
+    def transporte_sync(self) -> httpx.MockTransport:
+        def manejar(request: httpx.Request) -> httpx.Response:
+            latencia = self.latencia + self.latencia_tablas.get(self._tabla(request), 0.0)
+            if latencia:
+                time.sleep(latencia)
+            return self._falla_inyectada() or self.responder(request)
+        return httpx.MockTransport(manejar)
+
+    def aplicacion_asgi(self):
+        """La misma imitación como aplicación ASGI, para servirla con uvicorn y medir conexiones reales."""
+        async def aplicacion(scope, receive, send):
+            if scope["type"] != "http":
+                return
+            cuerpo = b""
+            while True:
+                mensaje = await receive()
+                cuerpo += mensaje.get("body", b"")
+                if not mensaje.get("more_body", False):
+                    break
+            url = scope["path"] + ("?" + scope["query_string"].decode("latin-1") if scope["query_string"] else "")
+            cabeceras = [(nombre.decode("latin-1"), valor.decode("latin-1")) for nombre, valor in scope["headers"]]
+            request = httpx.Request(scope["method"], "http://falso" + url, headers=cabeceras, content=cuerpo)
+            latencia = self.latencia + self.latencia_tablas.get(self._tabla(request), 0.0)
+            if latencia:
+                await asyncio.sleep(latencia)
+            response = self._falla_inyectada() or self.responder(request)
+            await send({"type": "http.response.start", "status": response.status_code,
+                        "headers": [(b"content-type", b"application/json")]})
+            await send({"type": "http.response.body", "body": response.content})
+        return aplicacion
+
+def sembrar_datos(falso: PostgRESTFalso, clientes: int = 100, pedidos: int = 500, lineas_por_pedido: int = 3, productos: int = 50, empleados: int = 20):
+    falso.sembrar("producto", [
+        {"id_producto": i, "nombre": f"Producto {i}", "precio": 1000 * i, "stock": 1_000_000}
+        for i in range(1, productos + 1)
+    ])
+    falso.sembrar("cliente", [
+        {
+            "id_cliente": i, "nombre": f"Cliente {i}", "apellido": "Prueba", "correo": f"cliente{i}@spinzone.cl",
+            "telefono": "912345678", "direccion": "Calle Falsa 123", "id_rol": 1,
+            "rut": f"{10_000_000 + i}-{i % 10}", "contrasena": "secreta"
+        }
+        for i in range(1, clientes + 1)
+    ])
+    falso.sembrar("empleado", [
+        {
+            "id_empleado": i, "nombre": f"Empleado {i}", "apellido": "Prueba", "rut": f"{20_000_000 + i}-{i % 10}",
+            "correo": f"empleado{i}@spinzone.cl", "contrasena": "secreta", "direccion": "Calle Falsa 456",
+            "telefono": "987654321", "rol_id": 2
+        }
+        for i in range(1, empleados + 1)
+    ])
+    falso.sembrar("pedido", [
+        {
+            "id_pedido": i, "fecha": f"2025-{(i % 12) + 1:02d}-{(i % 28) + 1:02d}", "medio_pago_id": (i % 2) + 1,
+            "id_estado_envio": (i % 3) + 1, "id_estado": (i % 4) + 1, "id_cliente": (i % clientes) + 1
+        }
+        for i in range(1, pedidos + 1)
+    ])
+    lineas, id_linea = [], 1
+    for id_pedido in range(1, pedidos + 1):
+        for j in range(lineas_por_pedido):
+            id_producto = ((id_pedido + j * 7) % productos) + 1
+            cantidad = (id_pedido + j) % 5 + 1
+            lineas.append({
+                "id_pedido_producto": id_linea, "id_pedido": id_pedido, "id_producto": id_producto,
+                "cantidad": cantidad, "precio_unitario": 1000 * id_producto, "subtotal": cantidad * 1000 * id_producto
+            })
+            id_linea += 1
+    falso.sembrar("pedido_producto", lineas)
+    falso._reconstruir_producto_ventas({})
+
+def stock(falso: PostgRESTFalso) -> Dict[int, int]:
+    """Stock actual de cada producto del PostgREST simulado."""
+    return {fila["id_producto"]: fila["stock"] for fila in falso.tablas["producto"]}
+
+def percentil(valores: List[float], p: float) -> float:
+    """Percentil `p` (0 a 1) de `valores` por rango más cercano, en las mismas unidades; 0 si no hay valores."""
+    if not valores:
+        return 0.0
+    valores = sorted(valores)
+    return valores[max(0, math.ceil(p * len(valores)) - 1)]
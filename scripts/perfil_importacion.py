@@ -0,0 +1,72 @@
+"""
+Mide el costo de importación de la API tal como lo paga un arranque en frío en Vercel.
+Ejecuta `python -X importtime` en un intérprete nuevo (varias veces, se queda con la mediana),
+lista los módulos más caros y agrupa el tiempo por paquete de primer nivel.
+
+Uso:
+    python scripts/perfil_importacion.py [--modulo api.index] [--presupuesto-ms 600] [--top 20] [--repeticiones 5]
+
+Termina con código 1 si el tiempo total supera el presupuesto, para usarlo en CI.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def medir(modulo: str) -> List[Tuple[str, int, int]]:
+    """Devuelve (módulo, propio_us, acumulado_us) para cada módulo importado por `modulo`."""
+    resultado = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {modulo}"],
+        cwd=RAIZ, capture_output=True, text=True
+    )
+    if resultado.returncode != 0:
+        raise RuntimeError(f"No se pudo importar {modulo}:\n{resultado.stderr}")
+
+    modulos = []
+    for linea in resultado.stderr.splitlines():
+        if not linea.startswith("import time:") or "self [us]" in linea:
+            continue
+        propio, acumulado, nombre = linea[len("import time:"):].split("|")
+        modulos.append((nombre.strip(), int(propio), int(acumulado)))
+    return modulos
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modulo", default="api.index", help="Módulo de entrada a importar")
+    parser.add_argument("--presupuesto-ms", type=float, default=600, help="Tiempo máximo de importación aceptado")
+    parser.add_argument("--top", type=int, default=20, help="Cantidad de módulos a listar")
+    parser.add_argument("--repeticiones", type=int, default=5)
+    args = parser.parse_args()
+
+    # La primera corrida compila los .pyc; no cuenta para la mediana
+    medir(args.modulo)
+    corridas = [medir(args.modulo) for _ in range(args.repeticiones)]
+    totales = [next(acumulado for nombre, _, acumulado in corrida if nombre == args.modulo) for corrida in corridas]
+    total_ms = statistics.median(totales) / 1000
+    modulos = corridas[totales.index(sorted(totales)[len(totales) // 2])]
+
+    print(f"Importación de {args.modulo}: {total_ms:.0f} ms (mediana de {args.repeticiones}, presupuesto {args.presupuesto_ms:.0f} ms)\n")
+
+    print(f"{'acumulado ms':>12} {'propio ms':>10}  módulo")
+    for nombre, propio, acumulado in sorted(modulos, key=lambda m: m[2], reverse=True)[:args.top]:
+        print(f"{acumulado / 1000:>12.1f} {propio / 1000:>10.1f}  {nombre}")
+
+    paquetes: Dict[str, int] = {}
+    for nombre, propio, _ in modulos:
+        paquete = nombre.split(".")[0]
+        paquetes[paquete] = paquetes.get(paquete, 0) + propio
+    print(f"\n{'propio ms':>10}  paquete")
+    for paquete, propio in sorted(paquetes.items(), key=lambda p: p[1], reverse=True)[:args.top]:
+        print(f"{propio / 1000:>10.1f}  {paquete}")
+
+    if total_ms > args.presupuesto_ms:
+        print(f"\nLa importación supera el presupuesto por {total_ms - args.presupuesto_ms:.0f} ms")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
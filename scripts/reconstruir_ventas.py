@@ -0,0 +1,23 @@
+import asyncio
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.database import get_conexion
+
+async def reconstruir_ventas():
+    """
+    Recalcula la tabla producto_ventas desde pedido_producto.
+    Usar tras crear la tabla (backfill) o si el agregado quedó desfasado.
+    """
+    print("Reconstruyendo el agregado de ventas por producto...")
+    
+    supabase = await get_conexion()
+    response = await supabase.rpc('reconstruir_producto_ventas', {}).execute()
+    
+    print(f"Agregado reconstruido: {response.data} productos con ventas")
+    print("Las instancias de la API recargarán el ranking de más vendidos al vencer TOP_VENTAS_TTL")
+
+if __name__ == "__main__":
+    asyncio.run(reconstruir_ventas())
@@ -0,0 +1,44 @@
+-- Aplica un lote de descuentos de stock del libro de inventario (app/inventario.py) una sola vez.
+-- Uso desde la API: supabase.rpc('aplicar_lote_stock', {'lote': '<id>', 'items': [{'id_producto': 1, 'cantidad': 2}, ...]})
+-- El id del lote queda registrado en lotes_stock: si la API lo reenvía (timeout, reinicio) no se
+-- descuenta de nuevo. El descuento en sí es el de descontar_stock (sql/descontar_stock.sql).
+-- Devuelve el stock actual de los productos del lote, con el que la API reconcilia sus contadores.
+create table if not exists lotes_stock (
+    id text primary key,
+    aplicado_en timestamptz not null default now()
+);
+
+create index if not exists lotes_stock_aplicado_en_idx on lotes_stock (aplicado_en);
+
+create or replace function aplicar_lote_stock(lote text, items jsonb)
+returns table (
+    id_producto integer,
+    stock integer,
+    aplicado boolean
+)
+language plpgsql
+as $$
+declare
+    nuevo boolean;
+begin
+    -- Un reenvío concurrente del mismo lote espera aquí a que el primero termine
+    insert into lotes_stock (id) values (lote) on conflict do nothing;
+    nuevo := found;
+
+    if nuevo then
+        perform descontar_stock(items);
+    end if;
+
+    return query
+        select p.id_producto, p.stock, nuevo
+        from producto p
+        where p.id_producto in (
+            select (item->>'id_producto')::integer from jsonb_array_elements(items) as item
+        )
+        order by p.id_producto;
+end;
+$$;
+
+-- Un lote solo se reenvía mientras la API no registró la respuesta (segundos); para que la tabla
+-- no crezca, borrar los registros viejos periódicamente (por ejemplo con pg_cron):
+--   select cron.schedule('limpiar-lotes-stock', '0 * * * *', $$delete from lotes_stock where aplicado_en < now() - interval '1 day'$$);
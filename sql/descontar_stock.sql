@@ -0,0 +1,44 @@
+-- Descuenta stock para una lista de productos en una sola llamada atómica.
+-- Uso desde la API: supabase.rpc('descontar_stock', {'items': [{'id_producto': 1, 'cantidad': 2}, ...]})
+-- Las filas se bloquean en orden de id_producto para evitar deadlocks entre pedidos concurrentes,
+-- y el stock nunca baja de 0 (mismo comportamiento que el antiguo max(0, stock - cantidad)).
+create or replace function descontar_stock(items jsonb)
+returns table (
+    id_producto integer,
+    cantidad integer,
+    stock_anterior integer,
+    stock_nuevo integer,
+    actualizado boolean
+)
+language sql
+as $$
+    with solicitados as (
+        select (item->>'id_producto')::integer as id_producto,
+               sum((item->>'cantidad')::integer)::integer as cantidad
+        from jsonb_array_elements(items) as item
+        group by 1
+    ),
+    bloqueados as (
+        select p.id_producto, p.stock
+        from producto p
+        join solicitados s on s.id_producto = p.id_producto
+        order by p.id_producto
+        for update of p
+    ),
+    actualizados as (
+        update producto p
+        set stock = greatest(0, b.stock - s.cantidad)
+        from bloqueados b
+        join solicitados s on s.id_producto = b.id_producto
+        where p.id_producto = b.id_producto
+        returning p.id_producto, b.stock as stock_anterior, p.stock as stock_nuevo
+    )
+    select s.id_producto,
+           s.cantidad,
+           a.stock_anterior,
+           a.stock_nuevo,
+           a.id_producto is not null as actualizado
+    from solicitados s
+    left join actualizados a on a.id_producto = s.id_producto
+    order by s.id_producto;
+$$;
@@ -0,0 +1,69 @@
+-- Aplica los efectos de la cola de la API (app/efectos.py) una sola vez.
+-- Cada efecto lleva un id que se registra en efectos_aplicados en la misma transacción que el
+-- efecto: si la API reenvía un efecto que ya se aplicó (timeout tras el commit, un worker de otro
+-- proceso que lo retomó), se omite. Requiere sql/descontar_stock.sql y sql/producto_ventas.sql.
+create table if not exists efectos_aplicados (
+    id text primary key,
+    aplicado_en timestamptz not null default now()
+);
+
+create index if not exists efectos_aplicados_aplicado_en_idx on efectos_aplicados (aplicado_en);
+
+-- Uso: supabase.rpc('aplicar_efectos_stock', {'efectos': [{'id': '<id>', 'items': [{'id_producto': 1, 'cantidad': 2}, ...]}, ...]})
+-- Devuelve lo mismo que descontar_stock para los productos de los efectos nuevos.
+create or replace function aplicar_efectos_stock(efectos jsonb)
+returns table (
+    id_producto integer,
+    cantidad integer,
+    stock_anterior integer,
+    stock_nuevo integer,
+    actualizado boolean
+)
+language plpgsql
+as $$
+declare
+    items jsonb;
+begin
+    -- Un reenvío concurrente del mismo efecto espera aquí a que el primero termine
+    with nuevos as (
+        insert into efectos_aplicados (id)
+        select efecto->>'id' from jsonb_array_elements(efectos) as efecto
+        on conflict do nothing
+        returning efectos_aplicados.id
+    )
+    select coalesce(jsonb_agg(item), '[]'::jsonb) into items
+    from jsonb_array_elements(efectos) as efecto
+    cross join jsonb_array_elements(efecto->'items') as item
+    where efecto->>'id' in (select n.id from nuevos n);
+
+    return query select * from descontar_stock(items);
+end;
+$$;
+
+-- Uso: supabase.rpc('aplicar_efectos_ventas', {'efectos': [{'id': '<id>', 'deltas': [{'id_producto': 1, 'delta': 3}, ...]}, ...]})
+-- Devuelve lo mismo que ajustar_ventas para los productos de los efectos nuevos.
+create or replace function aplicar_efectos_ventas(efectos jsonb)
+returns table (id_producto integer, total_vendido bigint)
+language plpgsql
+as $$
+declare
+    deltas jsonb;
+begin
+    with nuevos as (
+        insert into efectos_aplicados (id)
+        select efecto->>'id' from jsonb_array_elements(efectos) as efecto
+        on conflict do nothing
+        returning efectos_aplicados.id
+    )
+    select coalesce(jsonb_agg(item), '[]'::jsonb) into deltas
+    from jsonb_array_elements(efectos) as efecto
+    cross join jsonb_array_elements(efecto->'deltas') as item
+    where efecto->>'id' in (select n.id from nuevos n);
+
+    return query select * from ajustar_ventas(deltas);
+end;
+$$;
+
+-- Un efecto solo se reenvía mientras la API no registró la respuesta; para que la tabla no
+-- crezca, borrar los registros viejos periódicamente (por ejemplo con pg_cron):
+--   select cron.schedule('limpiar-efectos-aplicados', '0 * * * *', $$delete from efectos_aplicados where aplicado_en < now() - interval '1 day'$$);
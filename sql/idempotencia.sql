@@ -0,0 +1,17 @@
+-- Respuestas guardadas de los POST con Idempotency-Key, compartidas entre instancias.
+-- Solo se usa con IDEMPOTENCIA_ALMACEN=supabase; por defecto cada instancia las guarda en memoria.
+-- estado es null mientras la petición original sigue en curso.
+create table if not exists idempotencia (
+    clave text primary key,
+    huella text not null,
+    estado smallint,
+    cabeceras jsonb,
+    cuerpo text,
+    expira timestamptz not null
+);
+
+create index if not exists idempotencia_expira_idx on idempotencia (expira);
+
+-- Las filas vencidas se ignoran al leer; para que la tabla no crezca, borrarlas periódicamente
+-- (por ejemplo con pg_cron):
+--   select cron.schedule('limpiar-idempotencia', '*/15 * * * *', $$delete from idempotencia where expira < now()$$);
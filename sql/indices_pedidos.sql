@@ -0,0 +1,25 @@
+-- Índices para los filtros y el orden de GET /pedidos y GET /pedidos/export.
+-- Todos terminan en id_pedido porque la paginación por cursor ordena por (columna, id_pedido)
+-- y filtra con `columna > valor OR (columna = valor AND id_pedido > cursor)`: así Postgres
+-- recorre el índice desde el cursor en lugar de ordenar todas las filas filtradas.
+-- `create index concurrently` no bloquea las escrituras mientras se construye el índice
+-- (ejecutar cada sentencia por separado, fuera de una transacción).
+
+-- ?orden=fecha / -fecha y ?desde= / ?hasta= sin otros filtros
+create index concurrently if not exists pedido_fecha_id_idx on pedido (fecha, id_pedido);
+
+-- Filtros de igualdad más usados por el backoffice, combinados con el rango y el orden por fecha
+create index concurrently if not exists pedido_estado_fecha_idx on pedido (id_estado, fecha, id_pedido);
+create index concurrently if not exists pedido_estado_envio_fecha_idx on pedido (id_estado_envio, fecha, id_pedido);
+create index concurrently if not exists pedido_medio_pago_fecha_idx on pedido (medio_pago_id, fecha, id_pedido);
+
+-- GET /pedidos/cliente/{id_cliente}
+create index concurrently if not exists pedido_cliente_id_idx on pedido (id_cliente, id_pedido);
+
+-- Embebido pedido_producto en /pedidos/{id}/completo y /pedidos/export
+create index concurrently if not exists pedido_producto_pedido_idx on pedido_producto (id_pedido);
+
+-- Para comprobar que una consulta usa el índice:
+--   explain analyze select * from pedido
+--   where id_estado = 2 and fecha between '2025-01-01' and '2025-03-31'
+--   order by fecha, id_pedido limit 100;
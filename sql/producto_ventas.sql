@@ -0,0 +1,83 @@
+-- Agregado de unidades vendidas por producto, mantenido por la API en cada alta,
+-- cambio o baja de líneas de pedido_producto.
+create table if not exists producto_ventas (
+    id_producto integer primary key references producto (id_producto) on delete cascade,
+    total_vendido bigint not null default 0
+);
+
+create index if not exists producto_ventas_total_vendido_idx
+    on producto_ventas (total_vendido desc);
+
+-- Aplica variaciones de unidades vendidas y devuelve los totales resultantes.
+-- Uso: supabase.rpc('ajustar_ventas', {'deltas': [{'id_producto': 1, 'delta': 3}, ...]})
+create or replace function ajustar_ventas(deltas jsonb)
+returns table (id_producto integer, total_vendido bigint)
+language sql
+as $$
+    with d as (
+        select (item->>'id_producto')::integer as id_producto,
+               sum((item->>'delta')::bigint) as delta
+        from jsonb_array_elements(deltas) as item
+        group by 1
+    )
+    insert into producto_ventas as pv (id_producto, total_vendido)
+    select d.id_producto, greatest(0, d.delta)
+    from d
+    order by d.id_producto
+    on conflict (id_producto) do update
+        set total_vendido = greatest(0, pv.total_vendido + (
+            select d.delta from d where d.id_producto = excluded.id_producto
+        ))
+    returning pv.id_producto, pv.total_vendido;
+$$;
+
+-- Actualiza la línea de un pedido y devuelve la fila con la cantidad que tenía antes.
+-- Uso: supabase.rpc('actualizar_linea_pedido', {'pedido_id': 1, 'producto_id': 2, 'cambios': {'cantidad': 3}})
+-- La cantidad anterior se lee con la fila bloqueada, así que dos cambios concurrentes de la misma
+-- línea ven cada uno la cantidad que dejó el otro y sus deltas para ajustar_ventas suman bien.
+create or replace function actualizar_linea_pedido(pedido_id integer, producto_id integer, cambios jsonb)
+returns table (
+    id_pedido_producto integer,
+    id_pedido integer,
+    id_producto integer,
+    cantidad integer,
+    precio_unitario integer,
+    subtotal integer,
+    cantidad_anterior integer
+)
+language sql
+as $$
+    with anterior as (
+        select pp.id_pedido_producto, pp.cantidad
+        from pedido_producto pp
+        where pp.id_pedido = pedido_id and pp.id_producto = producto_id
+        for update
+    )
+    update pedido_producto pp
+    set cantidad = coalesce((cambios->>'cantidad')::integer, pp.cantidad),
+        precio_unitario = coalesce((cambios->>'precio_unitario')::integer, pp.precio_unitario),
+        subtotal = coalesce((cambios->>'subtotal')::integer, pp.subtotal)
+    from anterior a
+    where pp.id_pedido_producto = a.id_pedido_producto
+    returning pp.id_pedido_producto, pp.id_pedido, pp.id_producto, pp.cantidad,
+              pp.precio_unitario, pp.subtotal, a.cantidad;
+$$;
+
+-- Recalcula el agregado completo desde pedido_producto (backfill o corrección).
+-- Uso: python scripts/reconstruir_ventas.py
+create or replace function reconstruir_producto_ventas()
+returns integer
+language plpgsql
+as $$
+declare
+    filas integer;
+begin
+    delete from producto_ventas;
+    insert into producto_ventas (id_producto, total_vendido)
+    select pp.id_producto, sum(pp.cantidad)
+    from pedido_producto pp
+    group by pp.id_producto;
+    get diagnostics filas = row_count;
+    return filas;
+end;
+$$;
@@ -0,0 +1,8 @@
+-- Restricción UNIQUE sobre el rut de clientes y empleados.
+-- La usan POST /clientes/bulk y POST /empleados/bulk: cada lote es un insert con
+-- on_conflict=rut, que PostgREST solo acepta si existe una restricción única sobre la columna.
+-- Antes de aplicarla, verificar que no haya ruts repetidos:
+--   select rut, count(*) from cliente group by rut having count(*) > 1;
+--   select rut, count(*) from empleado group by rut having count(*) > 1;
+alter table cliente add constraint cliente_rut_key unique (rut);
+alter table empleado add constraint empleado_rut_key unique (rut);